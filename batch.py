@@ -0,0 +1,229 @@
+import os
+import re
+import json
+from datetime import datetime
+from scraper import run_scrape, independent_print, validate_hashtag
+from sinks import open_sinks, close_sinks
+from governor import RateLimited
+from watermarks import Watermark
+from parser import segment_rules
+from matcher import split_hashtags
+from constants import *
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+def load_jobs(path):
+    '''
+    Load a queue of scrape jobs from a YAML or JSON file.
+
+    The file holds a list of jobs, either at the top level or under a
+    "jobs" key. Each job has a "hashtag" and a "num_accounts", and
+    optionally a "secondary_hashtag", a "main_category", a
+    "backup_category" and an "output" path prefix.
+
+    Instead of the secondary hashtag, a job can have "segments": hashtag
+    rules by name, each either a list of hashtags (any of them) or a
+    dictionary with "any", "all" and "none" lists. Every segment gets
+    its own data files. Instead of the main and backup categories, a job
+    can have a list of "categories", and a list of "excluded_categories".
+
+    Args:
+        path (str): Path of the job file.
+    Returns:
+        list: The validated jobs as dictionaries.
+    Raises:
+        ValueError: If the file or one of its jobs is invalid.
+    '''
+    with open(path, encoding = "utf-8") as file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError(
+                    "PyYAML is required to read YAML job files."
+                )
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+
+    if isinstance(data, dict):
+        data = data.get("jobs")
+    if not isinstance(data, list):
+        raise ValueError(f"{path} doesn't contain a list of jobs.")
+
+    return [
+        validate_job(job, number)
+        for number, job in enumerate(data, start = 1)
+    ]
+
+def validate_job(job, number = 1):
+    '''
+    Validate a job of a job file and fill in its defaults.
+    Args:
+        job (dict): The job, see load_jobs.
+        number (int): The position of the job, used in error messages.
+    Returns:
+        dict: The validated job, with its filters under "filters".
+    Raises:
+        ValueError: If the job is invalid.
+    '''
+    if not isinstance(job, dict) or "hashtag" not in job:
+        raise ValueError(f"Job {number} has no hashtag.")
+
+    hashtag = str(job["hashtag"]).lstrip("#")
+    secondary_hashtag = job.get("secondary_hashtag") or ""
+    if isinstance(secondary_hashtag, list):
+        secondary_hashtag = " ".join(map(str, secondary_hashtag))
+    secondary_hashtag = str(secondary_hashtag).lstrip("#")
+    if not validate_hashtag(hashtag):
+        raise ValueError(f"Job {number} has an invalid hashtag.")
+
+    segments = job.get("segments") or {}
+    if not isinstance(segments, dict) or not all(
+        re.fullmatch(r"[\w-]+", str(name)) for name in segments
+    ):
+        raise ValueError(
+            f"Job {number} has invalid segments, they need names "
+            "made of letters, digits, '_' and '-'."
+        )
+
+    categories = job.get("categories")
+    excluded_categories = job.get("excluded_categories") or []
+    if not isinstance(categories, (list, type(None))) or \
+            not isinstance(excluded_categories, list):
+        raise ValueError(f"Job {number} has invalid categories.")
+
+    try:
+        num_accounts = int(job["num_accounts"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Job {number} has no valid num_accounts.")
+
+    try:
+        segment_rules({"segments": segments})
+    except ValueError as e:
+        raise ValueError(f"Job {number}: {e}")
+
+    return {
+        "hashtag": hashtag,
+        "num_accounts": num_accounts,
+        "filters": {
+            "hashtag": secondary_hashtag,
+            "main_category": str(job.get("main_category") or "").capitalize(),
+            "backup_category": str(job.get("backup_category") or "").capitalize(),
+            "segments": {str(name): rule for name, rule in segments.items()},
+            "categories": categories,
+            "excluded_categories": excluded_categories,
+        },
+        "output": job.get("output"),
+    }
+
+def output_prefix(job):
+    '''
+    Get a path prefix for a job's data files that doesn't clobber
+    the files of earlier jobs or runs.
+    Args:
+        job (dict): The job, as returned by load_jobs.
+    Returns:
+        str: The path prefix, without extension.
+    '''
+    prefix = job["output"]
+    if not prefix:
+        parts = [job["hashtag"]] + split_hashtags(job["filters"]["hashtag"])
+        prefix = "_".join(part for part in parts if part)
+        prefix += datetime.now().strftime("_%Y%m%d-%H%M%S")
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+
+    names = [""] + [f"_{name}" for name in job["filters"].get("segments") or {}]
+    candidate = prefix
+    suffix = 1
+    while any(
+        os.path.exists(f"{candidate}{name}{extension}")
+        for name in names
+        for extension in (".csv", ".json", ".jsonl")
+    ):
+        suffix += 1
+        candidate = f"{prefix}_{suffix}"
+
+    return candidate
+
+def run_jobs(driver, jobs, pool = None, engine = "browser", max_posts = HARVEST_LIMIT, recorder = None, db_path = None, discover = False, pipeline_workers = 0, incremental = False, refresh_days = 0, seen_store = None):
+    '''
+    Run a queue of scrape jobs back to back in one logged-in driver.
+    Args:
+        driver (WebDriver): The logged-in WebDriver object.
+        jobs (list): The jobs, as returned by load_jobs.
+        pool (DriverPool): Optional pool of browsers to scrape in parallel.
+        engine (str): "browser" or "http".
+        max_posts (int): Maximum number of posts harvested per job.
+        recorder (FixtureRecorder): Records every fetched post.
+        db_path (str): SQLite database every job's posts are upserted
+                       into instead of the CSV and JSON files.
+        discover (bool): Crawl the related hashtags most likely to yield
+                         matching accounts too.
+        pipeline_workers (int): Number of threads finishing the posts
+                                while the browser navigates.
+        incremental (bool): Only visit the posts taken since the previous
+                            crawl of each job's hashtag.
+        refresh_days (float): Number of days before the previous crawl's
+                              newest post whose posts are visited again.
+        seen_store (SeenStore): Store of the posts and accounts rejected
+                                by earlier jobs, skipped without fetching.
+    Returns:
+        list: The output path prefix of every job.
+    '''
+    prefixes = []
+
+    for number, job in enumerate(jobs, start = 1):
+        prefix = job["hashtag"] if db_path else output_prefix(job)
+        prefixes.append(prefix)
+        independent_print(
+            f"Job {number}/{len(jobs)}: #{job['hashtag']} -> {prefix}"
+        )
+
+        driver.get(f"{BASE_URL}/explore/tags/{job['hashtag']}/")
+
+        sinks = open_sinks(
+            prefix,
+            db_path = db_path,
+            segments = segment_rules(job["filters"]),
+            hashtag = job["hashtag"]
+        )
+        try:
+            accounts, total_duration, num_of_scrolls = run_scrape(
+                driver,
+                job["hashtag"],
+                job["num_accounts"],
+                job["filters"],
+                sinks,
+                pool = pool,
+                engine = engine,
+                max_posts = max_posts,
+                recorder = recorder,
+                discover = discover,
+                pipeline_workers = pipeline_workers,
+                watermark = Watermark(job["hashtag"], refresh_days)
+                            if incremental else None,
+                seen_store = seen_store
+            )
+        except ValueError as e:
+            # e.g. a hashtag without posts shouldn't stop the queue
+            independent_print(f"Job {number} failed: {e}")
+            continue
+        except RateLimited as e:
+            # but a throttled session would fail every next job too
+            independent_print(f"Job {number} stopped: {e} Skipping the rest.")
+            break
+        finally:
+            close_sinks(sinks, prefix)
+
+        independent_print(
+            f"Total duration of the loop: {total_duration:.2f} seconds\n"
+            f"Number of business accounts: {len(accounts)}\n"
+            f"Number of posts scrolled: {num_of_scrolls}"
+        )
+
+    return prefixes
@@ -0,0 +1,283 @@
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+import gzip
+import tracemalloc
+from collections import deque
+from itertools import cycle, islice
+from replay import load_fixtures, replay
+from sinks import open_sinks, close_sinks
+from payloads import decompress, parse_payload, brotli, zstandard
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+def synthetic_fixtures():
+    '''
+    Build a small set of recorded posts shaped like the real payloads,
+    for benchmarking without a recorded fixture file.
+    Returns:
+        list: The synthetic posts.
+    '''
+    categories = ["Restaurant", "Cafe", "Bakery", None]
+    fixtures = []
+
+    for i in range(16):
+        candidates = [
+            {
+                "width": width,
+                "height": width,
+                "url": f"https://scontent.cdninstagram.com/v/t51/{i}_{width}.jpg"
+            }
+            for width in (1080, 750, 640, 480, 320, 240, 150)
+        ]
+        fixtures.append({
+            "post_link": f"https://www.instagram.com/p/C{i:010d}/",
+            "user_link": f"https://www.instagram.com/user{i}/",
+            "date_of_pub": f"2023-08-{i % 28 + 1:02d}T12:00:00.000Z",
+            "user": {
+                "user": {
+                    "pk": str(1000 + i),
+                    "username": f"user{i}",
+                    "is_business": i % 3 != 0,
+                    "category": categories[i % len(categories)],
+                    "follower_count": 100 * i,
+                    "biography": "Fresh food every day " * 4,
+                }
+            },
+            "media": {
+                "items": [{
+                    "pk": str(3000000000000000000 + i),
+                    "code": f"C{i:010d}",
+                    "taken_at": 1691000000 + i,
+                    "like_count": 10 * i,
+                    "comment_count": i,
+                    "user": {"pk": str(1000 + i), "username": f"user{i}"},
+                    "caption": {
+                        "text": f"Lunch #food #foodie #city{i % 4} " + "yum " * 20
+                    },
+                    "image_versions2": {"candidates": candidates},
+                }]
+            },
+        })
+
+    return fixtures
+
+def scaled_dataset(fixtures, size, accounts = 1000):
+    '''
+    Yield `size` posts by cycling through the fixtures, spreading them
+    over `accounts` distinct usernames.
+    Args:
+        fixtures (list): The recorded posts.
+        size (int): Number of posts to yield.
+        accounts (int): Number of distinct accounts in the dataset.
+    Yields:
+        dict: One post at a time.
+    '''
+    for i, fixture in enumerate(islice(cycle(fixtures), size)):
+        user = dict(fixture["user"]["user"])
+        user["username"] = f"{user['username']}_{i % accounts}"
+        yield {
+            "post_link": f"{fixture['post_link']}{i}",
+            "user_link": fixture["user_link"],
+            "date_of_pub": fixture["date_of_pub"],
+            "user": {"user": user},
+            "media": fixture["media"],
+        }
+
+def run_replay(fixtures, size, filters, directory):
+    sinks = open_sinks(os.path.join(directory, f"bench_{size}"))
+    accounts, replayed = replay(
+        scaled_dataset(fixtures, size), sinks = sinks, **filters
+    )
+    close_sinks(sinks, os.path.join(directory, f"bench_{size}"))
+    return accounts, replayed
+
+def benchmark(fixtures, size, filters):
+    '''
+    Replay a dataset through the parse, filter and output path.
+    Args:
+        fixtures (list): The recorded posts.
+        size (int): Number of posts in the dataset.
+        filters (dict): The secondary hashtag and categories.
+    Returns:
+        dict: Throughput, retained allocations and peak memory.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        # cost of building the dataset, subtracted from the replay
+        start = time.perf_counter()
+        for _ in scaled_dataset(fixtures, size):
+            pass
+        generation = time.perf_counter() - start
+
+        gc.collect()
+        start = time.perf_counter()
+        accounts, replayed = run_replay(fixtures, size, filters, directory)
+        elapsed = time.perf_counter() - start - generation
+
+        # tracemalloc slows everything down, so memory is measured
+        # in a second run that isn't timed
+        del accounts
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        accounts, _ = run_replay(fixtures, size, filters, directory)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        retained = sys.getallocatedblocks() - blocks
+
+    return {
+        "posts": replayed,
+        "accounts": len(accounts),
+        "seconds": elapsed,
+        "posts_per_second": replayed / elapsed if elapsed > 0 else float("inf"),
+        "retained_blocks": retained,
+        "peak_memory_mib": peak / 2 ** 20,
+    }
+
+def compressors():
+    '''
+    Get the content encodings available to the decoding benchmark.
+    Returns:
+        dict: Compression functions by content encoding.
+    '''
+    available = {"identity": bytes, "gzip": gzip.compress}
+    if brotli is not None:
+        available["br"] = brotli.compress
+    if zstandard is not None:
+        available["zstd"] = zstandard.ZstdCompressor().compress
+    return available
+
+def benchmark_decoding(fixtures, size, encoding, max_pending = 256):
+    '''
+    Decode the recorded responses as captured bodies, once whole with
+    json.loads and once into the records of parse_payload. The last
+    `max_pending` posts are kept, like unclaimed payloads of a capture.
+    Args:
+        fixtures (list): The recorded posts.
+        size (int): Number of posts to decode.
+        encoding (str): The content encoding of the bodies.
+        max_pending (int): Number of decoded posts kept at a time.
+    Returns:
+        dict: Throughput and peak memory of both decoders.
+    '''
+    compress = compressors()[encoding]
+    bodies = [
+        (
+            compress(json.dumps(fixture["user"]).encode()),
+            compress(json.dumps(fixture["media"]).encode())
+        )
+        for fixture in fixtures
+    ]
+    decoders = {
+        "json": lambda kind, body: json.loads(decompress(body, encoding)),
+        "records": lambda kind, body: parse_payload(kind, body, encoding),
+    }
+
+    result = {"posts": size, "encoding": encoding}
+    for name, decode in decoders.items():
+        for traced in (False, True):
+            pending = deque(maxlen = max_pending)
+            gc.collect()
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            for user, media in islice(cycle(bodies), size):
+                pending.append((decode("user", user), decode("media", media)))
+            elapsed = time.perf_counter() - start
+            if traced:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                result[f"{name}_peak_memory_mib"] = peak / 2 ** 20
+            else:
+                result[f"{name}_posts_per_second"] = \
+                    size / elapsed if elapsed > 0 else float("inf")
+
+    return result
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description = "Benchmark the parse, filter and output path "
+                      "by replaying recorded posts."
+    )
+    arg_parser.add_argument(
+        "--fixtures",
+        help = "fixture file recorded with main.py --record "
+               "(synthetic posts are used if not given)"
+    )
+    arg_parser.add_argument(
+        "--sizes",
+        type = int,
+        nargs = "+",
+        default = DEFAULT_SIZES,
+        help = "numbers of posts to replay, e.g. 1000 10000 1000000"
+    )
+    arg_parser.add_argument("--hashtag", default = "")
+    arg_parser.add_argument("--main-category", default = "")
+    arg_parser.add_argument("--backup-category", default = "")
+    arg_parser.add_argument(
+        "--encoding",
+        default = "gzip",
+        choices = sorted(compressors()),
+        help = "content encoding of the bodies of the decoding benchmark"
+    )
+    arg_parser.add_argument(
+        "--json",
+        metavar = "FILE",
+        help = "also write the results to FILE as JSON"
+    )
+
+    return arg_parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.fixtures:
+        fixtures = list(load_fixtures(args.fixtures))
+    else:
+        fixtures = synthetic_fixtures()
+    filters = {
+        "hashtag": args.hashtag,
+        "main_category": args.main_category.capitalize(),
+        "backup_category": args.backup_category.capitalize(),
+    }
+
+    results = []
+    print(
+        f"{'posts':>10} {'accounts':>9} {'posts/s':>12} "
+        f"{'retained blocks':>16} {'peak MiB':>9}"
+    )
+    for size in args.sizes:
+        result = benchmark(fixtures, size, filters)
+        results.append(result)
+        print(
+            f"{result['posts']:>10} {result['accounts']:>9} "
+            f"{result['posts_per_second']:>12.0f} "
+            f"{result['retained_blocks']:>16} "
+            f"{result['peak_memory_mib']:>9.2f}"
+        )
+
+    decoding = []
+    print(
+        f"\n{'posts':>10} {'json posts/s':>13} {'records posts/s':>16} "
+        f"{'json MiB':>9} {'records MiB':>12}"
+    )
+    for size in args.sizes:
+        result = benchmark_decoding(fixtures, size, args.encoding)
+        decoding.append(result)
+        print(
+            f"{result['posts']:>10} "
+            f"{result['json_posts_per_second']:>13.0f} "
+            f"{result['records_posts_per_second']:>16.0f} "
+            f"{result['json_peak_memory_mib']:>9.2f} "
+            f"{result['records_peak_memory_mib']:>12.2f}"
+        )
+
+    if args.json:
+        with open(args.json, mode = "w", encoding = "utf-8") as file:
+            json.dump({"replay": results, "decoding": decoding}, file, indent = 4)
+
+if __name__ == "__main__":
+    main()
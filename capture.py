@@ -0,0 +1,243 @@
+import re
+import threading
+from collections import OrderedDict
+from payloads import decompress, parse_payload
+from governor import governor, is_throttle_response
+from constants import *
+
+def shortcode_from_url(url):
+    '''
+    Extract the post shortcode from a post URL.
+    Args:
+        url (str): The post URL, e.g. "https://www.instagram.com/p/Cx1a2b3/".
+    Returns:
+        str: The shortcode, or an empty string if the URL is not a post URL.
+    '''
+    match = re.search(r"/(?:p|reel)/([A-Za-z0-9_-]+)", url)
+    return match.group(1) if match else ""
+
+def shortcode_to_media_id(shortcode):
+    '''
+    Convert a post shortcode to the numeric media id used by the API.
+    Args:
+        shortcode (str): The post shortcode.
+    Returns:
+        str: The media id as a string.
+    '''
+    # Private posts append extra characters after the 11 encoded ones
+    media_id = 0
+    for char in shortcode[:11]:
+        media_id = media_id * 64 + SHORTCODE_ALPHABET.index(char)
+
+    return str(media_id)
+
+class ResponseCapture:
+    '''
+    Collect media and user info payloads as the browser receives them.
+
+    The capture is installed as selenium-wire's response interceptor,
+    so bodies are collected on the proxy thread as soon as they arrive
+    instead of being polled for after the fact. Payloads are decoded
+    right away and only their records of parse_payload are kept, keyed
+    by media id / user id, and user info by username too, until the
+    scrape loop claims them.
+
+    Args:
+        max_pending (int): Maximum number of unclaimed payloads kept
+                           per kind. The oldest ones are dropped first.
+    '''
+    PATTERNS = {
+        "media": re.compile(MEDIA_INFO_PATTERN),
+        "user": re.compile(USER_INFO_PATTERN),
+    }
+    API_RE = re.compile(API_PATTERN)
+
+    def __init__(self, max_pending = 256):
+        self.max_pending = max_pending
+        self._payloads = {kind: OrderedDict() for kind in self.PATTERNS}
+        self._condition = threading.Condition()
+        # throttling responses of this browser, unlike the governor's
+        # count of the whole session
+        self.throttle_events = 0
+
+    def attach(self, driver):
+        '''
+        Install the capture as the driver's response interceptor.
+        Args:
+            driver (WebDriver): The selenium-wire WebDriver object.
+        Returns:
+            ResponseCapture: The capture itself, for chaining.
+        '''
+        driver.response_interceptor = self.intercept
+        return self
+
+    def intercept(self, request, response):
+        '''
+        Response interceptor called by selenium-wire for every response.
+        Args:
+            request (Request): The captured request.
+            response (Response): The response to that request.
+        '''
+        if governor.enabled and self.API_RE.search(request.url):
+            self.report(request, response)
+
+        for kind, pattern in self.PATTERNS.items():
+            match = pattern.search(request.url)
+            if match:
+                break
+        else:
+            return
+
+        if response.status_code != 200:
+            return
+
+        try:
+            payload = parse_payload(
+                kind,
+                response.body,
+                response.headers.get('Content-Encoding', 'identity')
+            )
+        except ValueError:
+            return
+
+        self.put(kind, match.group(1), payload)
+
+        # user info is also looked up by username, which the page
+        # shows before the user id is known
+        if kind == "user":
+            username = payload["user"]["username"]
+            if username:
+                self.put(kind, username, payload)
+
+    def report(self, request, response):
+        '''
+        Report the status and latency of an API response to the governor.
+        Args:
+            request (Request): The captured request.
+            response (Response): The response to that request.
+        '''
+        body = b""
+        if response.status_code >= 400:
+            try:
+                body = decompress(
+                    response.body,
+                    response.headers.get('Content-Encoding', 'identity')
+                )
+            except ValueError:
+                pass
+
+        latency = None
+        if getattr(request, "date", None) and getattr(response, "date", None):
+            latency = (response.date - request.date).total_seconds()
+
+        throttled = is_throttle_response(response.status_code, body)
+        if throttled:
+            with self._condition:
+                self.throttle_events += 1
+        governor.observe(throttled, latency)
+
+    def put(self, kind, key, payload):
+        '''
+        Store a decoded payload and wake up anyone waiting for it.
+        Args:
+            kind (str): Either "media" or "user".
+            key (str): The media id or user id.
+            payload (dict): The payload's record, see parse_payload.
+        '''
+        with self._condition:
+            pending = self._payloads[kind]
+            pending[key] = payload
+            pending.move_to_end(key)
+            while len(pending) > self.max_pending:
+                pending.popitem(last = False)
+            self._condition.notify_all()
+
+    def wait_for(self, kind, key, timeout = RESPONSE_TIMEOUT):
+        '''
+        Block until the payload for the given key has been captured.
+        Args:
+            kind (str): Either "media" or "user".
+            key (str): The media id or user id.
+            timeout (float): Maximum number of seconds to wait.
+        Returns:
+            dict: The payload's record, see parse_payload.
+        Raises:
+            TimeoutError: If the payload does not arrive in time.
+        '''
+        key = str(key)
+        pending = self._payloads[kind]
+
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: key in pending, timeout
+            ):
+                raise TimeoutError(f"No {kind} info received for {key}")
+            return pending.pop(key)
+
+    def clear(self):
+        '''
+        Drop every unclaimed payload.
+        '''
+        with self._condition:
+            for pending in self._payloads.values():
+                pending.clear()
+
+def lean_seleniumwire_options():
+    '''
+    Selenium-wire options of the lean capture mode: requests are kept
+    in memory only, and only the most recent ones.
+    Returns:
+        dict: Options for the seleniumwire_options argument.
+    '''
+    return {
+        "request_storage": "memory",
+        "request_storage_max_size": LEAN_STORAGE_MAX_SIZE,
+    }
+
+def apply_lean_capture(driver):
+    '''
+    Restrict the capture to the API calls the scraper reads and stop the
+    browser from downloading images and videos.
+
+    Heavy media is blocked inside Chrome through the DevTools protocol
+    rather than aborted by a request interceptor: interceptors only see
+    in-scope requests, and blocked requests never reach the proxy at all.
+    The driver is marked with `lean_capture`, so the tabs opened later
+    can be blocked too, see block_heavy_media.
+
+    Args:
+        driver (WebDriver): The selenium-wire Chrome WebDriver object.
+    '''
+    driver.scopes = CAPTURE_SCOPES
+    block_heavy_media(driver)
+    driver.lean_capture = True
+
+def block_heavy_media(driver):
+    '''
+    Stop the current tab of the browser from downloading images and videos.
+    The blocking only applies to the tab it was set in.
+    Args:
+        driver (WebDriver): The selenium-wire Chrome WebDriver object.
+    '''
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd(
+        "Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS}
+    )
+
+def page_transfer_bytes(driver):
+    '''
+    Get the number of bytes the page transferred since the last call,
+    from the browser's resource timing entries.
+    Args:
+        driver (WebDriver): The WebDriver object.
+    Returns:
+        int: The transferred bytes.
+    '''
+    return driver.execute_script(
+        "var entries = performance.getEntriesByType('resource')"
+        ".concat(performance.getEntriesByType('navigation'));"
+        "var total = 0;"
+        "entries.forEach(function (e) { total += e.transferSize || 0; });"
+        "performance.clearResourceTimings();"
+        "return total;"
+    )
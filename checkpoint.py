@@ -0,0 +1,139 @@
+import os
+import json
+from parser import Account
+from constants import *
+
+def checkpoint_path(hashtag):
+    '''
+    Get the path of a hashtag's checkpoint file.
+    Args:
+        hashtag (str): The main hashtag.
+    Returns:
+        str: The path of the checkpoint file.
+    '''
+    return f"{hashtag}.checkpoint.json"
+
+class Checkpoint:
+    '''
+    Progress of a hashtag crawl that can be saved and resumed.
+
+    Holds the shortcodes of the posts already processed, the accepted
+    accounts, the number of posts scrolled and the filters of the run.
+    It is saved every `every` posts and whenever the loop stops, together
+    with the size of the data files at that point: rows a sink wrote
+    after the last save are cut off on resume, as their posts are
+    visited and written again.
+
+    Args:
+        path (str): Path of the checkpoint file.
+        filters (dict): The secondary hashtag and categories of the run.
+        num_accounts (int): The number of business accounts to scrape.
+        every (int): Number of processed posts between two saves.
+    '''
+    def __init__(self, path, filters, num_accounts, every = CHECKPOINT_EVERY):
+        self.path = path
+        self.filters = filters
+        self.num_accounts = num_accounts
+        self.every = every
+        self.visited = set()
+        self.accounts = {}
+        self.scrolls = 0
+        # size of the data files at the last save, by path
+        self.outputs = {}
+        self._unsaved = 0
+
+    @classmethod
+    def load(cls, path, every = CHECKPOINT_EVERY):
+        '''
+        Load a saved checkpoint.
+        Args:
+            path (str): Path of the checkpoint file.
+            every (int): Number of processed posts between two saves.
+        Returns:
+            Checkpoint: The restored checkpoint, or None if there is none.
+        '''
+        if not os.path.exists(path):
+            return None
+
+        with open(path, encoding = "utf-8") as file:
+            data = json.load(file)
+
+        checkpoint = cls(path, data["filters"], data["num_accounts"], every)
+        checkpoint.visited = set(data["visited"])
+        checkpoint.scrolls = data["scrolls"]
+        checkpoint.outputs = data.get("outputs", {})
+        checkpoint.accounts = {
+            username: Account.from_dict(account)
+            for username, account in data["accounts"].items()
+        }
+
+        return checkpoint
+
+    def is_visited(self, shortcode):
+        '''
+        Check if a post was already processed.
+        Args:
+            shortcode (str): The shortcode of the post.
+        Returns:
+            bool: True if the post was processed before.
+        '''
+        return shortcode in self.visited
+
+    def record(self, shortcode, scrolls, sinks = None):
+        '''
+        Record a processed post and save the checkpoint when it's due.
+        Args:
+            shortcode (str): The shortcode of the processed post.
+            scrolls (int): The number of posts scrolled so far.
+            sinks (list): Output sinks to make durable before saving.
+        '''
+        self.visited.add(shortcode)
+        self.scrolls = scrolls
+        self._unsaved += 1
+
+        if self._unsaved >= self.every:
+            self.save(sinks)
+
+    def save(self, sinks = None):
+        '''
+        Write the checkpoint to disk, atomically.
+        Args:
+            sinks (list): Output sinks to make durable first, so the
+                          saved progress never runs ahead of the output.
+        '''
+        for sink in sinks or []:
+            self.outputs.update(sink.checkpoint())
+
+        data = {
+            "filters": self.filters,
+            "num_accounts": self.num_accounts,
+            "scrolls": self.scrolls,
+            "visited": sorted(self.visited),
+            "accounts": self.accounts,
+            "outputs": self.outputs,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, mode = "w", encoding = "utf-8") as file:
+            json.dump(data, file, default = lambda x: x.to_dict())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+
+    def rewind_outputs(self):
+        '''
+        Cut the data files back to their size at the last save, before
+        they are appended to on resume, so the posts processed after
+        it aren't written twice.
+        '''
+        for path, size in self.outputs.items():
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, mode = "r+b") as file:
+                    file.truncate(size)
+
+    def remove(self):
+        '''
+        Delete the checkpoint file once the crawl is complete.
+        '''
+        if os.path.exists(self.path):
+            os.remove(self.path)
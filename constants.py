@@ -22,4 +22,106 @@ USERNAME_XPATH = ".*?/api/v1/users/.*?/info"
 MEDIA_XPATH = ".*?/api/v1/media/.*?/info"
 
 # Base URL
-BASE_URL = "https://www.instagram.com"
\ No newline at end of file
+BASE_URL = "https://www.instagram.com"
+
+# API endpoints captured by the response interceptor.
+# The first group is the media id / user id the payload belongs to.
+MEDIA_INFO_PATTERN = r"/api/v1/media/(\d+)/info"
+USER_INFO_PATTERN = r"/api/v1/users/(\d+)/info"
+
+# Alphabet used by Instagram to encode media ids as post shortcodes
+SHORTCODE_ALPHABET = (
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+)
+
+# Seconds to wait for a captured API response before skipping the post
+RESPONSE_TIMEOUT = 10
+
+# User info cache
+USER_CACHE_PATH = "user_cache.sqlite3"
+USER_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+USER_CACHE_LRU_SIZE = 4096
+
+# Rejected posts and accounts
+SEEN_STORE_PATH = "seen.sqlite3"
+SEEN_STORE_TTL = 30 * 24 * 60 * 60  # seconds
+SEEN_BLOOM_CAPACITY = 100000  # rejections
+SEEN_BLOOM_ERROR_RATE = 0.01
+
+# Browserless HTTP engine
+API_APP_ID = "936619743392459"
+TAG_SECTIONS_URL = "/api/v1/tags/{tag}/sections/"
+MEDIA_INFO_URL = "/api/v1/media/{media_id}/info/"
+USER_INFO_URL = "/api/v1/users/{user_id}/info/"
+HTTP_CONCURRENCY = 8
+
+# Checkpoints
+CHECKPOINT_EVERY = 25  # posts
+
+# Grid harvesting
+HARVEST_LIMIT = 500  # posts
+HARVEST_IDLE_SCROLLS = 3
+HARVEST_COVERED_SCROLLS = 2  # scrolls showing only crawled posts before stopping
+TAG_SECTIONS_PATTERN = r"/api/v1/tags/(?:web_info|[^/]+/sections)"
+
+# Saved browser session
+SESSION_PATH = "session.json"
+SESSION_COOKIE = "sessionid"
+SESSION_CHECK_URL = "/api/v1/accounts/edit/web_form_data/"  # needs a login
+LOGIN_TIMEOUT = 60
+
+# Lean capture mode
+CAPTURE_SCOPES = [MEDIA_XPATH, USERNAME_XPATH, ".*?/api/v1/tags/.*"]
+BLOCKED_URL_PATTERNS = [
+    "*.jpg*", "*.jpeg*", "*.png*", "*.webp*", "*.gif*", "*.heic*",
+    "*.mp4*", "*.m4s*", "*.m4a*", "*.webm*",
+]
+LEAN_STORAGE_MAX_SIZE = 100  # requests
+
+# A '#' followed by anything up to whitespace or punctuation,
+# trimmed to the hashtag's letters, marks, digits and underscores
+HASHTAG_PATTERN = r"#([^\s!-/:-@\[-^`{-~\u3000-\u303f\uff01-\uff0f]+)"
+
+# Discovery crawl
+DISCOVERY_BATCH = 24  # posts visited on a hashtag page before rescheduling
+DISCOVERY_PRIOR_WEIGHT = 10  # posts the co-occurrence estimate is worth
+DISCOVERY_MIN_ACCEPTED = 2  # accepted captions before a hashtag is crawled
+DISCOVERY_MAX_TAGS = 50  # hashtag pages opened per job
+
+# Pipelined scraping
+PIPELINE_WORKERS = 2  # threads decoding, filtering and writing posts
+PIPELINE_QUEUE_SIZE = 16  # posts waiting for a worker
+
+# Rate governor
+API_PATTERN = r"/api/v1/|/graphql"
+THROTTLE_MARKERS = [b"please wait a few minutes", b"try again later", b"rate limit"]
+GOVERNOR_RATE = 0.5  # posts or requests per second to start with
+GOVERNOR_MIN_RATE = 0.05
+GOVERNOR_MAX_RATE = 5
+GOVERNOR_BURST = 3  # tokens the bucket holds
+GOVERNOR_INCREASE = 0.05  # added to the rate, divided by the rate, per success
+GOVERNOR_DECREASE = 0.5  # rate multiplier on throttling
+GOVERNOR_SLOW_DECREASE = 0.9  # rate multiplier on slow responses
+GOVERNOR_SLOW_LATENCY = 5  # seconds
+GOVERNOR_BACKOFF_BASE = 15  # seconds
+GOVERNOR_BACKOFF_MAX = 900  # seconds
+GOVERNOR_MAX_RETRIES = 5
+GOVERNOR_TIMEOUT_FACTOR = 4  # wait timeouts in multiples of the mean latency
+GOVERNOR_MIN_TIMEOUT = 3  # seconds
+
+# Driver recycling
+RECYCLE_EVERY = 500  # posts
+RECYCLE_MAX_RSS = 2048  # MiB of the Chrome process tree
+RECYCLE_CHECK_EVERY = 10  # posts between two memory measurements
+
+# Payload decoding
+DECODE_CHUNK_SIZE = 64 * 1024  # bytes fed to the decompressors at a time
+
+# Incremental recrawls
+WATERMARKS_PATH = "watermarks.json"
+
+# Service mode
+SERVICE_HOST = "127.0.0.1"  # only reachable from this machine
+SERVICE_PORT = 8765
+SERVICE_JOB_EVENTS = 1000  # latest events kept per job for the clients
+SERVICE_FINISHED_JOBS = 100  # finished jobs kept for their status
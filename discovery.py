@@ -0,0 +1,159 @@
+import threading
+from collections import Counter, defaultdict
+from matcher import normalize_hashtag
+from constants import *
+
+class CooccurrenceIndex:
+    '''
+    Incremental index of the hashtags of the captions checked during a
+    job: which hashtags appear together, how often captions with a
+    hashtag were accepted, and how many new accounts every crawled
+    hashtag page yielded per post visited.
+
+    Captions are only checked once the user stage passed, so the accept
+    rates are relative to the posts of matching business accounts.
+    '''
+    def __init__(self):
+        self.cooccurrences = defaultdict(Counter)
+        self.captions = Counter()
+        self.accepted = Counter()
+        self.visits = Counter()
+        self.hits = Counter()
+        self.total_captions = 0
+        self.total_accepted = 0
+        self.total_visits = 0
+        self.total_hits = 0
+        self._lock = threading.Lock()
+
+    def observe(self, hashtags, accepted):
+        '''
+        Add the hashtags of a checked caption.
+        Args:
+            hashtags (set): The normalized hashtags of the caption.
+            accepted (bool): True if the post passed every filter.
+        '''
+        with self._lock:
+            self.total_captions += 1
+            self.total_accepted += accepted
+            for hashtag in hashtags:
+                self.captions[hashtag] += 1
+                self.accepted[hashtag] += accepted
+                related = self.cooccurrences[hashtag]
+                for other in hashtags:
+                    if other != hashtag:
+                        related[other] += 1
+
+    def record_visit(self, hashtag, hit):
+        '''
+        Record a post visited from a hashtag page.
+        Args:
+            hashtag (str): The hashtag whose page the post was found on.
+            hit (bool): True if the post added a new account.
+        '''
+        hashtag = normalize_hashtag(hashtag)
+        with self._lock:
+            self.visits[hashtag] += 1
+            self.hits[hashtag] += hit
+            self.total_visits += 1
+            self.total_hits += hit
+
+    def related(self, hashtag, limit = 10):
+        '''
+        Get the hashtags that appear most often together with a hashtag.
+        Args:
+            hashtag (str): The hashtag.
+            limit (int): Maximum number of hashtags returned.
+        Returns:
+            list: (hashtag, count) tuples, most frequent first.
+        '''
+        with self._lock:
+            return self.cooccurrences[normalize_hashtag(hashtag)].most_common(limit)
+
+    def expected_yield(self, hashtag, prior_weight = DISCOVERY_PRIOR_WEIGHT):
+        '''
+        Estimate the number of new accounts found per post visited on
+        a hashtag's page.
+
+        Hashtags not crawled yet are estimated from the captions they
+        appeared in: the overall yield, scaled by how much more often
+        than average their captions were accepted. The estimate counts
+        as `prior_weight` visits and is replaced by the measured yield
+        as the page is crawled.
+
+        Args:
+            hashtag (str): The hashtag.
+            prior_weight (int): Number of visits the estimate is worth.
+        Returns:
+            float: The expected new accounts per post visited.
+        '''
+        hashtag = normalize_hashtag(hashtag)
+        with self._lock:
+            base_yield = (self.total_hits + 1) / (self.total_visits + 2)
+            base_rate = (self.total_accepted + 1) / (self.total_captions + 2)
+            rate = (self.accepted[hashtag] + base_rate * prior_weight) / \
+                (self.captions[hashtag] + prior_weight)
+            prior = base_yield * rate / base_rate
+
+            return (self.hits[hashtag] + prior * prior_weight) / \
+                (self.visits[hashtag] + prior_weight)
+
+    def candidates(self, min_accepted = DISCOVERY_MIN_ACCEPTED):
+        '''
+        Get the hashtags seen in enough accepted captions to be crawled.
+        Args:
+            min_accepted (int): Minimum number of accepted captions.
+        Returns:
+            list: The hashtags.
+        '''
+        with self._lock:
+            return [
+                hashtag for hashtag, count in self.accepted.items()
+                if count >= min_accepted
+            ]
+
+class TagFrontier:
+    '''
+    Schedule the hashtag pages of a discovery crawl: the next page is
+    the one with the highest expected yield of new matching accounts
+    per post visited, among the seeds and the hashtags found in
+    accepted captions.
+
+    Args:
+        index (CooccurrenceIndex): The index of the job's captions.
+        seeds (list): The hashtags the crawl starts from.
+        max_tags (int): Maximum number of hashtag pages opened.
+    '''
+    def __init__(self, index, seeds, max_tags = DISCOVERY_MAX_TAGS):
+        self.index = index
+        self.seeds = [normalize_hashtag(seed) for seed in seeds]
+        self.max_tags = max_tags
+        self.opened = set()
+        self.exhausted = set()
+
+    def next_tag(self):
+        '''
+        Pick the hashtag page to crawl next.
+        Returns:
+            str: The hashtag, or None if there is nothing left to crawl.
+        '''
+        candidates = [
+            hashtag
+            for hashtag in self.seeds + self.index.candidates()
+            if hashtag not in self.exhausted and (
+                hashtag in self.opened or len(self.opened) < self.max_tags
+            )
+        ]
+        if not candidates:
+            return None
+
+        hashtag = max(candidates, key = self.index.expected_yield)
+        self.opened.add(hashtag)
+        return hashtag
+
+    def exhaust(self, hashtag):
+        '''
+        Stop crawling a hashtag page, e.g. once it has no new posts.
+        Args:
+            hashtag (str): The hashtag.
+        '''
+        self.exhausted.add(normalize_hashtag(hashtag))
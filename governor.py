@@ -0,0 +1,187 @@
+import time
+import random
+import asyncio
+import threading
+from metrics import metrics
+from constants import *
+
+class RateLimited(Exception):
+    '''
+    Raised when the session is still throttled after every retry.
+    '''
+
+def is_throttle_response(status_code, body = b""):
+    '''
+    Tell a rate-limiting response from a regular one.
+    Args:
+        status_code (int): The HTTP status code of the response.
+        body (bytes): The decoded body of the response.
+    Returns:
+        bool: True if the response asks the client to slow down.
+    '''
+    if status_code == 429:
+        return True
+    if status_code >= 400 and body:
+        body = body[:1024].lower()
+        return any(marker in body for marker in THROTTLE_MARKERS)
+    return False
+
+class RateGovernor:
+    '''
+    Pace the requests of a session to the highest rate that doesn't get
+    it throttled.
+
+    Requests take tokens from a bucket refilled at the current rate.
+    The rate grows additively with every successful response and is cut
+    multiplicatively on throttling, which also blocks the bucket for an
+    exponential backoff with jitter. Slow responses cut the rate a
+    little without blocking. The mean latency also sets the timeouts of
+    the waits for elements and responses.
+
+    While disabled, acquire and observe return immediately and the
+    timeouts are the fixed default.
+
+    Args:
+        enabled (bool): Whether requests are paced.
+        rate (float): Requests per second to start with.
+    '''
+    def __init__(self, enabled = False, rate = GOVERNOR_RATE):
+        self.enabled = enabled
+        self.rate = rate
+        self.throttle_events = 0
+        self.strikes = 0
+        self.latency = None
+        self._tokens = GOVERNOR_BURST
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def enable(self, rate = GOVERNOR_RATE):
+        '''
+        Start pacing requests.
+        Args:
+            rate (float): Requests per second to start with.
+        '''
+        self.rate = rate
+        self.enabled = True
+
+    def _refill(self, now):
+        self._tokens = min(
+            GOVERNOR_BURST, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self):
+        '''
+        Take a token from the bucket.
+        Returns:
+            float: Number of seconds to wait before sending the request.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(
+                self._blocked_until - now,
+                -self._tokens / self.rate if self._tokens < 0 else 0
+            )
+        return delay
+
+    def acquire(self):
+        '''
+        Block until the next request may be sent.
+        '''
+        if not self.enabled:
+            return
+        delay = self.reserve()
+        if delay > 0:
+            metrics.observe("governor_wait", delay)
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        '''
+        Wait until the next request may be sent, without blocking the loop.
+        '''
+        if not self.enabled:
+            return
+        delay = self.reserve()
+        if delay > 0:
+            metrics.observe("governor_wait", delay)
+            await asyncio.sleep(delay)
+
+    def observe(self, throttled, latency = None):
+        '''
+        Adjust the rate to the outcome of a response.
+        Args:
+            throttled (bool): True if the response was a throttling one.
+            latency (float): Seconds between the request and the response.
+        '''
+        if not self.enabled:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if throttled:
+                self.throttle_events += 1
+                self.strikes += 1
+                self.rate = max(GOVERNOR_MIN_RATE, self.rate * GOVERNOR_DECREASE)
+                backoff = min(
+                    GOVERNOR_BACKOFF_MAX,
+                    GOVERNOR_BACKOFF_BASE * 2 ** (self.strikes - 1)
+                ) * random.uniform(0.5, 1.5)
+                self._blocked_until = max(self._blocked_until, now + backoff)
+                self._refill(now)
+                self._tokens = min(self._tokens, 0)
+                metrics.increment("throttled_responses")
+                return
+
+            if latency is not None:
+                self.latency = latency if self.latency is None else \
+                    0.8 * self.latency + 0.2 * latency
+                if latency > GOVERNOR_SLOW_LATENCY:
+                    self.rate = max(
+                        GOVERNOR_MIN_RATE, self.rate * GOVERNOR_SLOW_DECREASE
+                    )
+                    return
+
+            # responses still in flight when throttled don't end the backoff
+            if now >= self._blocked_until:
+                self.strikes = 0
+            self.rate = min(
+                GOVERNOR_MAX_RATE, self.rate + GOVERNOR_INCREASE / self.rate
+            )
+
+    def throttled(self):
+        '''
+        Check if the session is backing off from throttling.
+        Returns:
+            bool: True until the backoff is over.
+        '''
+        return self.enabled and time.monotonic() < self._blocked_until
+
+    def wait_out(self):
+        '''
+        Block until the backoff is over.
+        '''
+        delay = self._blocked_until - time.monotonic()
+        if self.enabled and delay > 0:
+            metrics.observe("governor_wait", delay)
+            time.sleep(delay)
+
+    def timeout(self, default = RESPONSE_TIMEOUT):
+        '''
+        Get the timeout of the waits for elements and responses.
+        Args:
+            default (float): The timeout without any measured latency.
+        Returns:
+            float: A multiple of the mean latency, between the minimum
+                   timeout and the default one.
+        '''
+        if not self.enabled or self.latency is None:
+            return default
+        return min(
+            default,
+            max(GOVERNOR_MIN_TIMEOUT, self.latency * GOVERNOR_TIMEOUT_FACTOR)
+        )
+
+governor = RateGovernor()
@@ -0,0 +1,293 @@
+import re
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+from capture import shortcode_from_url, block_heavy_media
+from payloads import loads, decompress
+from governor import governor, RateLimited
+from constants import *
+
+# Collects every post link of the grid in a single WebDriver round trip
+POST_LINKS_SCRIPT = (
+    "return Array.from(document.querySelectorAll(\"a[href*='/p/']\"))"
+    ".map(function (a) { return a.href; });"
+)
+SCROLL_SCRIPT = (
+    "window.scrollTo(0, document.body.scrollHeight);"
+    "return document.body.scrollHeight;"
+)
+
+class PostFrontier:
+    '''
+    Deduplicated, ordered collection of post URLs waiting to be visited.
+    Posts are identified by their shortcode, so the same post reached
+    through different URLs is kept only once.
+
+    Args:
+        limit (int): Maximum number of posts the frontier accepts.
+        since (int): Unix timestamp posts taken before are left out,
+                     as far as the grid responses tell their dates.
+    '''
+    def __init__(self, limit = HARVEST_LIMIT, since = None):
+        self.limit = limit
+        self.since = since
+        # the grid stopped growing because of throttling, not its end
+        self.rate_limited = False
+        # the grid reached the posts taken before `since`
+        self.covered = False
+        # number of posts left out for being taken before `since`
+        self.older = 0
+        # taken_at of the grid's posts by shortcode
+        self.dates = {}
+        self._posts = {}
+        self._skipped = set()
+
+    def __len__(self):
+        return len(self._posts)
+
+    def __iter__(self):
+        return iter(self._posts.values())
+
+    def is_full(self):
+        '''
+        Check if the frontier reached its limit.
+        Returns:
+            bool: True if no more posts are accepted.
+        '''
+        return len(self._posts) >= self.limit
+
+    def skip(self, shortcode):
+        '''
+        Exclude a post from the frontier, e.g. a collaborative one.
+        Args:
+            shortcode (str): The shortcode of the post.
+        '''
+        self._skipped.add(shortcode)
+        self._posts.pop(shortcode, None)
+
+    def add(self, url):
+        '''
+        Add a post URL if it is new, not skipped and the limit allows it.
+        Args:
+            url (str): The post URL.
+        Returns:
+            str: The normalized URL of the post if it was added, else None.
+        '''
+        shortcode = shortcode_from_url(url)
+        if not shortcode or shortcode in self._posts or \
+                shortcode in self._skipped or self.is_full():
+            return None
+
+        if self.is_older(shortcode):
+            self.skip(shortcode)
+            self.older += 1
+            return None
+
+        link = self._posts[shortcode] = f"{BASE_URL}/p/{shortcode}/"
+        return link
+
+    def is_older(self, shortcode):
+        '''
+        Check if a post was taken before `since`.
+        Args:
+            shortcode (str): The shortcode of the post.
+        Returns:
+            bool: True if the post is known to be older.
+        '''
+        taken_at = self.dates.get(shortcode)
+        return self.since is not None and taken_at is not None and \
+            taken_at < self.since
+
+    def post_dates(self):
+        '''
+        Get the dates of the posts to visit, as far as they are known.
+        Returns:
+            dict: The taken_at of the posts by shortcode.
+        '''
+        return {
+            shortcode: self.dates[shortcode]
+            for shortcode in self._posts if shortcode in self.dates
+        }
+
+    def observe(self, medias):
+        '''
+        Record the dates of the grid's posts, and leave out the
+        collaborative ones and, once their date is known, the older ones.
+        Args:
+            medias (list): Media dictionaries of the grid responses.
+        '''
+        for media in medias:
+            shortcode = media.get("code")
+            if not shortcode:
+                continue
+            if media.get("taken_at"):
+                self.dates[shortcode] = media["taken_at"]
+            if media.get("coauthor_producers"):
+                self.skip(shortcode)
+            elif shortcode in self._posts and self.is_older(shortcode):
+                self.skip(shortcode)
+
+def grid_medias(driver):
+    '''
+    Read the posts of the grid responses captured so far.
+    Args:
+        driver (WebDriver): The selenium-wire WebDriver object.
+    Returns:
+        list: The media dictionaries of the posts, with their shortcode
+              ("code"), "taken_at" and "coauthor_producers".
+    '''
+    pattern = re.compile(TAG_SECTIONS_PATTERN)
+    medias = []
+
+    for request in driver.requests:
+        if not pattern.search(request.url) or request.response is None:
+            continue
+        try:
+            page = loads(
+                decompress(
+                    request.response.body,
+                    request.response.headers.get('Content-Encoding', 'identity')
+                )
+            )
+        except ValueError:
+            continue
+
+        # web_info nests the sections one level deeper
+        sections = page.get("sections", [])
+        for tab in page.get("data", {}).values():
+            if isinstance(tab, dict):
+                sections = sections + tab.get("sections", [])
+
+        for section in sections:
+            for media in section.get("layout_content", {}).get("medias", []):
+                medias.append(media.get("media", {}))
+
+    return medias
+
+def iter_post_links(driver, frontier, idle_scrolls = HARVEST_IDLE_SCROLLS, new_tab = False):
+    '''
+    Scroll the hashtag grid and yield its post links as they show up,
+    so the first posts can be visited before the grid is exhausted.
+    Collaborative posts are left out when the grid responses show them.
+    Scrolls without new posts while the session is throttled wait for
+    the governor's backoff instead of counting towards the end of the grid.
+    With the frontier's `since`, older posts are left out too, and the
+    scrolling stops once only older posts show up.
+
+    With `new_tab`, the posts are meant to be visited in a second tab,
+    so the grid keeps its scroll position: the links are yielded while
+    that tab is the current one, and the grid's tab is switched back to
+    for scrolling. The second tab is closed with the generator.
+
+    Args:
+        driver (WebDriver): The WebDriver object, on a hashtag page.
+        frontier (PostFrontier): The frontier the posts are added to.
+        idle_scrolls (int): Number of scrolls without any new post
+                            after which the end of the grid is assumed.
+        new_tab (bool): Whether to open a tab to visit the posts in.
+    Yields:
+        str: The URL of every post added to the frontier, in grid order.
+    Raises:
+        RateLimited: If the session is throttled before any post is found.
+    '''
+    try:
+        WebDriverWait(driver, governor.timeout()).until(
+            EC.presence_of_element_located((By.XPATH, POST_LINK_XPATH))
+        )
+    except Exception as e:
+        if governor.throttled():
+            raise RateLimited("The hashtag page is rate limited.")
+        return
+
+    grid_window = driver.current_window_handle
+    visit_window = None
+    if new_tab:
+        driver.switch_to.new_window("tab")
+        visit_window = driver.current_window_handle
+        # the lean capture's blocking doesn't carry over to new tabs
+        if getattr(driver, "lean_capture", False):
+            block_heavy_media(driver)
+        driver.switch_to.window(grid_window)
+
+    try:
+        idle = 0
+        throttled_scrolls = 0
+        covered_scrolls = 0
+        while not frontier.is_full() and idle < idle_scrolls:
+            events = governor.throttle_events
+            governor.acquire()
+            frontier.observe(grid_medias(driver))
+            del driver.requests
+            older = frontier.older
+            added = [
+                link for link in map(
+                    frontier.add, driver.execute_script(POST_LINKS_SCRIPT)
+                ) if link
+            ]
+            if added:
+                idle = 0
+                throttled_scrolls = 0
+                covered_scrolls = 0
+            elif frontier.older > older:
+                # the newer posts are all above, the rest was crawled before
+                covered_scrolls += 1
+                if covered_scrolls >= HARVEST_COVERED_SCROLLS:
+                    frontier.covered = True
+                    break
+            elif governor.throttle_events != events or governor.throttled():
+                throttled_scrolls += 1
+                if throttled_scrolls > GOVERNOR_MAX_RETRIES:
+                    frontier.rate_limited = True
+                    break
+                governor.wait_out()
+            else:
+                idle += 1
+
+            if added:
+                if visit_window is not None:
+                    driver.switch_to.window(visit_window)
+                yield from added
+                if visit_window is not None:
+                    driver.switch_to.window(grid_window)
+
+            height = driver.execute_script(SCROLL_SCRIPT)
+            # wait for the next rows of the grid instead of a fixed sleep
+            try:
+                WebDriverWait(driver, 5).until(
+                    lambda driver: driver.execute_script(
+                        "return document.body.scrollHeight;"
+                    ) > height
+                )
+            except Exception as e:
+                pass
+
+        frontier.observe(grid_medias(driver))
+        del driver.requests
+    finally:
+        if visit_window is not None:
+            try:
+                driver.switch_to.window(visit_window)
+                driver.close()
+                driver.switch_to.window(grid_window)
+            except Exception as e:
+                pass
+
+def harvest_post_links(driver, limit = HARVEST_LIMIT, idle_scrolls = HARVEST_IDLE_SCROLLS, since = None):
+    '''
+    Scroll the hashtag grid and collect its post links in bulk,
+    see iter_post_links.
+    Args:
+        driver (WebDriver): The WebDriver object, on a hashtag page.
+        limit (int): Maximum number of posts to collect.
+        idle_scrolls (int): Number of scrolls without any new post
+                            after which the end of the grid is assumed.
+        since (int): Unix timestamp of the oldest posts to collect.
+    Returns:
+        PostFrontier: The collected posts, in grid order.
+    Raises:
+        RateLimited: If the session is throttled before any post is found.
+    '''
+    frontier = PostFrontier(limit, since)
+    for _ in iter_post_links(driver, frontier, idle_scrolls):
+        pass
+    return frontier
@@ -0,0 +1,264 @@
+import time
+import asyncio
+import httpx
+from tqdm import tqdm
+from parser import response_parser, StaticElement, format_date_of_pub, PostFilter
+from user_cache import UserCache
+from payloads import loads, extract_media, extract_user
+from governor import governor, is_throttle_response, RateLimited
+from constants import *
+
+class HttpEngine:
+    '''
+    Browserless engine that talks to the media and user info endpoints
+    directly, reusing the cookies of a Selenium login.
+
+    Requests run concurrently over one pooled asyncio client, with at
+    most `concurrency` of them in flight at a time.
+
+    Args:
+        cookies (list): Session cookies, as returned by export_session.
+        concurrency (int): Maximum number of concurrent requests.
+        base_url (str): The site to talk to. Pointed at a local server
+                        serving recorded fixtures when testing.
+        user_cache (UserCache): Cache of known accounts' user info.
+    '''
+    def __init__(self, cookies, concurrency = HTTP_CONCURRENCY, base_url = BASE_URL, user_cache = None):
+        self.cookies = {cookie["name"]: cookie["value"] for cookie in cookies}
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.user_cache = user_cache if user_cache is not None else UserCache()
+
+    def _create_client(self):
+        headers = {
+            "X-IG-App-ID": API_APP_ID,
+            "X-CSRFToken": self.cookies.get("csrftoken", ""),
+            "X-Requested-With": "XMLHttpRequest",
+            "Referer": f"{self.base_url}/",
+        }
+        limits = httpx.Limits(
+            max_connections = self.concurrency,
+            max_keepalive_connections = self.concurrency
+        )
+        return httpx.AsyncClient(
+            base_url = self.base_url,
+            cookies = self.cookies,
+            headers = headers,
+            limits = limits,
+            timeout = RESPONSE_TIMEOUT,
+            http2 = False
+        )
+
+    async def _get_json(self, client, semaphore, method, url, **kwargs):
+        # throttled requests are sent again once the governor's backoff is over
+        for attempt in range(GOVERNOR_MAX_RETRIES + 1):
+            await governor.acquire_async()
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                latency = time.perf_counter() - start
+
+            throttled = is_throttle_response(response.status_code, response.content)
+            governor.observe(throttled, latency)
+            if not throttled or not governor.enabled:
+                break
+        else:
+            raise RateLimited("The session is rate limited.")
+
+        response.raise_for_status()
+        return loads(response.content)
+
+    async def iter_hashtag_medias(self, client, semaphore, tag):
+        '''
+        Yield the posts listed under a hashtag, newest first.
+        Args:
+            client (httpx.AsyncClient): The pooled client.
+            semaphore (asyncio.Semaphore): The concurrency limit.
+            tag (str): The main hashtag without '#'.
+        Yields:
+            tuple: The media id and the shortcode of each listed post.
+        Raises:
+            RateLimited: If the listing is still throttled after every retry.
+        '''
+        data = {"tab": "recent"}
+        while True:
+            # a failed page ends the listing, not the whole run
+            try:
+                page = await self._get_json(
+                    client, semaphore, "POST",
+                    TAG_SECTIONS_URL.format(tag = tag), data = data
+                )
+                medias = [
+                    (str(media["media"]["pk"]), media["media"].get("code"))
+                    for section in page.get("sections", [])
+                    for media in section["layout_content"].get("medias", [])
+                ]
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                tqdm.write(f"The listing of #{tag} stopped: {e!r}")
+                return
+
+            for media in medias:
+                yield media
+
+            if not page.get("more_available"):
+                return
+
+            data = {
+                "tab": "recent",
+                "max_id": page.get("next_max_id", ""),
+                "page": page.get("next_page", ""),
+            }
+
+    async def fetch_post(self, client, semaphore, media_id, post_filter = None):
+        '''
+        Fetch the media info and, unless cached or rejected by an
+        earlier run, the user info of a post.
+        Args:
+            client (httpx.AsyncClient): The pooled client.
+            semaphore (asyncio.Semaphore): The concurrency limit.
+            media_id (str): The media id of the post.
+            post_filter (PostFilter): The filters of the job, whose
+                                      earlier rejections are skipped.
+        Returns:
+            tuple: The user info and the media info, or None if
+                   the post has to be skipped.
+        '''
+        try:
+            media_dict = extract_media(await self._get_json(
+                client, semaphore, "GET",
+                MEDIA_INFO_URL.format(media_id = media_id)
+            ))
+            item = media_dict["items"][0]
+
+            # collaborative publications are skipped like in the browser
+            if item.get("coauthor_producers"):
+                return None
+            if post_filter is not None and \
+                    post_filter.seen_rejection(user_id = item["user"]["pk"]):
+                return None
+
+            user_dict = self.user_cache.get(item["user"]["username"])
+            if user_dict is None:
+                user_dict = extract_user(await self._get_json(
+                    client, semaphore, "GET",
+                    USER_INFO_URL.format(user_id = item["user"]["pk"])
+                ))
+                self.user_cache.put(user_dict)
+        except (httpx.HTTPError, ValueError, KeyError, IndexError):
+            return None
+
+        return user_dict, media_dict
+
+    async def scrape(self, tag, num_accounts = 10, hashtag = "", main_category = "", backup_category = "", sinks = None, post_filter = None):
+        '''
+        Scrape posts under a hashtag from business accounts.
+        Args:
+            tag (str): The main hashtag without '#'.
+            num_accounts (int): The number of business accounts to scrape.
+            hashtag (str): Secondary hashtag to filter users' accounts
+            main_category (str): Main category of business accounts to filter
+            backup_category (str): Secondary category of business accounts to filter
+            sinks (list): Output sinks accepted posts are streamed to.
+            post_filter (PostFilter): The filters of the job, used instead
+                                      of the hashtag and categories if given.
+        Returns:
+            tuple: A tuple containing the scraped data dictionary,
+                   duration of the scrape, and the number of posts visited.
+        '''
+        accounts = {}
+        visited = 0
+        if post_filter is None:
+            post_filter = PostFilter(hashtag, main_category, backup_category)
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        progress_bar = tqdm(total = num_accounts, desc = "Scraping Instagram Posts")
+
+        def record(post):
+            user_dict, media_dict = post
+            item = media_dict["items"][0]
+            username = user_dict["user"]["username"]
+            if username not in accounts and len(accounts) >= num_accounts:
+                return
+
+            response_parser(
+                user_dict,
+                media_dict,
+                hashtag,
+                main_category,
+                backup_category,
+                StaticElement(datetime = format_date_of_pub(item["taken_at"])),
+                StaticElement(href = f"{self.base_url}/{username}/"),
+                accounts,
+                progress_bar,
+                f"{self.base_url}/p/{item['code']}/",
+                sinks,
+                post_filter
+            )
+
+        async with self._create_client() as client:
+            pending = set()
+            async for media_id, shortcode in self.iter_hashtag_medias(client, semaphore, tag):
+                # posts rejected by earlier runs are skipped without any fetch
+                if shortcode and post_filter.seen_rejection(shortcode = shortcode):
+                    continue
+                visited += 1
+                pending.add(asyncio.create_task(
+                    self.fetch_post(client, semaphore, media_id, post_filter)
+                ))
+
+                # keep at most twice the concurrency limit scheduled,
+                # so the listing doesn't run far ahead of the target
+                if len(pending) >= 2 * self.concurrency:
+                    done, pending = await asyncio.wait(
+                        pending, return_when = asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.result() is not None:
+                            record(task.result())
+
+                if len(accounts) >= num_accounts:
+                    break
+
+            while pending and len(accounts) < num_accounts:
+                done, pending = await asyncio.wait(
+                    pending, return_when = asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.result() is not None:
+                        record(task.result())
+
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions = True)
+
+        progress_bar.close()
+        duration = time.time() - start_time
+
+        return accounts, duration, visited
+
+def scrape_instagram_posts(cookies, tag, num_accounts = 10, hashtag = "", main_category = "", backup_category = "", base_url = BASE_URL, sinks = None, post_filter = None):
+    '''
+    Scrape Instagram posts under a specific hashtag without a browser.
+    Args:
+        cookies (list): Session cookies of a logged-in browser.
+        tag (str): The main hashtag without '#'.
+        num_accounts (int): The number of business accounts to scrape.
+                            Default is 10.
+        hashtag (str): Secondary hashtag to filter users' accounts
+        main_category (str): Main category of business accounts to filter
+        backup_category (str): Secondary category of business accounts to filter
+        base_url (str): The site to talk to.
+        sinks (list): Output sinks accepted posts are streamed to.
+        post_filter (PostFilter): The filters of the job, used instead of
+                                  the hashtag and categories if given.
+    Returns:
+        tuple: A tuple containing the scraped data dictionary,
+               duration of the scrape, and the number of posts visited.
+    '''
+    engine = HttpEngine(cookies, base_url = base_url)
+    return asyncio.run(
+        engine.scrape(
+            tag, num_accounts, hashtag, main_category, backup_category,
+            sinks, post_filter
+        )
+    )
@@ -1,31 +1,306 @@
+import argparse
+from functools import partial
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.options import Options
 from scraper import login_to_instagram, scrape
+from pool import DriverPool
+from session import load_session, save_session, wait_for_login
+from batch import load_jobs, run_jobs
+from metrics import metrics
+from governor import governor
+from replay import FixtureRecorder
+from capture import lean_seleniumwire_options, apply_lean_capture
+from sinks import export_parquet
+from recycle import RecyclingDriver
+from seen_store import SeenStore
+from service import ScraperService, serve
 from constants import *
 
-def main():
+def create_driver(lean = False):
     '''
-    Main function to set up WebDriver, log in to Instagram, 
-    and start the scraping process.
+    Create a new Chrome WebDriver with the project's options.
+    Args:
+        lean (bool): Capture only the API calls the scraper reads,
+                     in bounded memory, and don't load images or videos.
+    Returns:
+        WebDriver: The selenium-wire WebDriver object.
     '''
-
     chrome_options = Options()
     chrome_options.add_experimental_option(
-        'excludeSwitches', 
+        'excludeSwitches',
         ['enable-logging']
     )
 
-    # Uncomment the following line,  
+    # Uncomment the following line,
     # to run this bot in headless mode.
     chrome_options.add_argument("--headless=new")  # <-- this one
 
-    driver = webdriver.Chrome(options = chrome_options)
+    if not lean:
+        return webdriver.Chrome(options = chrome_options)
+
+    chrome_options.add_experimental_option(
+        'prefs',
+        {'profile.managed_default_content_settings.images': 2}
+    )
+    driver = webdriver.Chrome(
+        options = chrome_options,
+        seleniumwire_options = lean_seleniumwire_options()
+    )
+    apply_lean_capture(driver)
+
+    return driver
+
+def parse_args():
+    '''
+    Parse the command line arguments.
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    '''
+    arg_parser = argparse.ArgumentParser(
+        description = "Scrape Instagram posts of business accounts."
+    )
+    arg_parser.add_argument(
+        "--workers",
+        type = int,
+        default = 1,
+        help = "number of browsers that scrape posts in parallel"
+    )
+    arg_parser.add_argument(
+        "--engine",
+        choices = ["browser", "http"],
+        default = "browser",
+        help = "scrape through the browser or talk to the API directly"
+    )
+    arg_parser.add_argument(
+        "--resume",
+        action = "store_true",
+        help = "resume an interrupted crawl from its checkpoint"
+    )
+    arg_parser.add_argument(
+        "--max-posts",
+        type = int,
+        default = HARVEST_LIMIT,
+        help = "maximum number of posts collected from the hashtag grid"
+    )
+    arg_parser.add_argument(
+        "--jobs",
+        metavar = "FILE",
+        help = "run the scrape jobs of a YAML or JSON file without prompts"
+    )
+    arg_parser.add_argument(
+        "--metrics",
+        metavar = "FILE",
+        help = "record per-stage latencies and write them to FILE, "
+               "in the Prometheus text format if it ends with .prom "
+               "and as a JSON summary otherwise"
+    )
+    arg_parser.add_argument(
+        "--record",
+        metavar = "FILE",
+        help = "record the fetched posts to a gzip fixture file "
+               "for replay and benchmark.py"
+    )
+    arg_parser.add_argument(
+        "--lean",
+        action = "store_true",
+        help = "capture only the API calls the scraper reads "
+               "and block images and videos"
+    )
+    arg_parser.add_argument(
+        "--recycle-every",
+        type = int,
+        default = RECYCLE_EVERY,
+        metavar = "N",
+        help = "restart the browser every N posts, keeping the session "
+               f"(default {RECYCLE_EVERY}, 0 to disable)"
+    )
+    arg_parser.add_argument(
+        "--max-rss",
+        type = int,
+        default = RECYCLE_MAX_RSS,
+        metavar = "MIB",
+        help = "restart the browser once it uses more than MIB MiB of memory "
+               f"(default {RECYCLE_MAX_RSS}, 0 to disable)"
+    )
+    arg_parser.add_argument(
+        "--governor",
+        type = float,
+        nargs = "?",
+        const = GOVERNOR_RATE,
+        metavar = "RATE",
+        help = "pace posts and API requests, starting at RATE per second "
+               f"(default {GOVERNOR_RATE}), and back off when throttled"
+    )
+    arg_parser.add_argument(
+        "--pipeline",
+        type = int,
+        default = 0,
+        metavar = "N",
+        help = "let N threads decode, filter and write the posts "
+               "while the browser opens the next ones"
+    )
+    arg_parser.add_argument(
+        "--discover",
+        action = "store_true",
+        help = "also crawl the related hashtags most likely to yield "
+               "matching accounts, picked from the captions"
+    )
+    arg_parser.add_argument(
+        "--incremental",
+        action = "store_true",
+        help = "only visit the posts taken since the previous crawl "
+               f"of the hashtag, recorded in {WATERMARKS_PATH}"
+    )
+    arg_parser.add_argument(
+        "--refresh-days",
+        type = float,
+        default = 0,
+        metavar = "DAYS",
+        help = "with --incremental, also visit again the posts of the "
+               "DAYS before the previous crawl, to update their counts"
+    )
+    arg_parser.add_argument(
+        "--no-seen-store",
+        action = "store_true",
+        help = "visit again the posts and accounts rejected by earlier "
+               f"runs, instead of skipping them (kept in {SEEN_STORE_PATH})"
+    )
+    arg_parser.add_argument(
+        "--serve",
+        type = int,
+        nargs = "?",
+        const = SERVICE_PORT,
+        metavar = "PORT",
+        help = "keep --workers logged-in browsers running and take scrape "
+               f"jobs over a local HTTP API on PORT (default {SERVICE_PORT})"
+    )
+    arg_parser.add_argument(
+        "--db",
+        metavar = "FILE",
+        help = "upsert the posts into a SQLite database "
+               "instead of writing CSV and JSON files"
+    )
+    arg_parser.add_argument(
+        "--parquet",
+        metavar = "FILE",
+        help = "export the posts of the --db database to a Parquet file "
+               "when the run ends (requires pyarrow)"
+    )
+
+    return arg_parser.parse_args()
+
+def main():
+    '''
+    Main function to set up WebDriver, log in to Instagram,
+    and start the scraping process.
+    '''
+    args = parse_args()
+    if args.parquet and not args.db:
+        raise SystemExit("--parquet requires --db.")
+    if args.discover and (args.workers > 1 or args.engine != "browser" or args.resume):
+        raise SystemExit(
+            "--discover only works with one browser, without --resume."
+        )
+    if args.resume and (args.workers > 1 or args.engine != "browser" or args.jobs):
+        raise SystemExit(
+            "--resume only works with one browser, without --jobs."
+        )
+    if args.incremental and (args.workers > 1 or args.engine != "browser" or args.discover):
+        raise SystemExit(
+            "--incremental only works with one browser, without --discover."
+        )
+    if args.serve and (args.jobs or args.resume or args.discover or args.incremental or args.engine != "browser"):
+        raise SystemExit(
+            "--serve takes its jobs over HTTP and only works with the browser "
+            "engine, without --jobs, --resume, --discover or --incremental."
+        )
+    if args.refresh_days and not args.incremental:
+        raise SystemExit("--refresh-days requires --incremental.")
+    jobs = load_jobs(args.jobs) if args.jobs else None
+    if args.metrics:
+        metrics.enable()
+    if args.governor:
+        governor.enable(args.governor)
+
+    driver_factory = partial(create_driver, lean = args.lean)
+    if args.recycle_every or args.max_rss:
+        # long runs get fresh browsers, logged in with the old one's cookies
+        driver_factory = partial(
+            RecyclingDriver, driver_factory, args.recycle_every, args.max_rss
+        )
+    driver = driver_factory()
     driver.get(BASE_URL)
 
-    login_to_instagram(driver)
-    scrape(driver)
+    # A saved session skips the login form
+    if not load_session(driver):
+        login_to_instagram(driver)
+        if wait_for_login(driver):
+            save_session(driver)
+
+    recorder = FixtureRecorder(args.record) if args.record else None
+    seen_store = None if args.no_seen_store else SeenStore()
+
+    pool = None
+    if args.workers > 1 and not args.serve:
+        pool = DriverPool(driver_factory, args.workers)
 
-    driver.quit()
+    try:
+        if args.serve:
+            # the logged-in browser is one of the service's warm ones
+            service = ScraperService(
+                driver_factory,
+                args.workers,
+                db_path = args.db,
+                max_posts = args.max_posts,
+                pipeline_workers = args.pipeline,
+                seen_store = seen_store
+            ).start(driver)
+            try:
+                serve(service, port = args.serve)
+            finally:
+                service.close()
+        elif jobs is not None:
+            run_jobs(
+                driver,
+                jobs,
+                pool = pool,
+                engine = args.engine,
+                max_posts = args.max_posts,
+                recorder = recorder,
+                db_path = args.db,
+                discover = args.discover,
+                pipeline_workers = args.pipeline,
+                incremental = args.incremental,
+                refresh_days = args.refresh_days,
+                seen_store = seen_store
+            )
+        else:
+            scrape(
+                driver,
+                pool,
+                engine = args.engine,
+                resume = args.resume,
+                max_posts = args.max_posts,
+                recorder = recorder,
+                db_path = args.db,
+                discover = args.discover,
+                pipeline_workers = args.pipeline,
+                incremental = args.incremental,
+                refresh_days = args.refresh_days,
+                seen_store = seen_store
+            )
+        if args.parquet:
+            export_parquet(args.db, args.parquet)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if seen_store is not None:
+            seen_store.close()
+        if pool is not None:
+            pool.quit()
+        driver.quit()
+        if args.metrics:
+            metrics.export(args.metrics)
 
 # Main script
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from constants import *
+
+HASHTAG_RE = re.compile(HASHTAG_PATTERN)
+
+# zero width (non-)joiners are part of hashtags in several scripts
+HASHTAG_JOINERS = "_\u200c\u200d"
+
+def normalize_hashtag(hashtag):
+    '''
+    Normalize a hashtag so that it compares like Instagram does:
+    without '#', Unicode-normalized and case-insensitive.
+    Args:
+        hashtag (str): The hashtag, with or without '#'.
+    Returns:
+        str: The normalized hashtag.
+    '''
+    return unicodedata.normalize("NFKC", hashtag.lstrip("#")).casefold()
+
+def _trim_hashtag(candidate):
+    # keep the leading letters, marks, digits and joiners,
+    # e.g. "food🍕" -> "food" and "हिंदी" stays whole
+    for end, char in enumerate(candidate):
+        if char not in HASHTAG_JOINERS and \
+                unicodedata.category(char)[0] not in "LMN":
+            return candidate[:end]
+    return candidate
+
+def hashtags_in(text):
+    '''
+    Tokenize the hashtags of a caption.
+    Args:
+        text (str): The caption.
+    Returns:
+        set: The normalized hashtags of the caption.
+    '''
+    hashtags = set()
+
+    for candidate in HASHTAG_RE.findall(text):
+        hashtag = normalize_hashtag(candidate)
+        if not hashtag.replace("_", "").isalnum():
+            hashtag = _trim_hashtag(hashtag)
+        if hashtag:
+            hashtags.add(hashtag)
+
+    return hashtags
+
+def split_hashtags(hashtags):
+    '''
+    Split a list of hashtags given as a string, e.g. "food, pizza #pasta".
+    Args:
+        hashtags (str or list): The hashtags, as a string or a list.
+    Returns:
+        list: The normalized hashtags.
+    '''
+    if isinstance(hashtags, str):
+        hashtags = re.split(r"[\s,#]+", hashtags)
+
+    return [
+        normalize_hashtag(str(hashtag)) for hashtag in hashtags
+        if str(hashtag).strip("# ")
+    ]
+
+class HashtagRule:
+    '''
+    Hashtag rule of a caption: it has to contain any of the `any_of`
+    hashtags (if there are some), all of the `all_of` hashtags and
+    none of the `none_of` hashtags.
+
+    Args:
+        any_of (iterable): Hashtags of which at least one is required.
+        all_of (iterable): Hashtags that are all required.
+        none_of (iterable): Hashtags that exclude the caption.
+    '''
+    def __init__(self, any_of = (), all_of = (), none_of = ()):
+        self.any_of = frozenset(split_hashtags(any_of))
+        self.all_of = frozenset(split_hashtags(all_of))
+        self.none_of = frozenset(split_hashtags(none_of))
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Build a rule from a job file entry: either a list of hashtags
+        (any of them) or a dictionary with "any", "all" and "none" lists.
+        Args:
+            config (str, list or dict): The rule's configuration.
+        Returns:
+            HashtagRule: The rule.
+        Raises:
+            ValueError: If the configuration has unknown keys.
+        '''
+        if not isinstance(config, dict):
+            return cls(any_of = config)
+
+        unknown = set(config) - {"any", "all", "none"}
+        if unknown:
+            raise ValueError(f"Unknown hashtag rule keys: {sorted(unknown)}")
+
+        return cls(
+            config.get("any") or (),
+            config.get("all") or (),
+            config.get("none") or ()
+        )
+
+class CaptionMatcher:
+    '''
+    Match captions against many named hashtag rules at once.
+
+    The caption is tokenized once and each of its hashtags is looked up
+    in an index of the rules that mention it, so the cost depends on the
+    length of the caption and not on the number of rules.
+
+    Args:
+        rules (dict): Hashtag rules by name.
+    '''
+    def __init__(self, rules):
+        self.rules = dict(rules)
+        self._order = {name: position for position, name in enumerate(self.rules)}
+        self._index = defaultdict(list)
+        # rules without required hashtags match unless excluded
+        self._unconditional = set()
+
+        for name, rule in self.rules.items():
+            for hashtag in rule.any_of:
+                self._index[hashtag].append((name, "any"))
+            for hashtag in rule.all_of:
+                self._index[hashtag].append((name, "all"))
+            for hashtag in rule.none_of:
+                self._index[hashtag].append((name, "none"))
+            if not rule.any_of and not rule.all_of:
+                self._unconditional.add(name)
+
+    def match(self, text):
+        '''
+        Find the rules a caption matches.
+        Args:
+            text (str): The caption.
+        Returns:
+            list: The names of the matching rules, in the rules' order.
+        '''
+        return self.match_hashtags(hashtags_in(text))
+
+    def match_hashtags(self, hashtags):
+        '''
+        Find the rules a caption's tokenized hashtags match.
+        Args:
+            hashtags (set): The normalized hashtags of the caption.
+        Returns:
+            list: The names of the matching rules, in the rules' order.
+        '''
+        any_hits = set()
+        all_hits = Counter()
+        excluded = set()
+
+        for hashtag in hashtags:
+            for name, kind in self._index.get(hashtag, ()):
+                if kind == "any":
+                    any_hits.add(name)
+                elif kind == "all":
+                    all_hits[name] += 1
+                else:
+                    excluded.add(name)
+
+        matches = []
+        for name in (any_hits | set(all_hits) | self._unconditional) - excluded:
+            rule = self.rules[name]
+            if rule.any_of and name not in any_hits:
+                continue
+            if all_hits[name] != len(rule.all_of):
+                continue
+            matches.append(name)
+
+        return sorted(matches, key = self._order.__getitem__)
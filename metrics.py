@@ -0,0 +1,175 @@
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class _NullTimer:
+    '''
+    Timer used while metrics are disabled. Does nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    '''
+    Measure the duration of a block and record it under a stage.
+    '''
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    '''
+    Per-stage latencies and event counters of the scrape loop.
+
+    While disabled, timer returns a shared no-op context manager and
+    increment returns immediately, so instrumented code pays almost
+    nothing for it.
+
+    Args:
+        enabled (bool): Whether measurements are recorded.
+    '''
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self._samples = defaultdict(list)
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def enable(self):
+        '''
+        Start recording measurements.
+        '''
+        self.enabled = True
+
+    def reset(self):
+        '''
+        Drop every recorded measurement.
+        '''
+        with self._lock:
+            self._samples.clear()
+            self._counters.clear()
+
+    def timer(self, stage):
+        '''
+        Time a block of code, e.g. `with metrics.timer("hover"): ...`.
+        Args:
+            stage (str): Name of the stage being timed.
+        Returns:
+            A context manager recording the block's duration.
+        '''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        '''
+        Record a duration for a stage.
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): The measured duration.
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def increment(self, counter, amount = 1):
+        '''
+        Increase an event counter.
+        Args:
+            counter (str): Name of the counter.
+            amount (int): Value to add.
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[counter] += amount
+
+    def summary(self):
+        '''
+        Aggregate the measurements.
+        Returns:
+            dict: For every stage its count, total and p50/p95/p99 in
+                  seconds, and the value of every counter.
+        '''
+        with self._lock:
+            samples = {
+                stage: sorted(values) for stage, values in self._samples.items()
+            }
+            counters = dict(self._counters)
+
+        stages = {}
+        for stage, values in samples.items():
+            stages[stage] = {"count": len(values), "sum": sum(values)}
+            for quantile in QUANTILES:
+                # nearest-rank quantile
+                index = max(0, math.ceil(quantile * len(values)) - 1)
+                stages[stage][f"p{int(quantile * 100)}"] = values[index]
+
+        return {"stages": stages, "counters": counters}
+
+    def to_prometheus(self, prefix = "instagram_scraper"):
+        '''
+        Format the measurements in the Prometheus text exposition format.
+        Args:
+            prefix (str): Prefix of the metric names.
+        Returns:
+            str: The metrics as text.
+        '''
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duration of the scrape loop stages.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, values in sorted(summary["stages"].items()):
+            for quantile in QUANTILES:
+                lines.append(
+                    f'{prefix}_stage_seconds{{stage="{stage}",'
+                    f'quantile="{quantile}"}} '
+                    f'{values[f"p{int(quantile * 100)}"]}'
+                )
+            lines.append(
+                f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {values["sum"]}'
+            )
+            lines.append(
+                f'{prefix}_stage_seconds_count{{stage="{stage}"}} {values["count"]}'
+            )
+
+        lines.append(f"# HELP {prefix}_events_total Events of the scrape loop.")
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for counter, value in sorted(summary["counters"].items()):
+            lines.append(f'{prefix}_events_total{{event="{counter}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        '''
+        Write the measurements to a file, in the Prometheus text format
+        if the path ends with ".prom" and as a JSON summary otherwise.
+        Args:
+            path (str): Path of the output file.
+        '''
+        with open(path, mode = "w", encoding = "utf-8") as file:
+            if path.endswith(".prom"):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), file, indent = 4)
+
+# Shared by the whole scrape loop, disabled unless asked for
+metrics = Metrics()
@@ -1,9 +1,53 @@
-import csv
+import sys
 import json
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from metrics import metrics
+from matcher import HashtagRule, CaptionMatcher, split_hashtags, hashtags_in
+from constants import *
+
+class StaticElement:
+    '''
+    Stand-in for a WebElement whose attributes are already known,
+    used when post data doesn't come from the browser.
+    Args:
+        **attributes: The element's attributes, e.g. href or datetime.
+    '''
+    def __init__(self, **attributes):
+        self.attributes = attributes
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+def format_date_of_pub(taken_at):
+    '''
+    Format a post's unix timestamp like the datetime attribute of the page.
+    Args:
+        taken_at (int): The post's "taken_at" unix timestamp.
+    Returns:
+        str: Date of publication in ISO format, e.g. "2023-08-10T12:34:56.000Z".
+    '''
+    date = datetime.fromtimestamp(taken_at, tz = timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def _shortcode(post_link):
+    # Canonical post links are stored as their shortcode only
+    prefix = f"{BASE_URL}/p/"
+    if post_link.startswith(prefix) and post_link.endswith("/"):
+        shortcode = post_link[len(prefix):-1]
+        if shortcode and "/" not in shortcode:
+            return shortcode
+    return None
 
 class Post:
     '''
     Initialize a Post object.
+
+    Posts are kept in large numbers, so the class uses __slots__ and
+    stores canonical post links as their shortcode.
+
     Args:
         post_text (str): The post's description
         post_link (str): The link to the post.
@@ -11,6 +55,8 @@ class Post:
         comments (int): Number of comments on the post.
         date_of_pub (str): Date of publication in ISO format.
     '''
+    __slots__ = ("post_text", "_link", "likes", "comments", "date_of_pub")
+
     def __init__(self, post_text, post_link, likes, comments, date_of_pub):
         self.post_text = post_text
         self.post_link = post_link
@@ -18,6 +64,23 @@ class Post:
         self.comments = comments
         self.date_of_pub = date_of_pub
 
+    @property
+    def post_link(self):
+        if "/" in self._link:
+            return self._link
+        return f"{BASE_URL}/p/{self._link}/"
+
+    @post_link.setter
+    def post_link(self, post_link):
+        self._link = _shortcode(post_link) or post_link
+
+    @property
+    def shortcode(self):
+        '''
+        The post's shortcode, or None if its link isn't a canonical one.
+        '''
+        return None if "/" in self._link else self._link
+
     def __str__(self):
         return (
             f"\tpost text = {self.post_text},\n"
@@ -44,16 +107,35 @@ class Post:
 class Account:
     '''
     Initialize an Account object.
+
+    Usernames are interned and the canonical profile link is derived
+    from the username instead of being stored with every account.
+
     Args:
         followers (int): Number of followers for the account.
         user_link (str): The link to the account.
         username (str): The username of the account.
     '''
+    __slots__ = ("posts", "followers", "_user_link", "username")
+
     def __init__(self, followers, user_link, username):
         self.posts = []
         self.followers = followers
+        self.username = sys.intern(username)
         self.user_link = user_link
-        self.username = username
+
+    @property
+    def user_link(self):
+        if self._user_link is None:
+            return f"{BASE_URL}/{self.username}/"
+        return self._user_link
+
+    @user_link.setter
+    def user_link(self, user_link):
+        if user_link == f"{BASE_URL}/{self.username}/":
+            self._user_link = None
+        else:
+            self._user_link = user_link
 
     def __str__(self):
         posts_str = "\n".join([str(post) for post in self.posts])
@@ -92,54 +174,304 @@ class Account:
             "posts": [post.to_dict() for post in self.posts]
         }
 
-def convert_to_csv(data_dict, hashtag):
+    @classmethod
+    def from_dict(cls, data):
+        '''
+        Create an Account object from its dictionary representation.
+        Args:
+            data (dict): Dictionary returned by to_dict.
+        Returns:
+            Account: The restored Account object.
+        '''
+        account = cls(data["followers"], data["user_link"], data["username"])
+        for post in data.get("posts", []):
+            account.append_post(Post(**post))
+
+        return account
+
+CSV_HEADER = [
+    "username",
+    "followers",
+    "user link",
+    "post link",
+    "likes",
+    "comments",
+    "post text",
+    "date of pub"
+]
+
+def csv_row(account, post):
+    '''
+    Build the CSV row of a post.
+    Args:
+        account (Account): The account the post belongs to.
+        post (Post): The post to write.
+    Returns:
+        list: The values of the row, in the order of CSV_HEADER.
+    '''
+    return [
+        account.username, 
+        account.followers, 
+        account.user_link, 
+        post.post_link, 
+        post.likes, 
+        post.comments,
+        post.post_text, 
+        post.date_of_pub
+    ]
+
+def segment_rules(filters):
     '''
-    Convert scraped data to CSV format and save it to a file.
+    Get the hashtag rules of a job's segments.
     Args:
-        data_dict (dict): A dictionary containing scraped data.
-        hashtag (str): The hashtag used for the filename.
-    '''
-    csv_file = f"{hashtag}.csv"
-
-    with open(csv_file, mode = "w", newline = "", encoding = "utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow([
-            "username",
-            "followers",
-            "user link",
-            "post link",
-            "likes",
-            "comments",
-            "post text",
-            "date of pub"
-        ])
-
-        for account in data_dict.values():
-            for post in account.posts:
-                writer.writerow([
-                    account.username, 
-                    account.followers, 
-                    account.user_link, 
-                    post.post_link, 
-                    post.likes, 
-                    post.comments,
-                    post.post_text, 
-                    post.date_of_pub
-                ])
-
-def convert_to_json(data_dict, hashtag):
-    '''
-    Convert scraped data to JSON format and save it to a file.
+        filters (dict): The filters of a job, with an optional "segments"
+                        dictionary of rule configurations by name.
+    Returns:
+        dict: Hashtag rules by segment name.
+    '''
+    return {
+        name: HashtagRule.from_config(config)
+        for name, config in (filters.get("segments") or {}).items()
+    }
+
+class PostFilter:
+    '''
+    Filters of a scrape job, split in stages that can each reject a post
+    early. The user stage only needs the user info, the media stage only
+    needs the media info, so the scrape loop can skip the fetches and
+    waits of the later stages once a post is rejected.
+
+    Captions are matched on their tokenized hashtags, so "#food" doesn't
+    match "#foodie". Several named segments can be matched in one pass,
+    a post is kept if its caption matches any of them.
+
+    Args:
+        hashtag (str): The secondary hashtag to search for in the post caption.
+                       Several hashtags separated by spaces or commas
+                       match if any of them is in the caption.
+        main_category (str): The main business category to filter accounts.
+        backup_category (str): The backup business category to use if the main 
+                               category isn't triggered.
+        segments (dict): Hashtag rules by segment name, used instead of
+                         the secondary hashtag.
+        categories (list): Business categories of which the account must
+                           have one, used instead of the main and backup ones.
+        excluded_categories (list): Business categories that exclude an account.
+        index (CooccurrenceIndex): Index the hashtags of every caption
+                                   checked are added to, with the outcome.
+        seen (SeenStore): Store the rejections are kept in, to skip
+                          the rejected posts and accounts of earlier runs.
+    '''
+    # the stage, i.e. the key, of every rejection reason
+    REJECTION_KINDS = {
+        "non_business_accounts": "user",
+        "category_misses": "user",
+        "hashtag_misses": "post",
+    }
+
+    def __init__(self, hashtag = "", main_category = "", backup_category = "", segments = None, categories = None, excluded_categories = (), index = None, seen = None):
+        self.hashtag = hashtag
+        self.main_category = main_category
+        self.backup_category = backup_category
+        self.index = index
+        self.seen = seen
+        self._signatures = {}
+        self.rejections = Counter()
+        self._lock = threading.Lock()
+
+        if segments:
+            self.segments = dict(segments)
+        elif split_hashtags(hashtag):
+            self.segments = {hashtag: HashtagRule(any_of = hashtag)}
+        else:
+            self.segments = {}
+        self.matcher = CaptionMatcher(self.segments) if self.segments else None
+
+        # without a main category, accounts of any category are kept
+        if categories is None:
+            categories = [main_category, backup_category] if main_category else []
+        self.categories = {
+            category.casefold() for category in categories if category
+        }
+        self.excluded_categories = {
+            category.casefold() for category in excluded_categories if category
+        }
+
+    @classmethod
+    def from_filters(cls, filters):
+        '''
+        Build the filters of a job from its filters dictionary.
+        Args:
+            filters (dict): The secondary hashtag, main category and backup
+                            category, and optionally "segments",
+                            "categories" and "excluded_categories".
+        Returns:
+            PostFilter: The filters.
+        '''
+        return cls(
+            filters.get("hashtag", ""),
+            filters.get("main_category", ""),
+            filters.get("backup_category", ""),
+            segments = segment_rules(filters),
+            categories = filters.get("categories"),
+            excluded_categories = filters.get("excluded_categories") or ()
+        )
+
+    def check_user(self, user):
+        '''
+        User stage: the account has to be a business one of one of the
+        categories, and of none of the excluded ones.
+        Args:
+            user (dict): The JSON response containing user data.
+        Returns:
+            str: The reason of the rejection, or None if the user passes.
+        '''
+        if not user["user"]["is_business"]:
+            return "non_business_accounts"
+
+        user_category = (user["user"]["category"] or "").casefold()
+        if self.categories and user_category not in self.categories:
+            return "category_misses"
+        if user_category in self.excluded_categories:
+            return "category_misses"
+
+        return None
+
+    def check_media(self, media):
+        '''
+        Media stage: the post caption has to match one of the segments.
+        Args:
+            media (dict): The JSON response containing media data.
+        Returns:
+            str: The reason of the rejection, or None if the post passes.
+        '''
+        if self.matcher is None and self.index is None:
+            return None
+
+        caption = media["items"][0].get("caption") or {}
+        hashtags = hashtags_in(caption.get("text") or "")
+
+        reason = None
+        if self.matcher is not None and not self.matcher.match_hashtags(hashtags):
+            reason = "hashtag_misses"
+
+        if self.index is not None:
+            self.index.observe(hashtags, reason is None)
+
+        return reason
+
+    def signature(self, reason):
+        '''
+        Get the signature of the filters a rejection depends on.
+        Args:
+            reason (str): The reason of the rejection.
+        Returns:
+            str: The signature, "*" if the rejection applies to any filters.
+        '''
+        if reason == "non_business_accounts":
+            return "*"
+        if reason in self._signatures:
+            return self._signatures[reason]
+
+        if reason == "category_misses":
+            filters = [sorted(self.categories), sorted(self.excluded_categories)]
+        else:
+            # the rules' names don't change which captions match
+            filters = sorted(
+                [sorted(rule.any_of), sorted(rule.all_of), sorted(rule.none_of)]
+                for rule in self.segments.values()
+            )
+        signature = hashlib.sha1(json.dumps(filters).encode("utf-8")).hexdigest()[:16]
+        self._signatures[reason] = signature
+        return signature
+
+    def seen_rejection(self, shortcode = None, user_id = None):
+        '''
+        Check if a post or its account was rejected by an earlier run
+        with the same filters.
+        Args:
+            shortcode (str): The shortcode of the post.
+            user_id (str): The user id of the account.
+        Returns:
+            str: The reason of the rejection, or None if there is none.
+        '''
+        if self.seen is None:
+            return None
+
+        for reason, kind in self.REJECTION_KINDS.items():
+            key = shortcode if kind == "post" else user_id
+            if key is None:
+                continue
+            seen_reason = self.seen.get(kind, key, self.signature(reason))
+            if seen_reason is not None:
+                metrics.increment("seen_rejections_skipped")
+                return seen_reason
+
+        return None
+
+    def reject(self, reason, shortcode = None, user_id = None):
+        '''
+        Record why a post was rejected, and remember the post or the
+        account for later runs if there is a store.
+        Args:
+            reason (str): The reason returned by one of the stages.
+            shortcode (str): The shortcode of the post.
+            user_id (str): The user id of the post's account.
+        '''
+        with self._lock:
+            self.rejections[reason] += 1
+        metrics.increment(reason)
+
+        kind = self.REJECTION_KINDS.get(reason)
+        key = shortcode if kind == "post" else user_id
+        if self.seen is not None and kind is not None and key is not None:
+            self.seen.add(kind, key, self.signature(reason), reason)
+
+def record_post(user, media, date, link, accounts, progress_bar, post_link, sinks = None):
+    '''
+    Record a post that passed every filter, and its account if it's new.
+
     Args:
-        data_dict (dict): A dictionary containing scraped data.
-        hashtag (str): The hashtag used for the filename.
+        user (dict): The JSON response containing user data. Only the
+                     username is read if the account is already known.
+        media (dict): The JSON response containing media data.
+        date (WebElement): The date of publication WebElement object.
+        link (WebElement): The username link WebElement object.
+        accounts (dict): A dictionary to store Account objects.
+        progress_bar (tqdm.tqdm): The tqdm progress bar for tracking
+                        the number of accounts scraped.
+        post_link (str): The link to the post.
+        sinks (list): Output sinks every accepted post is written to.
+                      When given, posts are streamed to the sinks
+                      instead of being kept on the Account objects.
     '''
-    json_file = f"{hashtag}.json"
+    username = user["user"]["username"]
+
+    date_of_pub = date.get_attribute('datetime')
+    likes = media["items"][0]["like_count"]
+    comments = media["items"][0]["comment_count"]
+    # posts without a caption have none at all
+    text = (media["items"][0].get("caption") or {}).get("text") or ""
 
-    with open(json_file, mode = "w", encoding = "utf-8") as file:
-        json.dump(data_dict, file, indent = 4, default = lambda x: x.to_dict())
+    post = Post(text, post_link, likes, comments, date_of_pub)
 
-def response_parser(user, media, hashtag, main_category, backup_category, date, link, accounts, progress_bar, driver):
+    if username in accounts:
+        profile = accounts[username]
+    else:
+        user_link = link.get_attribute('href')
+        followers = user["user"]["follower_count"]
+        profile = Account(followers, user_link, username)
+        accounts[username] = profile
+        progress_bar.update(1)
+
+    if sinks:
+        for sink in sinks:
+            sink.write(profile, post)
+    else:
+        profile.append_post(post)
+    metrics.increment("accepted_posts")
+
+def response_parser(user, media, hashtag, main_category, backup_category, date, link, accounts, progress_bar, post_link, sinks = None, post_filter = None):
     '''
     Parse the JSON response to record business accounts' posts 
     under a specific hashtag, considering specified business categories.
@@ -156,53 +488,25 @@ def response_parser(user, media, hashtag, main_category, backup_category, date,
         accounts (dict): A dictionary to store Account objects.
         progress_bar (tqdm.tqdm): The tqdm progress bar for tracking
                         the number of accounts scraped.
-        driver (WebDriver): The WebDriver object for 
-                            interacting with the browser.
-    '''
-
-    # Check if the user's category matches the main category or
-    # no main category is specified.
-    def is_valid_main_category(user_cat):
-        return not main_category or user_cat == main_category
-
-    # Check if the user's category matches the backup category and 
-    # it's necessary to use the backup category.
-    def is_valid_backup_category(user_cat):
-        return backup_category and user_cat == backup_category
-
-    # Check if the specified hashtag is present in the post caption.
-    def is_hashtag_present():
-        return not hashtag or f"#{hashtag}" in media["items"][0]["caption"]["text"]
-
-    user_category = user["user"]["category"]
-
-    if user["user"]["is_business"]:
-        user_belongs_to_main_category = is_valid_main_category(user_category)
-        user_belongs_to_backup_category = is_valid_backup_category(user_category)
-        is_hashtag_valid = is_hashtag_present()
-
-        if user_belongs_to_main_category or \
-            (user_belongs_to_backup_category and \
-                not user_belongs_to_main_category) and \
-            is_hashtag_valid:   
-                username = user["user"]["username"]
-                user_link = link.get_attribute('href')
-                followers = user["user"]["follower_count"]
-
-                date_of_pub = date.get_attribute('datetime')
-                likes = media["items"][0]["like_count"]
-                comments = media["items"][0]["comment_count"]
-                text = media["items"][0]["caption"]["text"]
-                post_link = driver.current_url
-
-                if username in accounts:
-                    accounts[username].append_post(
-                        Post(text, post_link, likes, comments, date_of_pub)
-                    )
-                else:
-                    profile = Account(followers, user_link, username)
-                    profile.append_post(
-                        Post(text, post_link, likes, comments, date_of_pub)
-                    )
-                    accounts[username] = profile
-                    progress_bar.update(1)
+        post_link (str): The link to the post.
+        sinks (list): Output sinks every accepted post is written to.
+                      When given, posts are streamed to the sinks
+                      instead of being kept on the Account objects.
+        post_filter (PostFilter): The filters of the job, used instead of
+                                  the hashtag and categories if given.
+    '''
+    if post_filter is None:
+        post_filter = PostFilter(hashtag, main_category, backup_category)
+
+    reason = post_filter.check_user(user) or post_filter.check_media(media)
+    if reason:
+        post_filter.reject(
+            reason,
+            shortcode = media["items"][0].get("code"),
+            user_id = user["user"].get("pk")
+        )
+        return
+
+    record_post(
+        user, media, date, link, accounts, progress_bar, post_link, sinks
+    )
@@ -0,0 +1,149 @@
+import json
+import zlib
+from constants import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# errors of the decompressors, reported as ValueError
+DECODE_ERRORS = (zlib.error, ValueError)
+if brotli is not None:
+    DECODE_ERRORS += (brotli.error,)
+if zstandard is not None:
+    DECODE_ERRORS += (zstandard.ZstdError,)
+
+# fields of the user and media info responses the scraper reads
+USER_FIELDS = ("pk", "username", "is_business", "category", "follower_count")
+MEDIA_FIELDS = ("pk", "code", "taken_at", "like_count", "comment_count")
+
+def loads(data):
+    '''
+    Parse a JSON document, with orjson if it is installed.
+    Args:
+        data (bytes or str): The JSON document.
+    Returns:
+        The parsed document.
+    Raises:
+        ValueError: If the document isn't valid JSON.
+    '''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _decompressor(encoding):
+    if encoding in ("gzip", "x-gzip"):
+        # also accepts zlib-wrapped data
+        return zlib.decompressobj(32 + zlib.MAX_WBITS).decompress
+    if encoding == "deflate":
+        return zlib.decompressobj().decompress
+    if encoding == "br" and brotli is not None:
+        return brotli.Decompressor().process
+    if encoding == "zstd" and zstandard is not None:
+        # frames without a content size can only be decoded as a stream
+        return zstandard.ZstdDecompressor().decompressobj().decompress
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+def decompress(body, encoding = "identity"):
+    '''
+    Decompress a response body chunk by chunk, so the decompressors
+    never hold a second copy of the compressed body.
+    Args:
+        body (bytes): The raw response body.
+        encoding (str): The Content-Encoding of the response.
+    Returns:
+        bytes: The decompressed body.
+    Raises:
+        ValueError: If the encoding is unsupported or the body is corrupt.
+    '''
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity" or not body:
+        return body
+
+    decompress_chunk = _decompressor(encoding)
+    view = memoryview(body)
+    chunks = []
+    try:
+        for start in range(0, len(view), DECODE_CHUNK_SIZE):
+            chunks.append(decompress_chunk(view[start:start + DECODE_CHUNK_SIZE]))
+    except DECODE_ERRORS as error:
+        raise ValueError(f"Corrupt {encoding} body: {error}") from error
+
+    return b"".join(chunks)
+
+def extract_user(payload):
+    '''
+    Keep the fields of a user info response the scraper reads.
+    Args:
+        payload (dict): The user info response.
+    Returns:
+        dict: The record, shaped like the response: {"user": {...}}.
+    Raises:
+        ValueError: If the response has no user.
+    '''
+    user = payload.get("user") if isinstance(payload, dict) else None
+    if not isinstance(user, dict):
+        raise ValueError("The user info has no user")
+
+    return {"user": {field: user.get(field) for field in USER_FIELDS}}
+
+def _extract_account(account):
+    return {"pk": account.get("pk"), "username": account.get("username")}
+
+def extract_media(payload):
+    '''
+    Keep the fields of a media info response the scraper reads,
+    leaving out the image versions, carousels and the like.
+    Args:
+        payload (dict): The media info response.
+    Returns:
+        dict: The record, shaped like the response: {"items": [{...}]}.
+    Raises:
+        ValueError: If the response has no media item.
+    '''
+    try:
+        item = payload["items"][0]
+    except (KeyError, IndexError, TypeError) as error:
+        raise ValueError("The media info has no item") from error
+
+    record = {field: item.get(field) for field in MEDIA_FIELDS}
+    caption = item.get("caption")
+    record["caption"] = {"text": caption.get("text")} if caption else None
+    record["user"] = _extract_account(item.get("user") or {})
+    record["coauthor_producers"] = [
+        _extract_account(account)
+        for account in item.get("coauthor_producers") or ()
+    ]
+
+    return {"items": [record]}
+
+EXTRACTORS = {
+    "user": extract_user,
+    "media": extract_media,
+}
+
+def parse_payload(kind, body, encoding = "identity"):
+    '''
+    Decode a media or user info response body into its record.
+    The parsed response is dropped as soon as the fields are copied.
+    Args:
+        kind (str): Either "media" or "user".
+        body (bytes): The raw response body.
+        encoding (str): The Content-Encoding of the response.
+    Returns:
+        dict: The record returned by extract_media or extract_user.
+    Raises:
+        ValueError: If the body can't be decoded or lacks the fields.
+    '''
+    return EXTRACTORS[kind](loads(decompress(body, encoding)))
@@ -0,0 +1,197 @@
+import queue
+import threading
+from parser import record_post, StaticElement, format_date_of_pub
+from capture import shortcode_from_url
+from metrics import metrics
+from constants import *
+
+class PostPipeline:
+    '''
+    Worker threads that finish the posts handed over by the thread
+    driving the browser: they run the media filters and record the
+    accepted posts to the accounts and sinks.
+
+    The queue between both sides is bounded, so the browser waits for
+    the workers when they fall behind. Once the target number of
+    accounts is reached, `done` is set and the remaining posts are
+    dropped.
+
+    A post whose data can't be read is counted and skipped. Any other
+    error, e.g. a sink failing to write, stops the pipeline the same
+    way and is raised again in the browser's thread by submit or close.
+
+    Args:
+        post_filter (PostFilter): The filters of the job.
+        accounts (dict): The accounts accepted so far.
+        num_accounts (int): The number of business accounts to scrape.
+        progress_bar (tqdm.tqdm): The progress bar of the accounts scraped.
+        sinks (list): Output sinks accepted posts are streamed to.
+        checkpoint (Checkpoint): Progress every finished post is saved to.
+        workers (int): Number of worker threads.
+        queue_size (int): Maximum number of posts waiting for a worker.
+    '''
+    def __init__(self, post_filter, accounts, num_accounts, progress_bar, sinks = None, checkpoint = None, workers = PIPELINE_WORKERS, queue_size = PIPELINE_QUEUE_SIZE):
+        self.post_filter = post_filter
+        self.accounts = accounts
+        self.num_accounts = num_accounts
+        self.progress_bar = progress_bar
+        self.sinks = sinks
+        self.checkpoint = checkpoint
+        self.done = threading.Event()
+        # shortcodes of the posts recorded or rejected
+        self.visited = set()
+        # error that stopped the workers
+        self.error = None
+        self._error_raised = False
+        self._closed = False
+        self._queue = queue.Queue(queue_size)
+        # accounts, progress bar and checkpoint are only touched under it
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target = self._work, daemon = True)
+            for _ in range(workers)
+        ]
+
+    def start(self):
+        '''
+        Start the worker threads.
+        Returns:
+            PostPipeline: The pipeline itself, for chaining.
+        '''
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, post_link, user_dict, user_link, media_dict, scrolls):
+        '''
+        Hand a post that passed the user stage over to the workers.
+        Blocks while the queue is full.
+        Args:
+            post_link (str): The link to the post.
+            user_dict (dict): The user info of the post's account.
+            user_link (str): The link to the account.
+            media_dict (dict): The media info of the post.
+            scrolls (int): Number of posts visited so far.
+        Raises:
+            Exception: The error that stopped the workers, if any.
+        '''
+        item = (post_link, user_dict, user_link, media_dict, scrolls)
+        while not self.done.is_set():
+            try:
+                self._queue.put(item, timeout = 0.5)
+                return
+            except queue.Full:
+                metrics.increment("pipeline_backpressure")
+        self._raise_error()
+
+    def skip(self, post_link, scrolls):
+        '''
+        Record a post rejected before reaching the workers.
+        Args:
+            post_link (str): The link to the post.
+            scrolls (int): Number of posts visited so far.
+        '''
+        with self._lock:
+            self._mark_visited(post_link, scrolls)
+
+    def close(self):
+        '''
+        Let the workers finish the queued posts and stop them.
+        Raises:
+            Exception: The error that stopped the workers, unless
+                       submit raised it already.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+
+        # the workers keep emptying the queue until they get these,
+        # even after an error
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raise_error()
+
+    def save(self):
+        '''
+        Save the checkpoint, if there is one.
+        '''
+        if self.checkpoint is not None:
+            with self._lock:
+                self.checkpoint.save(self.sinks)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.close()
+
+    def _raise_error(self):
+        if self.error is not None and not self._error_raised:
+            self._error_raised = True
+            raise self.error
+
+    def _mark_visited(self, post_link, scrolls):
+        shortcode = shortcode_from_url(post_link)
+        self.visited.add(shortcode)
+        if self.checkpoint is not None:
+            self.checkpoint.record(shortcode, scrolls, self.sinks)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._finish(*item)
+            except (ValueError, KeyError, IndexError, TypeError):
+                metrics.increment("pipeline_errors")
+            except Exception as e:
+                # the next posts would fail the same way, e.g. on a full disk
+                metrics.increment("pipeline_errors")
+                with self._lock:
+                    if self.error is None:
+                        self.error = e
+                self.done.set()
+
+    def _finish(self, post_link, user_dict, user_link, media_dict, scrolls):
+        if self.done.is_set():
+            return
+
+        # only the posts rejected or recorded here are marked visited,
+        # so a resume or the watermark never skips the dropped ones
+        reason = self.post_filter.check_media(media_dict)
+        if reason:
+            self.post_filter.reject(
+                reason, shortcode = shortcode_from_url(post_link)
+            )
+            with self._lock:
+                self._mark_visited(post_link, scrolls)
+            return
+
+        date_of_pub = format_date_of_pub(media_dict["items"][0]["taken_at"])
+        username = user_dict["user"]["username"]
+
+        with self._lock:
+            # posts of new accounts past the target are dropped
+            if username not in self.accounts and \
+                    len(self.accounts) >= self.num_accounts:
+                self.done.set()
+                return
+
+            with metrics.timer("record_post"):
+                record_post(
+                    user_dict,
+                    media_dict,
+                    StaticElement(datetime = date_of_pub),
+                    StaticElement(href = user_link),
+                    self.accounts,
+                    self.progress_bar,
+                    post_link,
+                    self.sinks
+                )
+            self._mark_visited(post_link, scrolls)
+            if len(self.accounts) >= self.num_accounts:
+                self.done.set()
@@ -0,0 +1,239 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from tqdm import tqdm
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import TimeoutException
+from parser import PostFilter, record_post
+from capture import ResponseCapture, shortcode_from_url
+from user_cache import UserCache
+from session import import_session, export_session
+from scraper import fetch_post
+from governor import governor, RateLimited
+from metrics import metrics
+from constants import *
+
+class KeyedLock:
+    '''
+    Hand out one lock per key, e.g. per username. A key's lock is
+    dropped once nobody holds or waits for it, so only the keys in use
+    take memory.
+    '''
+    def __init__(self):
+        # key -> [lock, number of threads holding or waiting for it]
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __len__(self):
+        return len(self._locks)
+
+    @contextmanager
+    def hold(self, key):
+        '''
+        Hold the lock belonging to the given key.
+        Args:
+            key (str): The key to lock.
+        '''
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+class DriverPool:
+    '''
+    Pool of browsers that share one hashtag's posts through a work queue.
+
+    Every worker owns one driver created by the driver factory. When
+    session cookies are given, they are loaded into each driver instead
+    of logging in again. Results are merged into a single accounts
+    dictionary and all workers stop once the target is reached.
+
+    Args:
+        driver_factory (callable): Function without arguments that
+                                   returns a new WebDriver object.
+        size (int): Number of drivers in the pool.
+        cookies (list): Session cookies to share between the drivers.
+        user_cache (UserCache): Cache of known accounts' user info
+                                shared by all workers.
+    '''
+    def __init__(self, driver_factory, size, cookies = None, user_cache = None):
+        self.driver_factory = driver_factory
+        self.size = size
+        self.cookies = cookies
+        self.user_cache = user_cache if user_cache is not None else UserCache()
+        self.drivers = []
+
+    def start(self):
+        '''
+        Create the missing drivers and load the shared session into them.
+        '''
+        while len(self.drivers) < self.size:
+            driver = self.driver_factory()
+            if self.cookies:
+                import_session(driver, self.cookies)
+            self.drivers.append(driver)
+
+    def share_session(self, driver):
+        '''
+        Share the session of a logged-in browser with the pool's drivers.
+        Args:
+            driver (WebDriver): The logged-in WebDriver object.
+        '''
+        if self.cookies is None:
+            self.cookies = export_session(driver)
+
+    def quit(self):
+        '''
+        Quit every driver of the pool.
+        '''
+        for driver in self.drivers:
+            driver.quit()
+        self.drivers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.quit()
+
+    def scrape(self, post_links, num_accounts = 10, hashtag = "", main_category = "", backup_category = "", sinks = None, post_filter = None):
+        '''
+        Scrape the given posts in parallel across the pool's drivers.
+        Args:
+            post_links (iterable): URLs of the posts to visit.
+            num_accounts (int): The number of business accounts to scrape.
+            hashtag (str): Secondary hashtag to filter users' accounts
+            main_category (str): Main category of business accounts to filter
+            backup_category (str): Secondary category of business accounts to filter
+            sinks (list): Output sinks accepted posts are streamed to.
+            post_filter (PostFilter): The filters of the job, used instead
+                                      of the hashtag and categories if given.
+        Returns:
+            tuple: A tuple containing the scraped data dictionary,
+                   duration of the scrape, and the number of posts visited.
+        Raises:
+            RateLimited: If the session stays throttled.
+            Exception: The first unexpected error of a worker, e.g. a
+                       browser that died or a sink failing to write,
+                       after every worker stopped.
+        '''
+        self.start()
+
+        work = queue.Queue()
+        for post_link in post_links:
+            work.put(post_link)
+
+        accounts = {}
+        if post_filter is None:
+            post_filter = PostFilter(hashtag, main_category, backup_category)
+        locks = KeyedLock()
+        admission = threading.Lock()
+        stop = threading.Event()
+        rate_limited = threading.Event()
+        errors = []
+        visited = [0]
+        visited_lock = threading.Lock()
+        start_time = time.time()
+
+        progress_bar = tqdm(total = num_accounts, desc = "Scraping Instagram Posts")
+
+        def record(post, post_link):
+            user_dict, media_dict, date, username_link = post
+            username = user_dict["user"]["username"]
+
+            with locks.hold(username):
+                if username in accounts:
+                    record_post(
+                        user_dict, media_dict, date, username_link,
+                        accounts, progress_bar, post_link, sinks
+                    )
+                    return
+
+                # New accounts are admitted one at a time,
+                # so the target is never overshot.
+                with admission:
+                    if len(accounts) >= num_accounts:
+                        stop.set()
+                        return
+                    record_post(
+                        user_dict, media_dict, date, username_link,
+                        accounts, progress_bar, post_link, sinks
+                    )
+                    if len(accounts) >= num_accounts:
+                        stop.set()
+
+        def worker(driver):
+            capture = ResponseCapture().attach(driver)
+            action = ActionChains(driver)
+
+            while not stop.is_set():
+                try:
+                    post_link = work.get_nowait()
+                except queue.Empty:
+                    return
+
+                # posts rejected by earlier runs are skipped without any fetch
+                if post_filter.seen_rejection(shortcode = shortcode_from_url(post_link)):
+                    continue
+
+                with visited_lock:
+                    visited[0] += 1
+
+                # the drivers share one session, so one pace
+                events = capture.throttle_events
+                governor.acquire()
+                post = None
+                try:
+                    driver.get(post_link)
+                    post = fetch_post(
+                        driver, capture, self.user_cache, post_filter,
+                        accounts, action, post_link
+                    )
+                    if post is not None:
+                        record(post, post_link)
+                except (TimeoutException, TimeoutError):
+                    # a slow page only loses its post
+                    metrics.increment("pool_timeouts")
+                except Exception as e:
+                    # anything else would fail every post, stop the pool
+                    errors.append(e)
+                    stop.set()
+                    return
+                finally:
+                    del driver.requests
+                    capture.clear()
+
+                # a post lost to its own throttled responses is visited again
+                # after the backoff
+                if post is None and capture.throttle_events != events:
+                    if governor.strikes > GOVERNOR_MAX_RETRIES:
+                        rate_limited.set()
+                        stop.set()
+                    else:
+                        work.put(post_link)
+
+        threads = [
+            threading.Thread(target = worker, args = (driver,), daemon = True)
+            for driver in self.drivers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        progress_bar.close()
+        if errors:
+            raise errors[0]
+        if rate_limited.is_set():
+            raise RateLimited("The session is rate limited.")
+        duration = time.time() - start_time
+
+        return accounts, duration, visited[0]
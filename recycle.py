@@ -0,0 +1,190 @@
+import os
+import time
+from session import export_session, import_session
+from metrics import metrics
+from constants import *
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def process_tree_rss(pid):
+    '''
+    Measure the resident memory of a process and all its descendants.
+    Uses psutil if it is installed, /proc otherwise.
+    Args:
+        pid (int): The id of the root process.
+    Returns:
+        int: The resident memory in bytes, or None if it can't be measured.
+    '''
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive = True)
+            return sum(process.memory_info().rss for process in processes)
+        except psutil.Error:
+            return None
+
+    if not os.path.isdir("/proc"):
+        return None
+
+    children = {}
+    rss = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding = "utf-8") as file:
+                # the command name may contain spaces, the fields follow it
+                fields = file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+
+    if pid not in rss:
+        return None
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+
+    return total
+
+class RecyclingDriver:
+    '''
+    WebDriver wrapper that replaces its browser with a fresh one every
+    `every` posts, or once the browser's processes use more than
+    `max_rss` MiB, to keep memory and latency flat on long runs.
+
+    Everything is delegated to the current browser. The check runs before
+    each navigation: the old browser's cookies are moved to a new one,
+    with the same interceptors and scopes, which then opens the URL the
+    old one was about to. Callers keep using the same object and their
+    state, e.g. the accepted accounts, is untouched.
+
+    With `automatic` off, navigations never recycle the browser, and
+    callers recycle it at safe points with recycle_if_due, e.g. between
+    two jobs of a browser that keeps several tabs open during a job.
+
+    Args:
+        driver_factory (function): Creates a new WebDriver.
+        every (int): Number of navigations between two recycles, 0 to disable.
+        max_rss (int): Memory threshold of the browser in MiB, 0 to disable.
+    '''
+    _OWN_ATTRIBUTES = {
+        "driver", "driver_factory", "every", "max_rss",
+        "navigations", "recycles", "automatic"
+    }
+    # selenium-wire settings carried over to the new browser
+    _CARRIED_ATTRIBUTES = ("request_interceptor", "response_interceptor", "scopes")
+
+    def __init__(self, driver_factory, every = RECYCLE_EVERY, max_rss = RECYCLE_MAX_RSS):
+        self.driver_factory = driver_factory
+        self.every = every
+        self.max_rss = max_rss
+        self.navigations = 0
+        self.recycles = 0
+        self.automatic = True
+        self.driver = driver_factory()
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper itself
+        if name in self._OWN_ATTRIBUTES:
+            raise AttributeError(name)
+        return getattr(self.driver, name)
+
+    def __setattr__(self, name, value):
+        if name in self._OWN_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.driver, name, value)
+
+    def __delattr__(self, name):
+        delattr(self.driver, name)
+
+    def rss(self):
+        '''
+        Measure the memory of the current browser's processes.
+        Returns:
+            int: The resident memory in bytes, or None if unknown.
+        '''
+        try:
+            pid = self.driver.service.process.pid
+        except AttributeError:
+            return None
+        return process_tree_rss(pid)
+
+    def needs_recycling(self, check_memory = False):
+        '''
+        Check the recycling policy.
+        Args:
+            check_memory (bool): Measure the memory now, instead of only
+                                 every RECYCLE_CHECK_EVERY navigations.
+        Returns:
+            bool: True if the browser should be replaced.
+        '''
+        if self.every and self.navigations >= self.every:
+            return True
+
+        if self.max_rss and self.navigations and (check_memory or
+                self.navigations % RECYCLE_CHECK_EVERY == 0):
+            rss = self.rss()
+            if rss is not None:
+                metrics.observe("browser_rss_mib", rss / 2 ** 20)
+                return rss > self.max_rss * 2 ** 20
+
+        return False
+
+    def recycle(self):
+        '''
+        Replace the browser with a fresh one sharing its session.
+        '''
+        start = time.perf_counter()
+        cookies = export_session(self.driver)
+        carried = {
+            name: getattr(self.driver, name)
+            for name in self._CARRIED_ATTRIBUTES
+            if getattr(self.driver, name, None)
+        }
+        self.driver.quit()
+
+        driver = self.driver_factory()
+        for name, value in carried.items():
+            setattr(driver, name, value)
+        import_session(driver, cookies)
+
+        self.driver = driver
+        self.navigations = 0
+        self.recycles += 1
+        metrics.increment("driver_recycles")
+        metrics.observe("recycle", time.perf_counter() - start)
+
+    def recycle_if_due(self):
+        '''
+        Replace the browser if the policy says so, whether or not
+        recycling is automatic.
+        Returns:
+            bool: True if the browser was replaced.
+        '''
+        if not self.needs_recycling(check_memory = True):
+            return False
+        self.recycle()
+        return True
+
+    def get(self, url):
+        '''
+        Open a URL, in a fresh browser if the policy says so and
+        recycling is automatic.
+        Args:
+            url (str): The URL to open.
+        '''
+        if self.automatic and self.needs_recycling():
+            self.recycle()
+        self.navigations += 1
+        self.driver.get(url)
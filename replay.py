@@ -0,0 +1,108 @@
+import gzip
+import json
+import threading
+from tqdm import tqdm
+from parser import response_parser, StaticElement, PostFilter
+from payloads import loads
+
+class FixtureRecorder:
+    '''
+    Record the captured media and user info of every post whose user
+    info was fetched, accepted or not, to a gzip-compressed JSON Lines
+    fixture file, together with the post link, the profile link and
+    the date of publication.
+
+    Args:
+        path (str): Path of the fixture file, e.g. "food.jsonl.gz".
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, mode = "wt", encoding = "utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, user_dict, media_dict, post_link, user_link, date_of_pub):
+        '''
+        Record the data of one post.
+        Args:
+            user_dict (dict): The user info response.
+            media_dict (dict): The media info response.
+            post_link (str): The link to the post.
+            user_link (str): The link to the account.
+            date_of_pub (str): Date of publication in ISO format.
+        '''
+        line = json.dumps({
+            "post_link": post_link,
+            "user_link": user_link,
+            "date_of_pub": date_of_pub,
+            "user": user_dict,
+            "media": media_dict,
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        '''
+        Close the fixture file.
+        '''
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_fixtures(path):
+    '''
+    Read the posts of a fixture file.
+    Args:
+        path (str): Path of the fixture file.
+    Yields:
+        dict: One recorded post at a time.
+    '''
+    with gzip.open(path, mode = "rt", encoding = "utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield loads(line)
+
+def replay(fixtures, hashtag = "", main_category = "", backup_category = "", sinks = None, accounts = None):
+    '''
+    Feed recorded posts through response_parser as the scrape loop
+    would, with stand-ins for the WebElements and no browser.
+    Args:
+        fixtures (iterable): Recorded posts, e.g. from load_fixtures.
+        hashtag (str): Secondary hashtag to filter users' accounts
+        main_category (str): Main category of business accounts to filter
+        backup_category (str): Secondary category of business accounts to filter
+        sinks (list): Output sinks accepted posts are streamed to.
+        accounts (dict): Dictionary the accepted accounts are added to.
+    Returns:
+        tuple: The accounts dictionary and the number of posts replayed.
+    '''
+    if accounts is None:
+        accounts = {}
+    progress_bar = tqdm(disable = True)
+    post_filter = PostFilter(hashtag, main_category, backup_category)
+    replayed = 0
+
+    for fixture in fixtures:
+        response_parser(
+            fixture["user"],
+            fixture["media"],
+            hashtag,
+            main_category,
+            backup_category,
+            StaticElement(datetime = fixture["date_of_pub"]),
+            StaticElement(href = fixture["user_link"]),
+            accounts,
+            progress_bar,
+            fixture["post_link"],
+            sinks,
+            post_filter
+        )
+        replayed += 1
+
+    progress_bar.close()
+
+    return accounts, replayed
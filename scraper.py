@@ -1,16 +1,28 @@
 import time
-import json
 from getpass import getpass
 from tqdm import tqdm
 from seleniumwire import webdriver
-from seleniumwire.utils import decode
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.chrome.options import Options
-from parser import response_parser, convert_to_csv, convert_to_json
+from selenium.common.exceptions import TimeoutException
+from parser import PostFilter, record_post, StaticElement, format_date_of_pub
+from sinks import open_sinks, close_sinks
+from checkpoint import Checkpoint, checkpoint_path
+from harvest import PostFrontier, harvest_post_links, iter_post_links
+from discovery import CooccurrenceIndex, TagFrontier
+from pipeline import PostPipeline
+from watermarks import Watermark
+from governor import governor, RateLimited
+from metrics import metrics
+from capture import ResponseCapture, shortcode_from_url, shortcode_to_media_id
+from capture import page_transfer_bytes
+from user_cache import UserCache
+from session import export_session
+import http_engine
 from constants import *
 
 def handle_cookie_options(driver):
@@ -82,25 +94,30 @@ def handle_not_now_options(driver):
     except Exception as e:
         pass
 
-def get_response_dict(driver, url):
+def get_response_dict(capture, kind, key, timeout = None):
     '''
-    Get the JSON response from a specific URL.
+    Get the JSON response captured for a specific media or user.
     Args:
-        driver (WebDriver): The WebDriver object for interacting with the browser.
-        url (str): The URL to get the response from.
+        capture (ResponseCapture): The capture attached to the driver.
+        kind (str): Either "media" or "user".
+        key (str): The media id or user id the response belongs to.
+        timeout (float): Maximum number of seconds to wait for the response.
+                         The governor's timeout is used if not given.
     Returns:
-        dict: The JSON response as a Python dictionary.
-    '''
-    request = driver.wait_for_request(url, 10)
-    time.sleep(2)
-    response = request.response
-    response_decoded = json.loads(
-        decode(
-            response.body, response.headers.get('Content-Encoding', 'identity')
-        )
-    )
+        dict: The fields of the response the scraper reads, see parse_payload.
+    Raises:
+        TimeoutError: If the response does not arrive in time, or
+                      couldn't be decoded.
+    '''
+    if timeout is None:
+        timeout = governor.timeout()
 
-    return response_decoded
+    with metrics.timer(f"{kind}_response"):
+        try:
+            return capture.wait_for(kind, key, timeout)
+        except TimeoutError:
+            metrics.increment(f"{kind}_response_timeouts")
+            raise
 
 def independent_print(string):
     '''
@@ -113,7 +130,307 @@ def independent_print(string):
     print()
 
 
-def scrape_instagram_posts(driver, num_accounts = 10, hashtag = "", main_category = "", backup_category = ""):
+def fetch_post(driver, capture, user_cache, post_filter, accounts, action = None, post_link = None, recorder = None):
+    '''
+    Collect the data of the post currently opened in the browser,
+    running the cheapest discriminating checks first:
+    collaboration and author from the media info, known account, then
+    user info (business and category), then caption hashtag.
+    Every stage can reject the post before the next fetch or wait.
+    The date of publication and the author's link come from the media
+    info too, the page is only touched to hover the username link.
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        capture (ResponseCapture): The capture attached to the driver.
+        user_cache (UserCache): Cache of known accounts' user info.
+        post_filter (PostFilter): The filters of the job. Rejections
+                                  are recorded on it.
+        accounts (dict): The accounts accepted so far.
+        action (ActionChains): Action chain used to hover the username link.
+        post_link (str): The URL of the post. The current URL of the
+                         browser is used if not given.
+        recorder (FixtureRecorder): Records every post whose user info
+                                    is fetched, before it is filtered.
+    Returns:
+        tuple: The user info, the media info, the date of publication
+               element and the username link element of a post that
+               passed every filter, or None if it has to be skipped.
+               For an account accepted before, the user info may only
+               hold the username.
+    Raises:
+        TimeoutError: If the media or user info doesn't arrive in time.
+        TimeoutException: If the username link doesn't show up in time.
+    '''
+    if post_link is None:
+        post_link = driver.current_url
+
+    media_dict = fetch_media(capture, post_link)
+    if media_dict is None:
+        return None
+
+    user = fetch_user(
+        driver, capture, user_cache, post_filter, accounts, media_dict, action,
+        recorder
+    )
+    if user is None:
+        return None
+    user_dict, username_link = user
+
+    reason = post_filter.check_media(media_dict)
+    if reason:
+        post_filter.reject(reason, shortcode = shortcode_from_url(post_link))
+        return None
+
+    date = StaticElement(
+        datetime = format_date_of_pub(media_dict["items"][0]["taken_at"])
+    )
+
+    return user_dict, media_dict, date, username_link
+
+def fetch_media(capture, post_link):
+    '''
+    Get the media info of a post and skip collaborative ones,
+    without waiting for anything on the page.
+    Args:
+        capture (ResponseCapture): The capture attached to the driver.
+        post_link (str): The URL of the post.
+    Returns:
+        dict: The media info, or None if the post has to be skipped.
+    Raises:
+        TimeoutError: If the media info doesn't arrive in time.
+    '''
+    media_id = shortcode_to_media_id(shortcode_from_url(post_link))
+    media_dict = get_response_dict(capture, "media", media_id)
+
+    item = media_dict["items"][0]
+    if not item["user"]["username"]:
+        return None
+    if item["coauthor_producers"]:
+        metrics.increment("collaborative_posts_skipped")
+        return None
+
+    return media_dict
+
+def fetch_user(driver, capture, user_cache, post_filter, accounts, media_dict, action = None, recorder = None):
+    '''
+    Run the user stage of the post currently opened in the browser:
+    get the user info of new accounts from the cache or by hovering
+    the username link, and check it.
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        capture (ResponseCapture): The capture attached to the driver.
+        user_cache (UserCache): Cache of known accounts' user info.
+        post_filter (PostFilter): The filters of the job. Rejections
+                                  are recorded on it.
+        accounts (dict): The accounts accepted so far.
+        media_dict (dict): The media info of the post, see fetch_media.
+        action (ActionChains): Action chain used to hover the username link.
+        recorder (FixtureRecorder): Records every post whose user info
+                                    is fetched, before it is filtered.
+    Returns:
+        tuple: The user info and the username link element of a post
+               that passed the user stage, or None if it has to be skipped.
+               For an account accepted before, the user info may only
+               hold the username.
+    Raises:
+        TimeoutError: If the user info doesn't arrive in time.
+        TimeoutException: If the username link doesn't show up in time.
+    '''
+    author = media_dict["items"][0]["user"]
+    username = author["username"]
+    username_link = StaticElement(href = f"{BASE_URL}/{username}/")
+
+    # user stage, accounts accepted before already passed it
+    if username in accounts:
+        user_dict = user_cache.get(username) or {"user": {"username": username}}
+        if recorder is not None and "is_business" in user_dict["user"]:
+            record_fixture(recorder, user_dict, media_dict)
+        return user_dict, username_link
+
+    # and accounts rejected by earlier runs are skipped without any fetch
+    if post_filter.seen_rejection(user_id = author["pk"]):
+        return None
+
+    user_dict = user_cache.get(username)
+    if user_dict is None:
+        if action is None:
+            action = ActionChains(driver)
+        # the user info is only requested by the page on hover
+        with metrics.timer("hover"):
+            element = WebDriverWait(driver, governor.timeout()).until(
+                EC.element_to_be_clickable((
+                    By.CSS_SELECTOR, USERNAME_LINK_SELECTOR
+                ))
+            )
+            action.move_to_element(element).perform()
+        user_dict = get_response_dict(capture, "user", username)
+        user_cache.put(user_dict)
+    else:
+        metrics.increment("user_cache_hits")
+
+    # recorded before the filters, so replays go through the same rejections
+    if recorder is not None:
+        record_fixture(recorder, user_dict, media_dict)
+
+    reason = post_filter.check_user(user_dict)
+    if reason:
+        post_filter.reject(reason, user_id = author["pk"])
+        return None
+
+    return user_dict, username_link
+
+def record_fixture(recorder, user_dict, media_dict):
+    '''
+    Record the user and media info of a post for offline replay.
+    Args:
+        recorder (FixtureRecorder): The fixture recorder.
+        user_dict (dict): The user info of the post's account.
+        media_dict (dict): The media info of the post.
+    '''
+    item = media_dict["items"][0]
+    recorder.record(
+        user_dict,
+        media_dict,
+        f"{BASE_URL}/p/{item['code']}/",
+        f"{BASE_URL}/{item['user']['username']}/",
+        format_date_of_pub(item["taken_at"])
+    )
+
+def visit_post(driver, post_link, capture, user_cache, post_filter, accounts, action, progress_bar, sinks = None, recorder = None):
+    '''
+    Open a post, fetch its data and record it if it passes every filter.
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        post_link (str): The URL of the post.
+        capture (ResponseCapture): The capture attached to the driver.
+        user_cache (UserCache): Cache of known accounts' user info.
+        post_filter (PostFilter): The filters of the job.
+        accounts (dict): The accounts accepted so far.
+        action (ActionChains): Action chain used to hover the username link.
+        progress_bar (tqdm.tqdm): The progress bar of the accounts scraped.
+        sinks (list): Output sinks accepted posts are streamed to.
+        recorder (FixtureRecorder): Records every fetched post.
+    Returns:
+        bool: True if the post was recorded, False if it was skipped,
+              None if its data didn't arrive in time.
+    '''
+    timed_out = False
+    with metrics.timer("navigate"):
+        driver.get(post_link)
+    with metrics.timer("fetch_post"):
+        try:
+            post = fetch_post(
+                driver, capture, user_cache, post_filter, accounts, action,
+                post_link, recorder
+            )
+        except (TimeoutException, TimeoutError):
+            post = None
+            timed_out = True
+    del driver.requests
+
+    # one more round trip, only paid when measuring
+    if metrics.enabled:
+        metrics.increment("bytes_transferred", page_transfer_bytes(driver))
+
+    if post is None:
+        return None if timed_out else False
+
+    user_dict, media_dict, date, username_link = post
+
+    # record the account and/or post, it passed every filter
+    with metrics.timer("record_post"):
+        record_post(
+            user_dict,
+            media_dict,
+            date,
+            username_link,
+            accounts,
+            progress_bar,
+            post_link,
+            sinks
+        )
+
+    return True
+
+def navigate_post(driver, post_link, capture, user_cache, post_filter, accounts, action, pipeline, scrolls, recorder = None):
+    '''
+    Open a post, run its user stage and hand it over to the pipeline's
+    workers, which check its caption and record it while the browser
+    opens the next post.
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        post_link (str): The URL of the post.
+        capture (ResponseCapture): The capture attached to the driver.
+        user_cache (UserCache): Cache of known accounts' user info.
+        post_filter (PostFilter): The filters of the job.
+        accounts (dict): The accounts accepted so far.
+        action (ActionChains): Action chain used to hover the username link.
+        pipeline (PostPipeline): The workers finishing the posts.
+        scrolls (int): Number of posts visited so far.
+        recorder (FixtureRecorder): Records every fetched post.
+    Returns:
+        bool: True if the post was handed over to the workers, False if
+              it was skipped, None if its data didn't arrive in time.
+    '''
+    timed_out = False
+    with metrics.timer("navigate"):
+        driver.get(post_link)
+    with metrics.timer("fetch_user"):
+        user = None
+        try:
+            media_dict = fetch_media(capture, post_link)
+            if media_dict is not None:
+                user = fetch_user(
+                    driver, capture, user_cache, post_filter, accounts,
+                    media_dict, action, recorder
+                )
+        except (TimeoutException, TimeoutError):
+            timed_out = True
+    del driver.requests
+
+    # one more round trip, only paid when measuring
+    if metrics.enabled:
+        metrics.increment("bytes_transferred", page_transfer_bytes(driver))
+
+    if user is None:
+        return None if timed_out else False
+
+    user_dict, username_link = user
+    pipeline.submit(
+        post_link,
+        user_dict,
+        username_link.get_attribute('href'),
+        media_dict,
+        scrolls
+    )
+    return True
+
+def governed_visit(visit, driver, post_link, capture, *args):
+    '''
+    Visit a post at the governor's pace, and visit it again after the
+    backoff if it failed because its own responses got throttled.
+    Throttling seen by the other browsers of the session only slows
+    the pace down.
+    Args:
+        visit (function): visit_post or navigate_post.
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        post_link (str): The URL of the post.
+        capture (ResponseCapture): The capture attached to the driver.
+        *args: The other arguments of the visit.
+    Returns:
+        bool: The result of the visit.
+    Raises:
+        RateLimited: If the post is still throttled after every retry.
+    '''
+    for attempt in range(GOVERNOR_MAX_RETRIES + 1):
+        events = capture.throttle_events
+        governor.acquire()
+        result = visit(driver, post_link, capture, *args)
+        if result or capture.throttle_events == events:
+            return result
+    raise RateLimited("The session is rate limited.")
+
+def scrape_instagram_posts(driver, num_accounts = 10, hashtag = "", main_category = "", backup_category = "", capture = None, user_cache = None, sinks = None, checkpoint = None, max_posts = HARVEST_LIMIT, recorder = None, post_filter = None, pipeline_workers = 0, watermark = None, stream = False):
     '''
     Scrape Instagram posts under a specific hashtag from business accounts.
     Args:
@@ -123,81 +440,154 @@ def scrape_instagram_posts(driver, num_accounts = 10, hashtag = "", main_categor
         hashtag (str): Secondary hashtag to filter users' accounts
         main_category (str): Main category of business accounts to filter
         backup_category (str): Secondary category of business accounts to filter
+        capture (ResponseCapture): Capture to read API responses from.
+                                   A new one is attached if not given.
+        user_cache (UserCache): Cache of known accounts' user info.
+                                The default on-disk cache is used if not given.
+        sinks (list): Output sinks accepted posts are streamed to.
+        checkpoint (Checkpoint): Progress to resume from and save to.
+                                 Posts it has already seen are skipped.
+        max_posts (int): Maximum number of posts harvested from the grid.
+        recorder (FixtureRecorder): Records every fetched post for
+                                    offline replay and benchmarks.
+        post_filter (PostFilter): The filters of the job, used instead of
+                                  the hashtag and categories if given.
+        pipeline_workers (int): If not 0, the browser only navigates and
+                                this many worker threads decode, filter
+                                and record the posts meanwhile.
+        watermark (Watermark): If given, only the posts taken after it
+                               or in its refresh window are visited,
+                               and it is moved past the processed ones.
+        stream (bool): If True, the posts are visited in a second tab as
+                       soon as the grid shows them, instead of after
+                       the whole grid was harvested.
     Returns:
         tuple: A tuple containing the scraped data dictionary, 
                duration of the scrape, and the number of scrolls.
     '''
     accounts = {}
     action = ActionChains(driver)
+    if post_filter is None:
+        post_filter = PostFilter(hashtag, main_category, backup_category)
+    if capture is None:
+        capture = ResponseCapture().attach(driver)
+    if user_cache is None:
+        user_cache = UserCache()
     start_time = time.time()
     scrolls = 0
 
+    if checkpoint is not None:
+        accounts = checkpoint.accounts
+        scrolls = checkpoint.scrolls
+
+    since = watermark.since() if watermark is not None else None
+
+    if stream:
+        frontier = PostFrontier(max_posts, since)
+        post_links = iter_post_links(driver, frontier, new_tab = True)
+    else:
+        # Collect the grid's post links first, then visit them by URL
+        with metrics.timer("harvest"):
+            frontier = harvest_post_links(driver, max_posts, since = since)
+        if not len(frontier):
+            if since is not None:
+                independent_print("No new posts since the last crawl!")
+                return accounts, time.time() - start_time, scrolls
+            raise ValueError("The hashtag has no posts!")
+        post_links = iter(frontier)
+
     # Progress bar with the total number of accounts as the maximum value
-    progress_bar = tqdm(total = num_accounts, desc = "Scraping Instagram Posts")
+    progress_bar = tqdm(
+        total = num_accounts,
+        initial = len(accounts),
+        desc = "Scraping Instagram Posts"
+    )
 
-    while len(accounts) != num_accounts:
-        if scrolls == 0:
-            try:
-                first_post = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, POST_LINK_XPATH))
-                )
-                first_post.click()
-                scrolls += 1
-            except Exception as e:
-                raise ValueError("The hashtag has no posts!")
+    pipeline = None
+    if pipeline_workers:
+        pipeline = PostPipeline(
+            post_filter, accounts, num_accounts, progress_bar,
+            sinks, checkpoint, pipeline_workers
+        ).start()
+
+    processed = set()
+    try:
+        for post_link in post_links:
+            if len(accounts) >= num_accounts or \
+                    pipeline is not None and pipeline.done.is_set():
+                break
+
+            # posts processed before a resume or rejected by earlier
+            # runs are skipped without any fetch
+            shortcode = shortcode_from_url(post_link)
+            if checkpoint is not None and checkpoint.is_visited(shortcode) or \
+                    post_filter.seen_rejection(shortcode = shortcode):
+                processed.add(shortcode)
+                continue
+
+            scrolls += 1
+            # posts whose data didn't arrive (None) are neither marked
+            # processed nor checkpointed, so they are visited again
+            if pipeline is not None:
+                if governed_visit(
+                    navigate_post, driver, post_link, capture, user_cache,
+                    post_filter, accounts, action, pipeline, scrolls,
+                    recorder
+                ) is False:
+                    pipeline.skip(post_link, scrolls)
+                continue
+
+            if governed_visit(
+                visit_post, driver, post_link, capture, user_cache,
+                post_filter, accounts, action, progress_bar, sinks, recorder
+            ) is None:
+                continue
+            processed.add(shortcode)
+
+            if checkpoint is not None:
+                checkpoint.record(shortcode, scrolls, sinks)
         else:
-            try:
-                next_post1 = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((
-                        By.CSS_SELECTOR, NEXT_BUTTON_SELECTOR1
-                    ))
+            if frontier.rate_limited:
+                raise RateLimited(
+                    "The hashtag grid stopped loading because of rate limiting."
+                )
+            if not len(frontier):
+                # only reached when streaming, the harvest checks it first
+                if since is None:
+                    raise ValueError("The hashtag has no posts!")
+                independent_print("No new posts since the last crawl!")
+            elif frontier.covered:
+                independent_print(
+                    "The posts of the previous crawl were reached!"
                 )
-                next_post1.click()
-                scrolls += 1
-            except Exception as e:
+            elif frontier.is_full():
+                # more posts may be left, the grid was only cut short
+                independent_print(
+                    f"The limit of {max_posts} posts to visit was reached! "
+                    "Raise it with --max-posts to go further."
+                )
+            else:
                 independent_print(
                     "The very last post with entered hashtag was reached!"
                 )
-                break
-
-        # if publication is collaborative, skip it.
-        try:
-            username_link = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((
-                    By.CSS_SELECTOR, USERNAME_LINK_SELECTOR
-                ))
-            )
-        except Exception as e:
-            continue
-        
-        # post data
-        media_dict = get_response_dict(driver, MEDIA_XPATH)
-        date = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((
-                By.CSS_SELECTOR, DATE_OF_PUB_SELECTOR
-            ))
-        )
-
-        # user data
-        action.move_to_element(username_link).perform()
-        user_dict = get_response_dict(driver, USERNAME_XPATH)
-
-        # record the account and/or post if the account is buisness
-        # and has catergory "Restaurant"
-        response_parser(
-            user_dict,
-            media_dict,
-            hashtag,
-            main_category,
-            backup_category,
-            date,
-            username_link,
-            accounts,
-            progress_bar,
-            driver
-        )
-                
-        del driver.requests
+    finally:
+        if stream:
+            # closes the tab the posts were visited in
+            post_links.close()
+        if pipeline is not None:
+            # the posts finished before a worker failed are still saved
+            try:
+                pipeline.close()
+            finally:
+                pipeline.save()
+                processed |= pipeline.visited
+        elif checkpoint is not None:
+            checkpoint.save(sinks)
+        # the output is made durable first, so the mark never runs ahead of it
+        if watermark is not None:
+            for sink in sinks or []:
+                sink.checkpoint()
+            watermark.advance(frontier.post_dates(), processed)
 
     end_time = time.time()
     duration = end_time - start_time
@@ -205,6 +595,93 @@ def scrape_instagram_posts(driver, num_accounts = 10, hashtag = "", main_categor
 
     return accounts, duration, scrolls
 
+def discover_instagram_posts(driver, num_accounts, seeds, post_filter, capture = None, user_cache = None, sinks = None, max_posts = HARVEST_LIMIT, recorder = None, batch_size = DISCOVERY_BATCH):
+    '''
+    Scrape posts from the hashtag pages most likely to yield new
+    matching business accounts, starting from the seed hashtags.
+
+    The hashtags of the checked captions are indexed as they are
+    fetched. The pages are crawled `batch_size` posts at a time, and
+    after every batch the next page is picked by expected new accounts
+    per post visited, among the seeds and the hashtags of accepted
+    captions.
+
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        num_accounts (int): The number of business accounts to scrape.
+        seeds (list): The hashtags the crawl starts from.
+        post_filter (PostFilter): The filters of the job.
+        capture (ResponseCapture): Capture to read API responses from.
+                                   A new one is attached if not given.
+        user_cache (UserCache): Cache of known accounts' user info.
+                                The default on-disk cache is used if not given.
+        sinks (list): Output sinks accepted posts are streamed to.
+        max_posts (int): Maximum number of posts harvested from a page's grid.
+        recorder (FixtureRecorder): Records every fetched post.
+        batch_size (int): Number of posts visited before rescheduling.
+    Returns:
+        tuple: A tuple containing the scraped data dictionary,
+               duration of the scrape, and the number of posts visited.
+    '''
+    accounts = {}
+    action = ActionChains(driver)
+    if post_filter.index is None:
+        post_filter.index = CooccurrenceIndex()
+    index = post_filter.index
+    tag_frontier = TagFrontier(index, seeds)
+    if capture is None:
+        capture = ResponseCapture().attach(driver)
+    if user_cache is None:
+        user_cache = UserCache()
+    start_time = time.time()
+    visited = 0
+    seen = set()
+    grids = {}
+
+    progress_bar = tqdm(total = num_accounts, desc = "Scraping Instagram Posts")
+
+    while len(accounts) < num_accounts:
+        tag = tag_frontier.next_tag()
+        if tag is None:
+            independent_print("No hashtag left to discover posts from!")
+            break
+
+        # a page's grid is harvested once, then consumed batch by batch
+        if tag not in grids:
+            driver.get(f"{BASE_URL}/explore/tags/{tag}/")
+            with metrics.timer("harvest"):
+                grids[tag] = iter(harvest_post_links(driver, max_posts))
+            metrics.increment("discovered_tags")
+
+        batch = 0
+        for post_link in grids[tag]:
+            shortcode = shortcode_from_url(post_link)
+            if shortcode in seen:
+                continue
+            seen.add(shortcode)
+            if post_filter.seen_rejection(shortcode = shortcode):
+                continue
+
+            known_accounts = len(accounts)
+            governed_visit(
+                visit_post, driver, post_link, capture, user_cache,
+                post_filter, accounts, action, progress_bar, sinks, recorder
+            )
+            index.record_visit(tag, len(accounts) > known_accounts)
+            visited += 1
+            batch += 1
+
+            if batch >= batch_size or len(accounts) >= num_accounts:
+                break
+        else:
+            tag_frontier.exhaust(tag)
+            del grids[tag]
+
+    duration = time.time() - start_time
+    progress_bar.close()
+
+    return accounts, duration, visited
+
 def get_validated_input(prompt, validator_func):
     '''
     Prompt the user for input, validate it using the provided validator function,
@@ -258,27 +735,186 @@ def validate_integer(input_str):
     except ValueError:
         return False
 
-def scrape(driver):
+def run_scrape(driver, hashtag, num_accounts, filters, sinks, pool = None, engine = "browser", checkpoint = None, max_posts = HARVEST_LIMIT, recorder = None, discover = False, pipeline_workers = 0, watermark = None, seen_store = None):
+    '''
+    Scrape a hashtag with the selected engine. The driver has to be
+    logged in and on the hashtag's page.
+    Args:
+        driver (WebDriver): The WebDriver object for interacting with the browser.
+        hashtag (str): The main hashtag without '#'.
+        num_accounts (int): The number of business accounts to scrape.
+        filters (dict): The secondary hashtag, main category and backup category,
+                        and optionally segments and lists of categories.
+        sinks (list): Output sinks accepted posts are streamed to.
+        pool (DriverPool): Optional pool of browsers to scrape in parallel.
+        engine (str): "browser" or "http".
+        checkpoint (Checkpoint): Progress to resume from and save to.
+                                 Only used by the single browser.
+        max_posts (int): Maximum number of posts harvested from the grid.
+        recorder (FixtureRecorder): Records every fetched post.
+                                    Only used by the single browser.
+        discover (bool): Crawl the related hashtags most likely to yield
+                         matching accounts too, in the single browser.
+        pipeline_workers (int): Number of threads finishing the posts
+                                while the single browser navigates,
+                                0 to do everything in the browser's thread.
+        watermark (Watermark): Mark of the hashtag's previous crawls, to
+                               only visit newer posts. Only used by the
+                               single browser.
+        seen_store (SeenStore): Store of the posts and accounts rejected
+                                by earlier runs, skipped without fetching.
+    Returns:
+        tuple: A tuple containing the scraped data dictionary,
+               duration of the scrape, and the number of posts visited.
+    '''
+    hashtag_2 = filters["hashtag"]
+    main_category = filters["main_category"]
+    backup_category = filters["backup_category"]
+    post_filter = PostFilter.from_filters(filters)
+    post_filter.seen = seen_store
+
+    if discover:
+        return discover_instagram_posts(
+            driver,
+            num_accounts,
+            [hashtag],
+            post_filter,
+            sinks = sinks,
+            max_posts = max_posts,
+            recorder = recorder
+        )
+
+    if engine == "http":
+        return http_engine.scrape_instagram_posts(
+            export_session(driver),
+            hashtag,
+            num_accounts,
+            hashtag_2,
+            main_category,
+            backup_category,
+            sinks = sinks,
+            post_filter = post_filter
+        )
+
+    if pool is not None:
+        # The pool's browsers share the session of the logged-in one
+        pool.share_session(driver)
+        return pool.scrape(
+            harvest_post_links(driver, max_posts),
+            num_accounts,
+            hashtag_2,
+            main_category,
+            backup_category,
+            sinks = sinks,
+            post_filter = post_filter
+        )
+
+    return scrape_instagram_posts(
+        driver,
+        num_accounts,
+        hashtag_2,
+        main_category,
+        backup_category,
+        sinks = sinks,
+        checkpoint = checkpoint,
+        max_posts = max_posts,
+        recorder = recorder,
+        post_filter = post_filter,
+        pipeline_workers = pipeline_workers,
+        watermark = watermark
+    )
+
+def prompt_filters():
+    '''
+    Prompt the user for the secondary hashtag and the business categories.
+    Returns:
+        dict: The secondary hashtag, main category and backup category.
+    '''
+    hashtag_2 = get_validated_input(
+        "Enter the secondary hashtag without '#'\n"
+        "(several separated by spaces match any of them): ",
+        validate_hashtag
+    )
+
+    # Handle user's category input
+    print()
+    print(
+        "Warning: Providing a non-existent category could result\n in "
+        "0 scraped accounts and may take a long time.\n"
+        "Please ensure you enter a valid business category"
+        " to get meaningful results.\n"
+    )
+    main_category = input(
+        "Enter main category of business accounts"
+        " to scrape (or leave blank): "
+    )
+    if main_category:
+        backup_category = input(
+            "Enter backup category of business accounts"
+            " to scrape (or leave blank): "
+        )
+    else:
+        backup_category = ""
+
+    return {
+        "hashtag": hashtag_2,
+        "main_category": main_category.capitalize(),
+        "backup_category": backup_category.capitalize(),
+    }
+
+def confirm_data_files_removed():
+    '''
+    Warn the user to remove previously scraped data files from the
+    directory, as a new crawl overwrites them.
+    Returns:
+        bool: True if the user has removed them.
+    '''
+    print()
+    data_files_removed = get_validated_input(
+        "Before scraping again, please ensure you have removed any\n"
+        "previously scraped data files from the directory.\n"
+        "Have you removed the data files? (y/n): ",
+        validate_yes_or_no,
+    )
+
+    if data_files_removed == "n":
+        independent_print(
+            "Please remove the data files first before continuing."
+        )
+        return False
+    return True
+
+def scrape(driver, pool = None, engine = "browser", resume = False, max_posts = HARVEST_LIMIT, recorder = None, db_path = None, discover = False, pipeline_workers = 0, incremental = False, refresh_days = 0, seen_store = None):
     '''
     Perform the scraping process for the user-specified hashtag.
     Main user's inputs.
     Args:
         driver (WebDriver): The WebDriver object for interacting with the browser.
+        pool (DriverPool): Optional pool of browsers. If given, the posts
+                           of the hashtag grid are scraped in parallel.
+        engine (str): "browser" to scrape through the browser, or "http"
+                      to talk to the API directly with the browser's session.
+        resume (bool): Resume the hashtag's crawl from its checkpoint,
+                       if one was saved by an interrupted run.
+        max_posts (int): Maximum number of posts harvested from the grid.
+        recorder (FixtureRecorder): Records every fetched post.
+        db_path (str): SQLite database posts are upserted into instead
+                       of the CSV and JSON files.
+        discover (bool): Crawl the related hashtags most likely to yield
+                         matching accounts too.
+        pipeline_workers (int): Number of threads finishing the posts
+                                while the browser navigates.
+        incremental (bool): Only visit the posts taken since the previous
+                            crawl of the hashtag, see Watermark.
+        refresh_days (float): Number of days before the previous crawl's
+                              newest post whose posts are visited again.
+        seen_store (SeenStore): Store of the posts and accounts rejected
+                                by earlier runs, skipped without fetching.
     '''
     while True:
-        # Warn user to remove previously scraped data files from the directory
-        print()
-        data_files_removed = get_validated_input(
-            "Before scraping again, please ensure you have removed any\n"
-            "previously scraped data files from the directory.\n"
-            "Have you removed the data files? (y/n): ",
-            validate_yes_or_no,
-        )
-
-        if data_files_removed == "n":
-            independent_print(
-                "Please remove the data files first before continuing."
-            )
+        # Data files are kept and appended to when resuming, and a
+        # database is upserted into so it needn't be removed
+        if not resume and not db_path and not confirm_data_files_removed():
             continue
 
         # Validate user's hashtag inputs
@@ -286,54 +922,82 @@ def scrape(driver):
         hashtag = get_validated_input(
             "Enter the main hashtag without '#': ", validate_hashtag
         )
-        hashtag_2 = get_validated_input(
-            "Enter the secondary hashtag without '#': ", validate_hashtag
-        )
 
-        # Handle user's category input
-        print()
-        print(
-            "Warning: Providing a non-existent category could result\n in "
-            "0 scraped accounts and may take a long time.\n"
-            "Please ensure you enter a valid business category"
-            " to get meaningful results.\n"
-        )
-        main_category = input(
-            "Enter main category of business accounts"
-            " to scrape (or leave blank): "
-        )
-        if main_category:
-            backup_category = input(
-                "Enter backup category of business accounts"
-                " to scrape (or leave blank): "
+        checkpoint = None
+        if resume:
+            checkpoint = Checkpoint.load(checkpoint_path(hashtag))
+            if checkpoint is None:
+                independent_print(
+                    f"No checkpoint of #{hashtag} was found, "
+                    "starting a new crawl."
+                )
+                # the data files are overwritten like in any new crawl
+                if not db_path and not confirm_data_files_removed():
+                    continue
+
+        if checkpoint is not None:
+            filters = checkpoint.filters
+            num_accounts = checkpoint.num_accounts
+            independent_print(
+                f"Resuming #{hashtag}: {len(checkpoint.visited)} posts and "
+                f"{len(checkpoint.accounts)} accounts already scraped."
             )
+            driver.get(f"{BASE_URL}/explore/tags/{hashtag}/")
         else:
-            backup_category = ""
-
-        main_category = main_category.capitalize()
-        backup_category = backup_category.capitalize()
-        
+            filters = prompt_filters()
 
-        driver.get(f"{BASE_URL}/explore/tags/{hashtag}/")
+            driver.get(f"{BASE_URL}/explore/tags/{hashtag}/")
 
-        # Validate user's integer input
-        print()
-        num_accounts = int(
-            get_validated_input(
-                "Number of business accounts to scrape: ", validate_integer
+            # Validate user's integer input
+            print()
+            num_accounts = int(
+                get_validated_input(
+                    "Number of business accounts to scrape: ", validate_integer
+                )
+            )
+            checkpoint = Checkpoint(
+                checkpoint_path(hashtag), filters, num_accounts
             )
-        )
 
-        accounts, total_duration, num_of_scrolls = scrape_instagram_posts(
-            driver, 
-            num_accounts, 
-            hashtag_2, 
-            main_category, 
-            backup_category
+        watermark = None
+        if incremental:
+            watermark = Watermark(hashtag, refresh_days)
+
+        # Posts are written as they are accepted, the JSON file
+        # is compacted from the JSON Lines one at the end.
+        checkpoint.rewind_outputs()
+        sinks = open_sinks(
+            hashtag, "a" if checkpoint.visited else "w", db_path
         )
+        try:
+            accounts, total_duration, num_of_scrolls = run_scrape(
+                driver,
+                hashtag,
+                num_accounts,
+                filters,
+                sinks,
+                pool = pool,
+                engine = engine,
+                checkpoint = checkpoint,
+                max_posts = max_posts,
+                recorder = recorder,
+                discover = discover,
+                pipeline_workers = pipeline_workers,
+                watermark = watermark,
+                seen_store = seen_store
+            )
+        except RateLimited as e:
+            # unlike the end of the feed, the crawl isn't complete
+            independent_print(
+                f"{e} Stopping, the progress is saved: "
+                "run again later with --resume."
+            )
+            break
+        finally:
+            close_sinks(sinks, hashtag)
 
-        convert_to_csv(accounts, hashtag)
-        convert_to_json(accounts, hashtag)
+        # The crawl is complete, nothing is left to resume
+        checkpoint.remove()
 
         independent_print(
             f"Total duration of the loop: {total_duration:.2f} seconds\n"
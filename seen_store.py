@@ -0,0 +1,150 @@
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from constants import *
+
+class BloomFilter:
+    '''
+    Set membership in constant time and memory, with false positives
+    at the given rate but no false negatives.
+
+    Args:
+        capacity (int): Number of items the error rate is sized for.
+        error_rate (float): Rate of false positives at full capacity.
+    '''
+    def __init__(self, capacity = SEEN_BLOOM_CAPACITY, error_rate = SEEN_BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: the i-th position is h1 + i * h2
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size = 16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        '''
+        Add an item.
+        Args:
+            item (str): The item.
+        '''
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+class SeenStore:
+    '''
+    Persistent store of rejected posts and accounts, so later runs and
+    other hashtags' jobs skip them before fetching anything.
+
+    Every rejection is kept with its reason and the signature of the
+    filters it depends on, so it only applies to jobs with the same
+    filters. Lookups go through an in-memory Bloom filter loaded at
+    startup, and only its positives are checked against the database.
+    Entries older than the TTL are evicted.
+
+    Args:
+        path (str): Path to the SQLite database file. Use ":memory:"
+                    to keep the rejections for the current run only.
+        ttl (float): Number of seconds a rejection stays valid.
+        capacity (int): Number of rejections the Bloom filter is sized
+                        for, at least twice the stored ones.
+    '''
+    def __init__(self, path = SEEN_STORE_PATH, ttl = SEEN_STORE_TTL, capacity = SEEN_BLOOM_CAPACITY):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rejections ("
+            " kind TEXT,"
+            " key TEXT,"
+            " signature TEXT,"
+            " reason TEXT,"
+            " rejected_at REAL,"
+            " PRIMARY KEY (kind, key, signature))"
+        )
+        self._connection.commit()
+        self.evict_expired()
+
+        rows = self._connection.execute(
+            "SELECT kind, key, signature FROM rejections"
+        ).fetchall()
+        self._bloom = BloomFilter(max(capacity, 2 * len(rows)))
+        for row in rows:
+            self._bloom.add(self._item(*row))
+
+    @staticmethod
+    def _item(kind, key, signature):
+        return f"{kind}\0{key}\0{signature}"
+
+    def add(self, kind, key, signature, reason):
+        '''
+        Store a rejection.
+        Args:
+            kind (str): Either "post" (keyed by shortcode) or "user"
+                        (keyed by user id).
+            key (str): The shortcode or user id.
+            signature (str): The signature of the filters it depends on.
+            reason (str): The reason of the rejection.
+        '''
+        key = str(key)
+        with self._lock:
+            self._bloom.add(self._item(kind, key, signature))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO rejections"
+                " (kind, key, signature, reason, rejected_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (kind, key, signature, reason, time.time())
+            )
+            self._connection.commit()
+
+    def get(self, kind, key, signature):
+        '''
+        Look up a rejection.
+        Args:
+            kind (str): Either "post" or "user".
+            key (str): The shortcode or user id.
+            signature (str): The signature of the current filters.
+        Returns:
+            str: The reason of the rejection, or None if there is none.
+        '''
+        key = str(key)
+        with self._lock:
+            if self._item(kind, key, signature) not in self._bloom:
+                return None
+            row = self._connection.execute(
+                "SELECT reason, rejected_at FROM rejections"
+                " WHERE kind = ? AND key = ? AND signature = ?",
+                (kind, key, signature)
+            ).fetchone()
+
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        return row[0]
+
+    def evict_expired(self):
+        '''
+        Remove every rejection older than the TTL from the database.
+        '''
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM rejections WHERE rejected_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self._connection.commit()
+
+    def close(self):
+        '''
+        Close the underlying database connection.
+        '''
+        with self._lock:
+            self._connection.close()
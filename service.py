@@ -0,0 +1,495 @@
+import re
+import json
+import time
+import queue
+import itertools
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from scraper import scrape_instagram_posts
+from batch import validate_job, output_prefix
+from parser import PostFilter, segment_rules
+from sinks import open_sinks, close_sinks
+from capture import ResponseCapture
+from pool import DriverPool
+from recycle import RecyclingDriver
+from governor import RateLimited
+from constants import *
+
+class Job:
+    '''
+    A scrape job submitted to the service, with its progress.
+
+    Everything that happens to the job is published as an event: its
+    start, every accepted post and its end. Clients read the events
+    from any position and wait for the next ones. Only the latest
+    SERVICE_JOB_EVENTS events are kept, the positions of the dropped
+    ones are skipped.
+
+    Args:
+        job_id (str): The id of the job.
+        spec (dict): The validated job, as returned by validate_job.
+    '''
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.status = "queued"
+        self.error = None
+        self.summary = {}
+        self.events = deque(maxlen = SERVICE_JOB_EVENTS)
+        # number of events published, dropped ones included
+        self.published = 0
+        self.posts = 0
+        self.usernames = set()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.first_post_at = None
+        self.finished_at = None
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def publish(self, event):
+        '''
+        Add an event and wake up the clients waiting for it.
+        Args:
+            event (dict): The event, with its type under "event".
+        '''
+        with self._condition:
+            if event["event"] == "post":
+                self.posts += 1
+                self.usernames.add(event["username"])
+                if self.first_post_at is None:
+                    self.first_post_at = time.time()
+            self.events.append(event)
+            self.published += 1
+            self._condition.notify_all()
+
+    def start(self):
+        '''
+        Mark the job as running.
+        '''
+        self.started_at = time.time()
+        self.status = "running"
+        self.publish({"event": "started", "id": self.id})
+
+    def finish(self, status, error = None, **summary):
+        '''
+        Mark the job as finished.
+        Args:
+            status (str): "done", "failed" or "cancelled".
+            error (str): Why the job failed.
+            **summary: Figures of the finished job, e.g. its duration.
+        '''
+        with self._condition:
+            self.finished_at = time.time()
+            self.status = status
+            self.error = error
+            self.summary = summary
+            # in the same lock, so no client sees the job finished
+            # without its last event
+            self.publish({"event": status, **self.to_dict()})
+
+    def wait_events(self, start, timeout = None):
+        '''
+        Get the events from a position, waiting for some if there are none.
+        Args:
+            start (int): Position of the first event to return.
+            timeout (float): Maximum number of seconds to wait.
+        Returns:
+            tuple: The position of the first event returned, later than
+                   `start` if the events there were dropped, and the
+                   events, empty if none came or the job is finished.
+        '''
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.published > start or self.finished, timeout
+            )
+            first = max(start, self.published - len(self.events))
+            skipped = first - (self.published - len(self.events))
+            return first, list(itertools.islice(self.events, skipped, None))
+
+    def to_dict(self):
+        '''
+        Get the status of the job.
+        Returns:
+            dict: The status, progress and timings of the job.
+        '''
+        time_to_first_post = None
+        if self.first_post_at is not None:
+            time_to_first_post = self.first_post_at - self.started_at
+        return {
+            "id": self.id,
+            "hashtag": self.spec["hashtag"],
+            "num_accounts": self.spec["num_accounts"],
+            "status": self.status,
+            "error": self.error,
+            "accounts": len(self.usernames),
+            "posts": self.posts,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "time_to_first_post": time_to_first_post,
+            **self.summary,
+        }
+
+class JobSink:
+    '''
+    Sink publishing every accepted post of a job as an event.
+    Args:
+        job (Job): The job.
+    '''
+    def __init__(self, job):
+        self.job = job
+
+    def write(self, account, post):
+        event = {
+            "event": "post",
+            "username": account.username,
+            "followers": account.followers,
+            "user_link": account.user_link,
+        }
+        event.update(post.to_dict())
+        self.job.publish(event)
+
+    def checkpoint(self):
+        return {}
+
+    def close(self):
+        pass
+
+class ScraperService:
+    '''
+    Long-lived scraper keeping a pool of logged-in browsers warm and
+    running the jobs submitted to it, one per browser at a time.
+
+    Starting a browser, its proxy and the login is paid once when the
+    service starts instead of by every job, so a job goes straight to
+    its hashtag page. Its posts are visited in a second tab as soon as
+    the grid shows them, without waiting for the whole grid. Recycled
+    browsers are only replaced between two jobs, never in the middle
+    of one. Only the latest SERVICE_FINISHED_JOBS finished jobs are kept.
+
+    Args:
+        driver_factory (callable): Function without arguments that
+                                   returns a new WebDriver object.
+        size (int): Number of browsers, i.e. of jobs run at once.
+        run_job (callable): Runs a job in a browser: called with the
+                            driver, its capture, the Job and the sinks
+                            to stream posts to, returns a summary dict.
+                            Scrapes the hashtag in the browser by default.
+        db_path (str): SQLite database posts are upserted into instead
+                       of each job's CSV and JSON files.
+        max_posts (int): Maximum number of posts harvested per job.
+        pipeline_workers (int): Number of threads finishing the posts
+                                while each browser navigates.
+        seen_store (SeenStore): Store of the posts and accounts rejected
+                                by earlier jobs, skipped without fetching.
+    '''
+    def __init__(self, driver_factory, size = 1, run_job = None, db_path = None, max_posts = HARVEST_LIMIT, pipeline_workers = 0, seen_store = None):
+        self.pool = DriverPool(driver_factory, size)
+        self.run_job = run_job if run_job is not None else self.scrape_job
+        self.db_path = db_path
+        self.max_posts = max_posts
+        self.pipeline_workers = pipeline_workers
+        self.seen_store = seen_store
+        self.user_cache = self.pool.user_cache
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # output prefixes are picked and their files created under it
+        self._outputs_lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+        # jobs by status, of the finished jobs no longer kept
+        self._pruned = {}
+
+    def start(self, driver = None):
+        '''
+        Start the browsers and the threads running the jobs.
+        Args:
+            driver (WebDriver): A logged-in WebDriver object, whose
+                                session the other browsers share.
+                                It becomes one of the service's browsers.
+        Returns:
+            ScraperService: The service itself, for chaining.
+        '''
+        if driver is not None:
+            self.pool.share_session(driver)
+            self.pool.size -= 1
+        self.pool.start()
+        drivers = self.pool.drivers + ([driver] if driver is not None else [])
+
+        for driver in drivers:
+            # replacing the browser would close the tabs of a running job
+            if isinstance(driver, RecyclingDriver):
+                driver.automatic = False
+            capture = ResponseCapture().attach(driver)
+            thread = threading.Thread(
+                target = self._work, args = (driver, capture), daemon = True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, spec):
+        '''
+        Queue a job.
+        Args:
+            spec (dict): The job, with the keys of a job file's jobs.
+        Returns:
+            Job: The queued job.
+        Raises:
+            ValueError: If the job is invalid or the service is closing.
+        '''
+        spec = validate_job(spec)
+        with self._lock:
+            if self._closed:
+                raise ValueError("The service is closing.")
+            job = Job(str(next(self._ids)), spec)
+            self.jobs[job.id] = job
+            self._queue.put(job)
+            self._prune()
+        return job
+
+    def _prune(self):
+        # the oldest finished jobs go first, the dictionary keeps them in order
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:len(finished) - SERVICE_FINISHED_JOBS]:
+            del self.jobs[job.id]
+            self._pruned[job.status] = self._pruned.get(job.status, 0) + 1
+
+    def cancel(self, job_id):
+        '''
+        Cancel a job that hasn't started yet.
+        Args:
+            job_id (str): The id of the job.
+        Returns:
+            bool: True if the job was cancelled.
+        '''
+        job = self.jobs.get(job_id)
+        with self._lock:
+            if job is None or job.status != "queued":
+                return False
+            job.status = "cancelled"
+        job.finish("cancelled")
+        return True
+
+    def status(self):
+        '''
+        Get the status of the service.
+        Returns:
+            dict: The number of browsers and of jobs by status.
+        '''
+        with self._lock:
+            jobs = list(self.jobs.values())
+            counts = dict(self._pruned)
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"browsers": len(self._threads), "jobs": counts}
+
+    def close(self):
+        '''
+        Cancel the queued jobs, let the running ones finish, stop the
+        threads and quit the browsers the service started.
+        '''
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.cancel(job.id)
+
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.pool.quit()
+
+    def _work(self, driver, capture):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                job.start()
+
+            sinks = [JobSink(job)]
+            try:
+                if isinstance(driver, RecyclingDriver):
+                    driver.recycle_if_due()
+                summary = self.run_job(driver, capture, job, sinks)
+            except (ValueError, RateLimited) as e:
+                job.finish("failed", str(e))
+            except Exception as e:
+                # one broken job mustn't take its browser down
+                job.finish("failed", f"{type(e).__name__}: {e}")
+            else:
+                job.finish("done", **(summary or {}))
+            finally:
+                capture.clear()
+
+    def scrape_job(self, driver, capture, job, sinks):
+        '''
+        Scrape a job's hashtag in a browser of the service.
+        Args:
+            driver (WebDriver): The browser running the job.
+            capture (ResponseCapture): The capture attached to it.
+            job (Job): The job.
+            sinks (list): Sinks the accepted posts are streamed to,
+                          besides the job's data files or database.
+        Returns:
+            dict: The duration of the scrape and the posts visited.
+        '''
+        spec = job.spec
+        post_filter = PostFilter.from_filters(spec["filters"])
+        post_filter.seen = self.seen_store
+        # the files reserve the prefix, so jobs running at once never
+        # pick the same one
+        with self._outputs_lock:
+            prefix = spec["hashtag"] if self.db_path else output_prefix(spec)
+            outputs = open_sinks(
+                prefix,
+                db_path = self.db_path,
+                segments = segment_rules(spec["filters"]),
+                hashtag = spec["hashtag"]
+            )
+
+        try:
+            driver.get(f"{BASE_URL}/explore/tags/{spec['hashtag']}/")
+            accounts, duration, visited = scrape_instagram_posts(
+                driver,
+                spec["num_accounts"],
+                capture = capture,
+                user_cache = self.user_cache,
+                sinks = outputs + sinks,
+                max_posts = self.max_posts,
+                post_filter = post_filter,
+                pipeline_workers = self.pipeline_workers,
+                stream = True
+            )
+        finally:
+            close_sinks(outputs, prefix)
+
+        return {"output": prefix, "duration": duration, "posts_visited": visited}
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    '''
+    JSON API of the service:
+
+        POST   /jobs              queue a job, same keys as in job files
+        GET    /jobs              status of every job
+        GET    /jobs/ID           status of a job
+        GET    /jobs/ID/events    stream the job's events as JSON Lines
+                                  until it is finished, from ?since=N
+        DELETE /jobs/ID           cancel a job that hasn't started
+        GET    /status            browsers and jobs of the service
+    '''
+    JOB_PATH = re.compile(r"/jobs/(\w+)(/events)?/?")
+
+    def log_message(self, format, *args):
+        # the scrape's own output is easier to follow without access logs
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job(self, path):
+        match = self.JOB_PATH.fullmatch(path)
+        if match is None:
+            return None, None
+        return self.server.service.jobs.get(match.group(1)), match.group(2)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        service = self.server.service
+
+        if url.path == "/status":
+            return self._send_json(200, service.status())
+        if url.path.rstrip("/") == "/jobs":
+            return self._send_json(
+                200, [job.to_dict() for job in list(service.jobs.values())]
+            )
+
+        job, events = self._job(url.path)
+        if job is None:
+            return self._send_json(404, {"error": "No such job."})
+        if not events:
+            return self._send_json(200, job.to_dict())
+
+        try:
+            position = int(parse_qs(url.query).get("since", ["0"])[0])
+        except ValueError:
+            return self._send_json(400, {"error": "Invalid since."})
+        self._stream_events(job, position)
+
+    def _stream_events(self, job, position):
+        # the end of the stream is told by closing the connection
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            while True:
+                position, events = job.wait_events(position, timeout = 1)
+                for event in events:
+                    self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                position += len(events)
+                self.wfile.flush()
+                if job.finished and position >= job.published:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "Not found."})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = self.server.service.submit(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, job.to_dict())
+
+    def do_DELETE(self):
+        job, events = self._job(urlparse(self.path).path)
+        if job is None or events:
+            return self._send_json(404, {"error": "No such job."})
+        if not self.server.service.cancel(job.id):
+            return self._send_json(409, {"error": "The job has already started."})
+        self._send_json(200, job.to_dict())
+
+def serve(service, host = SERVICE_HOST, port = SERVICE_PORT):
+    '''
+    Serve the service's API until interrupted.
+    Args:
+        service (ScraperService): The started service.
+        host (str): The address to listen on, local only by default.
+        port (int): The port to listen on.
+    '''
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving scrape jobs on http://{host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,111 @@
+import os
+import json
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.wait import WebDriverWait
+from constants import *
+
+# Resolves to whether an endpoint only served to logged-in users answers
+SESSION_CHECK_SCRIPT = (
+    "var done = arguments[arguments.length - 1];"
+    "fetch(arguments[0], {headers: {'X-IG-App-ID': arguments[1]}})"
+    ".then(function (response) { done(response.ok && !response.redirected); })"
+    ".catch(function () { done(false); });"
+)
+
+def export_session(driver):
+    '''
+    Export the cookies of a logged-in browser session.
+    Args:
+        driver (WebDriver): The logged-in WebDriver object.
+    Returns:
+        list: The session cookies as a list of dictionaries.
+    '''
+    return driver.get_cookies()
+
+def import_session(driver, cookies):
+    '''
+    Load exported session cookies into another browser,
+    so it shares the login without going through the login form.
+    Args:
+        driver (WebDriver): The WebDriver object to log in.
+        cookies (list): Cookies returned by export_session.
+    '''
+    # Cookies can only be set for the domain currently opened
+    driver.get(BASE_URL)
+    for cookie in cookies:
+        cookie = dict(cookie)
+        # Chrome rejects the "expiry" of already expired or float values
+        if "expiry" in cookie:
+            cookie["expiry"] = int(cookie["expiry"])
+        driver.add_cookie(cookie)
+    driver.refresh()
+
+def wait_for_login(driver, timeout = LOGIN_TIMEOUT):
+    '''
+    Wait until the browser holds a logged-in session.
+    Args:
+        driver (WebDriver): The WebDriver object.
+        timeout (float): Maximum number of seconds to wait.
+    Returns:
+        bool: True if the session cookie appeared in time.
+    '''
+    try:
+        WebDriverWait(driver, timeout).until(
+            lambda driver: driver.get_cookie(SESSION_COOKIE)
+        )
+        return True
+    except TimeoutException:
+        return False
+
+def is_logged_in(driver):
+    '''
+    Check that the browser's session is accepted by the site, by
+    requesting an endpoint that only answers logged-in users.
+    Args:
+        driver (WebDriver): The WebDriver object, on the site.
+    Returns:
+        bool: True if the session is logged in.
+    '''
+    if driver.get_cookie(SESSION_COOKIE) is None:
+        return False
+    try:
+        return bool(driver.execute_async_script(
+            SESSION_CHECK_SCRIPT, SESSION_CHECK_URL, API_APP_ID
+        ))
+    except WebDriverException:
+        return False
+
+def save_session(driver, path = SESSION_PATH):
+    '''
+    Save the cookies of a logged-in browser session to a file.
+    Args:
+        driver (WebDriver): The logged-in WebDriver object.
+        path (str): Path of the session file.
+    '''
+    # The file holds login cookies, it is private from its creation
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # and a file saved before with wider permissions is narrowed too
+    os.chmod(path, 0o600)
+    with os.fdopen(descriptor, mode = "w", encoding = "utf-8") as file:
+        json.dump(export_session(driver), file)
+
+def load_session(driver, path = SESSION_PATH):
+    '''
+    Restore a saved session, so the browser skips the login form.
+    An expired or revoked session is cleared from the browser again.
+    Args:
+        driver (WebDriver): The WebDriver object to log in.
+        path (str): Path of the session file.
+    Returns:
+        bool: True if the restored session is logged in.
+    '''
+    if not os.path.exists(path):
+        return False
+
+    with open(path, encoding = "utf-8") as file:
+        import_session(driver, json.load(file))
+
+    if is_logged_in(driver):
+        return True
+    driver.delete_all_cookies()
+    return False
@@ -0,0 +1,513 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import threading
+from parser import CSV_HEADER, csv_row
+from capture import shortcode_from_url
+from matcher import CaptionMatcher
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY,
+    followers INTEGER,
+    user_link TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    shortcode TEXT PRIMARY KEY,
+    username TEXT NOT NULL REFERENCES accounts (username),
+    post_link TEXT,
+    likes INTEGER,
+    comments INTEGER,
+    post_text TEXT,
+    date_of_pub TEXT,
+    scraped_at REAL
+);
+CREATE TABLE IF NOT EXISTS post_hashtags (
+    shortcode TEXT NOT NULL REFERENCES posts (shortcode),
+    hashtag TEXT NOT NULL,
+    PRIMARY KEY (shortcode, hashtag)
+);
+CREATE INDEX IF NOT EXISTS posts_username ON posts (username);
+CREATE INDEX IF NOT EXISTS posts_post_link ON posts (post_link);
+CREATE INDEX IF NOT EXISTS posts_date_of_pub ON posts (date_of_pub);
+CREATE INDEX IF NOT EXISTS post_hashtags_hashtag ON post_hashtags (hashtag);
+"""
+
+class FileSink:
+    '''
+    Base class of the streaming output sinks.
+
+    Accepted posts are buffered and written in batches. The file is
+    flushed after every batch and fsync'ed every `checkpoint_every`
+    posts, so a crash loses at most one batch instead of the whole run.
+
+    Args:
+        path (str): Path of the output file.
+        mode (str): "w" to start a new file, "a" to append to it.
+        batch_size (int): Number of posts buffered before a write.
+        checkpoint_every (int): Number of posts between two fsyncs.
+    '''
+    def __init__(self, path, mode = "w", batch_size = 50, checkpoint_every = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self._buffer = []
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+        is_new = mode == "w" or not os.path.exists(path) or \
+            os.path.getsize(path) == 0
+        self._file = open(path, mode = mode, newline = "", encoding = "utf-8")
+        if is_new:
+            self.write_header()
+
+    def write_header(self):
+        '''
+        Write the header of a new file. Nothing by default.
+        '''
+
+    def format(self, account, post):
+        '''
+        Build the record written for a post.
+        Args:
+            account (Account): The account the post belongs to.
+            post (Post): The accepted post.
+        '''
+        raise NotImplementedError
+
+    def write_records(self, records):
+        '''
+        Write a batch of records to the file.
+        Args:
+            records (list): Records built by format.
+        '''
+        raise NotImplementedError
+
+    def write(self, account, post):
+        '''
+        Buffer an accepted post and write the batch once it is full.
+        Args:
+            account (Account): The account the post belongs to.
+            post (Post): The accepted post.
+        '''
+        with self._lock:
+            self._buffer.append(self.format(account, post))
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.write_records(self._buffer)
+            self._unsynced += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+        if self._unsynced >= self.checkpoint_every:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def checkpoint(self):
+        '''
+        Write every buffered post and make the file durable on disk.
+        Returns:
+            dict: The size of the file by path, see Checkpoint.rewind_outputs.
+        '''
+        with self._lock:
+            self._flush()
+            self._sync()
+            return {self.path: os.fstat(self._file.fileno()).st_size}
+
+    def close(self):
+        '''
+        Checkpoint and close the file.
+        '''
+        if self._file.closed:
+            return
+        self.checkpoint()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CsvSink(FileSink):
+    '''
+    Stream accepted posts to a CSV file with the columns of CSV_HEADER.
+    '''
+    def __init__(self, path, *args, **kwargs):
+        self._writer = None
+        super().__init__(path, *args, **kwargs)
+        self._writer = csv.writer(self._file)
+
+    def write_header(self):
+        csv.writer(self._file).writerow(CSV_HEADER)
+
+    def format(self, account, post):
+        return csv_row(account, post)
+
+    def write_records(self, records):
+        self._writer.writerows(records)
+
+class JsonLinesSink(FileSink):
+    '''
+    Stream accepted posts to a JSON Lines file, one post per line
+    together with the fields of its account. The account fields come
+    first, so compact_json_lines can split them from the post fields
+    without decoding the posts.
+    '''
+    _encode = json.JSONEncoder(ensure_ascii = False).encode
+
+    def format(self, account, post):
+        return self._encode({
+            "username": account.username,
+            "followers": account.followers,
+            "user_link": account.user_link,
+            "post_text": post.post_text,
+            "post_link": post.post_link,
+            "likes": post.likes,
+            "comments": post.comments,
+            "date_of_pub": post.date_of_pub
+        })
+
+    def write_records(self, records):
+        self._file.write("\n".join(records) + "\n")
+
+def compact_json_lines(jsonl_path, json_path):
+    '''
+    Convert a JSON Lines file written by JsonLinesSink into a JSON file
+    of the accounts by username, each with its list of posts.
+    The posts are copied as they were encoded by JsonLinesSink, one per
+    line, and only the account fields of each line are decoded.
+    Args:
+        jsonl_path (str): Path of the JSON Lines file.
+        json_path (str): Path of the JSON file to write.
+    '''
+    accounts = {}
+    heads = {}
+
+    with open(jsonl_path, encoding = "utf-8") as file:
+        for line in file:
+            # a quote is always escaped inside JSON strings, so the first
+            # match is the key following the account fields
+            head, _, tail = line.rstrip().partition(', "post_text": ')
+            if not tail:
+                continue
+            account = heads.get(head)
+            if account is None:
+                account = heads[head] = json.loads(head + "}")
+            username = account["username"]
+            if username not in accounts:
+                accounts[username] = (account, [])
+            accounts[username][1].append(tail)
+
+    dumps = JsonLinesSink._encode
+    with open(json_path, mode = "w", encoding = "utf-8") as file:
+        if not accounts:
+            file.write("{}")
+            return
+
+        separator = ",\n            {\"post_text\": "
+        for index, (username, (account, posts)) in enumerate(accounts.items()):
+            file.write(
+                f"{',' if index else '{'}\n"
+                f"    {dumps(username)}: {{\n"
+                f"        \"followers\": {dumps(account['followers'])},\n"
+                f"        \"user_link\": {dumps(account['user_link'])},\n"
+                f"        \"username\": {dumps(username)},\n"
+                f"        \"posts\": [\n"
+                f"            {{\"post_text\": {separator.join(posts)}\n"
+                f"        ]\n"
+                f"    }}"
+            )
+        file.write("\n}")
+
+class SqliteSink:
+    '''
+    Store accepted posts in a SQLite database, upserting them by post
+    shortcode so re-scrapes update like and comment counts in place
+    instead of duplicating rows.
+
+    Posts are buffered and written in one transaction per batch.
+    Posts are indexed by username, post link and date of publication.
+
+    Args:
+        path (str): Path of the database file.
+        hashtag (str): The main hashtag the posts are scraped under.
+        batch_size (int): Number of posts buffered before a transaction.
+    '''
+    def __init__(self, path, hashtag = "", batch_size = 200):
+        self.path = path
+        self.hashtag = hashtag
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(SQLITE_SCHEMA)
+
+    def write(self, account, post):
+        '''
+        Buffer an accepted post and write the batch once it is full.
+        Args:
+            account (Account): The account the post belongs to.
+            post (Post): The accepted post.
+        '''
+        post_link = post.post_link
+        shortcode = post.shortcode or \
+            shortcode_from_url(post_link) or post_link
+        record = (
+            account.username,
+            account.followers,
+            account.user_link,
+            shortcode,
+            post_link,
+            post.likes,
+            post.comments,
+            post.post_text,
+            post.date_of_pub,
+        )
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        scraped_at = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO accounts (username, followers, user_link, updated_at)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (username) DO UPDATE SET"
+                " followers = excluded.followers,"
+                " user_link = excluded.user_link,"
+                " updated_at = excluded.updated_at",
+                [record[0:3] + (scraped_at,) for record in self._buffer]
+            )
+            self._connection.executemany(
+                "INSERT INTO posts (shortcode, username, post_link, likes,"
+                " comments, post_text, date_of_pub, scraped_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (shortcode) DO UPDATE SET"
+                " likes = excluded.likes,"
+                " comments = excluded.comments,"
+                " post_text = excluded.post_text,"
+                " scraped_at = excluded.scraped_at",
+                [
+                    (record[3], record[0]) + record[4:] + (scraped_at,)
+                    for record in self._buffer
+                ]
+            )
+            if self.hashtag:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO post_hashtags (shortcode, hashtag)"
+                    " VALUES (?, ?)",
+                    [(record[3], self.hashtag) for record in self._buffer]
+                )
+        self._buffer = []
+
+    def checkpoint(self):
+        '''
+        Write every buffered post to the database. Posts written again
+        after a resume are upserted, so there is no size to rewind to.
+        Returns:
+            dict: Nothing to rewind, an empty dict.
+        '''
+        with self._lock:
+            self._flush()
+        return {}
+
+    def close(self):
+        '''
+        Checkpoint and close the database.
+        '''
+        if self._connection is None:
+            return
+        self.checkpoint()
+        self._connection.close()
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def export_parquet(db_path, parquet_path, hashtag = None, batch_size = 50000):
+    '''
+    Export the posts of a SQLite database written by SqliteSink to a
+    Parquet file, one column per field, reading the rows in batches.
+    Args:
+        db_path (str): Path of the database file.
+        parquet_path (str): Path of the Parquet file to write.
+        hashtag (str): Only export the posts scraped under this hashtag.
+        batch_size (int): Number of rows converted at a time.
+    Raises:
+        ImportError: If pyarrow is not installed.
+    '''
+    if pa is None:
+        raise ImportError("pyarrow is required to export Parquet files.")
+
+    schema = pa.schema([
+        ("username", pa.string()),
+        ("followers", pa.int64()),
+        ("user_link", pa.string()),
+        ("shortcode", pa.string()),
+        ("post_link", pa.string()),
+        ("likes", pa.int64()),
+        ("comments", pa.int64()),
+        ("post_text", pa.string()),
+        ("date_of_pub", pa.string()),
+    ])
+    query = (
+        "SELECT a.username, a.followers, a.user_link, p.shortcode,"
+        " p.post_link, p.likes, p.comments, p.post_text, p.date_of_pub"
+        " FROM posts p JOIN accounts a ON a.username = p.username"
+    )
+    parameters = ()
+    if hashtag:
+        query += (
+            " WHERE p.shortcode IN"
+            " (SELECT shortcode FROM post_hashtags WHERE hashtag = ?)"
+        )
+        parameters = (hashtag,)
+
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.execute(query, parameters)
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write_batch(
+                    pa.record_batch(
+                        [pa.array(column, field.type)
+                         for column, field in zip(columns, schema)],
+                        schema = schema
+                    )
+                )
+    finally:
+        connection.close()
+
+class SegmentSinks:
+    '''
+    Route accepted posts to the sinks of the segments their caption
+    matches, so that one crawl fills the outputs of several segments.
+
+    Args:
+        segments (dict): Hashtag rules by segment name.
+        sinks (dict): The path prefix and the sinks of every segment,
+                      by segment name.
+    '''
+    def __init__(self, segments, sinks):
+        self.matcher = CaptionMatcher(segments)
+        self.sinks = sinks
+
+    def write(self, account, post):
+        '''
+        Write an accepted post to the sinks of its segments.
+        Args:
+            account (Account): The account the post belongs to.
+            post (Post): The accepted post.
+        '''
+        for name in self.matcher.match(post.post_text or ""):
+            for sink in self.sinks[name][1]:
+                sink.write(account, post)
+
+    def checkpoint(self):
+        '''
+        Checkpoint the sinks of every segment.
+        Returns:
+            dict: The sizes of the segments' files by path.
+        '''
+        sizes = {}
+        for _, sinks in self.sinks.values():
+            for sink in sinks:
+                sizes.update(sink.checkpoint())
+        return sizes
+
+    def close(self):
+        '''
+        Close the sinks of every segment and compact their JSON files.
+        '''
+        for prefix, sinks in self.sinks.values():
+            close_sinks(sinks, prefix)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_sinks(prefix, mode = "w", db_path = None, segments = None, hashtag = None):
+    '''
+    Open the CSV and JSON Lines sinks of a hashtag, or the SQLite sink
+    if a database is given.
+    Args:
+        prefix (str): The path prefix of the filenames, e.g. the hashtag.
+        mode (str): "w" to start new files, "a" to append to them.
+        db_path (str): Path of a SQLite database to upsert posts into.
+        segments (dict): Hashtag rules by segment name. If given, every
+                         segment gets its own sinks, named after the
+                         prefix and the segment.
+        hashtag (str): The main hashtag the database records the posts
+                       under. The prefix is used if not given.
+    Returns:
+        list: The opened sinks.
+    '''
+    if hashtag is None:
+        hashtag = prefix
+
+    if segments:
+        return [
+            SegmentSinks(segments, {
+                name: (
+                    f"{prefix}_{name}",
+                    open_sinks(f"{prefix}_{name}", mode, db_path, hashtag = hashtag)
+                )
+                for name in segments
+            })
+        ]
+
+    if db_path:
+        return [SqliteSink(db_path, hashtag)]
+
+    return [
+        CsvSink(f"{prefix}.csv", mode),
+        JsonLinesSink(f"{prefix}.jsonl", mode)
+    ]
+
+def close_sinks(sinks, hashtag = None):
+    '''
+    Close the sinks and, if a hashtag is given, compact its JSON Lines
+    file into "{hashtag}.json".
+    Args:
+        sinks (list): The sinks to close.
+        hashtag (str): The hashtag used for the filenames.
+    '''
+    for sink in sinks:
+        sink.close()
+
+    if hashtag is not None and \
+            any(isinstance(sink, JsonLinesSink) for sink in sinks):
+        compact_json_lines(f"{hashtag}.jsonl", f"{hashtag}.json")
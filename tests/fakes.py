@@ -0,0 +1,321 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import urlparse, parse_qs
+from urllib.request import Request, urlopen
+from selenium.common.exceptions import NoSuchWindowException, WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webelement import WebElement
+from capture import shortcode_from_url, shortcode_to_media_id
+from constants import *
+
+def media_info(code, username, user_id, caption = "#pizza", taken_at = 1700000000, coauthors = ()):
+    return {
+        "items": [{
+            "pk": shortcode_to_media_id(code),
+            "code": code,
+            "taken_at": taken_at,
+            "like_count": 10,
+            "comment_count": 2,
+            "caption": {"text": caption} if caption is not None else None,
+            "user": {"pk": user_id, "username": username},
+            "coauthor_producers": [
+                {"pk": "9", "username": coauthor} for coauthor in coauthors
+            ],
+        }]
+    }
+
+def user_info(username, user_id, is_business = True, category = "Restaurant", followers = 1200):
+    return {
+        "user": {
+            "pk": user_id,
+            "username": username,
+            "is_business": is_business,
+            "category": category,
+            "follower_count": followers,
+        }
+    }
+
+class StandInSite:
+    '''
+    Local HTTP server standing in for the site's API: the hashtag
+    listing, paged by `page_size`, and the media and user info of the
+    posts added to it, as fixture JSON.
+
+    Responses can be delayed by path, and queued responses, e.g. a 429
+    or a 500, are served once each before the fixtures.
+    '''
+    def __init__(self, page_size = 3):
+        self.page_size = page_size
+        self.posts = []
+        self.fixtures = {}
+        self.delays = {}
+        self.queued = {}
+        self.hits = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add_post(self, code, username, user_id = None, caption = "#pizza", taken_at = 1700000000, coauthors = (), **user):
+        user_id = user_id or str(abs(hash(username)) % 10 ** 9)
+        media = media_info(code, username, user_id, caption, taken_at, coauthors)
+        self.posts.append(media["items"][0])
+        self.fixtures[MEDIA_INFO_URL.format(media_id = shortcode_to_media_id(code))] = media
+        self.fixtures[USER_INFO_URL.format(user_id = user_id)] = user_info(username, user_id, **user)
+
+    def queue(self, path, status, payload = None):
+        with self._lock:
+            self.queued.setdefault(path, []).append((status, payload or {}))
+
+    def listing(self, page):
+        start = page * self.page_size
+        medias = [
+            {"media": {key: post[key] for key in ("pk", "code", "taken_at", "coauthor_producers")}}
+            for post in self.posts[start:start + self.page_size]
+        ]
+        more = start + self.page_size < len(self.posts)
+        return {
+            "sections": [{"layout_content": {"medias": medias}}],
+            "more_available": more,
+            "next_max_id": str(page + 1) if more else "",
+            "next_page": page + 1 if more else "",
+        }
+
+    def respond(self, path, params):
+        with self._lock:
+            self.hits.append(path)
+            queued = self.queued.get(path)
+            if queued:
+                return queued.pop(0)
+        time.sleep(self.delays.get(path, 0))
+
+        if "/tags/" in path:
+            return 200, self.listing(int(params.get("page", ["0"])[0] or 0))
+        if path in self.fixtures:
+            return 200, self.fixtures[path]
+        return 404, {"status": "fail"}
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, params):
+                status, payload = site.respond(urlparse(self.path).path, params)
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self._reply(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target = self._server.serve_forever, daemon = True).start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class FakeRequest:
+    def __init__(self, url, status_code, body):
+        self.url = url
+        self.response = FakeResponse(status_code, body)
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.headers = {"Content-Encoding": "identity"}
+        self.body = body
+
+class FakeElement(WebElement):
+    def __init__(self, parent, href = ""):
+        super().__init__(parent, "fake-element")
+        self.href = href
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def get_attribute(self, name):
+        return self.href if name == "href" else None
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def new_window(self, type_hint = None):
+        self.driver.opened += 1
+        handle = f"tab-{self.driver.opened}"
+        self.driver.windows[handle] = ""
+        self.driver.current_window_handle = handle
+
+    def window(self, handle):
+        if handle not in self.driver.windows:
+            raise NoSuchWindowException(handle)
+        self.driver.current_window_handle = handle
+
+class FakeDriver:
+    '''
+    Stand-in for a selenium-wire WebDriver browsing a StandInSite.
+
+    Opening a hashtag page loads the first page of its listing into
+    the grid, every scroll loads the next one, opening a post loads its
+    media info and hovering loads the user info of its author. Every
+    response goes through the response interceptor and into `requests`,
+    like in selenium-wire. A `dead` driver fails every navigation.
+    '''
+    def __init__(self, site):
+        self.site = site
+        self.windows = {"tab-0": ""}
+        self.current_window_handle = "tab-0"
+        self.opened = 0
+        self.switch_to = FakeSwitchTo(self)
+        self.response_interceptor = None
+        self.scopes = []
+        self.cookies = {}
+        self.visited = []
+        self.cdp = []
+        self.quit_called = False
+        self.dead = False
+        self.author = None
+        self._requests = []
+        self._grid = []
+        self._next_page = None
+        self._height = 0
+
+    @property
+    def current_url(self):
+        return self.windows[self.current_window_handle]
+
+    @property
+    def requests(self):
+        return list(self._requests)
+
+    @requests.deleter
+    def requests(self):
+        self._requests = []
+
+    def _load(self, path, data = None):
+        url = self.site.url + path
+        request = Request(url, data = data, method = "POST" if data is not None else "GET")
+        try:
+            with urlopen(request) as response:
+                status, body = response.status, response.read()
+        except HTTPError as error:
+            status, body = error.code, error.read()
+
+        request = FakeRequest(url, status, body)
+        self._requests.append(request)
+        if self.response_interceptor is not None:
+            self.response_interceptor(request, request.response)
+        return status, body
+
+    def _load_listing(self, tag, page):
+        status, body = self._load(
+            TAG_SECTIONS_URL.format(tag = tag), f"tab=recent&page={page}".encode("utf-8")
+        )
+        self._next_page = None
+        if status == 200:
+            listing = json.loads(body)
+            self._grid += [
+                media["media"]["code"]
+                for section in listing["sections"]
+                for media in section["layout_content"]["medias"]
+            ]
+            if listing["more_available"]:
+                self._next_page = (tag, listing["next_page"])
+
+    def get(self, url):
+        if self.quit_called or self.dead:
+            raise WebDriverException("The browser is gone.")
+        if self.current_window_handle not in self.windows:
+            raise NoSuchWindowException(self.current_window_handle)
+        self.windows[self.current_window_handle] = url
+        self.visited.append(url)
+        self.author = None
+
+        path = urlparse(url).path
+        if path.startswith("/explore/tags/"):
+            self._grid = []
+            self._load_listing(path.strip("/").split("/")[-1], 0)
+        elif shortcode_from_url(url):
+            status, body = self._load(MEDIA_INFO_URL.format(
+                media_id = shortcode_to_media_id(shortcode_from_url(url))
+            ))
+            if status == 200:
+                self.author = json.loads(body)["items"][0]["user"]
+
+    def execute(self, command, params = None):
+        # the only command sent directly is ActionChains' hover
+        if command == Command.W3C_ACTIONS and self.author is not None:
+            self._load(USER_INFO_URL.format(user_id = self.author["pk"]))
+        return {"value": None}
+
+    def execute_script(self, script, *args):
+        if "querySelectorAll" in script:
+            return [f"{BASE_URL}/p/{code}/" for code in self._grid]
+        if "scrollTo" in script:
+            if self._next_page is not None:
+                self._load_listing(*self._next_page)
+            # the page always grows after a scroll, so the harvest
+            # never waits on it
+            self._height += 1
+            return self._height - 1
+        return self._height
+
+    def execute_async_script(self, script, *args):
+        # the only async script is the session check, answered by the site
+        status, body = self._load(args[0])
+        return status == 200
+
+    def execute_cdp_cmd(self, command, params):
+        self.cdp.append((self.current_window_handle, command))
+        return {}
+
+    def find_element(self, by, value):
+        if self.dead:
+            raise WebDriverException("The browser is gone.")
+        href = f"{BASE_URL}/{self.author['username']}/" if self.author else ""
+        return FakeElement(self, href)
+
+    def find_elements(self, by, value):
+        return [self.find_element(by, value)]
+
+    def close(self):
+        del self.windows[self.current_window_handle]
+
+    def quit(self):
+        self.quit_called = True
+
+    def refresh(self):
+        pass
+
+    def get_cookies(self):
+        return list(self.cookies.values())
+
+    def get_cookie(self, name):
+        return self.cookies.get(name)
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie["name"]] = cookie
+
+    def delete_all_cookies(self):
+        self.cookies = {}
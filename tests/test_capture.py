@@ -0,0 +1,82 @@
+import time
+import threading
+import pytest
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.action_chains import ActionChains
+import capture
+from capture import ResponseCapture, shortcode_to_media_id
+from governor import RateGovernor
+from constants import MEDIA_INFO_URL, USERNAME_LINK_SELECTOR
+from fakes import StandInSite, FakeDriver
+
+@pytest.fixture
+def site():
+    site = StandInSite()
+    site.add_post("Cpost00", "shop", "7")
+    site.add_post("Cpost01", "other", "8")
+    site.start()
+    yield site
+    site.stop()
+
+@pytest.fixture
+def driver(site):
+    return FakeDriver(site)
+
+def media_id(code):
+    return shortcode_to_media_id(code)
+
+def test_media_and_user_info_are_captured(driver):
+    responses = ResponseCapture().attach(driver)
+    driver.get("https://www.instagram.com/p/Cpost00/")
+    # hovering the username requests the user info
+    link = driver.find_element(By.CSS_SELECTOR, USERNAME_LINK_SELECTOR)
+    ActionChains(driver).move_to_element(link).perform()
+
+    media = responses.wait_for("media", media_id("Cpost00"), timeout = 1)
+    assert media["items"][0]["user"]["username"] == "shop"
+    # user info is kept by user id and by username
+    assert responses.wait_for("user", "7", timeout = 1)["user"]["username"] == "shop"
+    assert responses.wait_for("user", "shop", timeout = 1)["user"]["pk"] == "7"
+    # a payload is handed out once
+    with pytest.raises(TimeoutError):
+        responses.wait_for("media", media_id("Cpost00"), timeout = 0.05)
+
+def test_wait_for_blocks_until_a_delayed_response(site, driver):
+    responses = ResponseCapture().attach(driver)
+    site.delays[MEDIA_INFO_URL.format(media_id = media_id("Cpost01"))] = 0.3
+    start = time.monotonic()
+    thread = threading.Thread(
+        target = driver.get, args = ("https://www.instagram.com/p/Cpost01/",)
+    )
+    thread.start()
+
+    media = responses.wait_for("media", media_id("Cpost01"), timeout = 5)
+    thread.join()
+    assert time.monotonic() - start >= 0.3
+    assert media["items"][0]["code"] == "Cpost01"
+
+def test_failed_responses_are_not_captured(site, driver):
+    responses = ResponseCapture().attach(driver)
+    site.queue(MEDIA_INFO_URL.format(media_id = media_id("Cpost00")), 500)
+    driver.get("https://www.instagram.com/p/Cpost00/")
+    with pytest.raises(TimeoutError):
+        responses.wait_for("media", media_id("Cpost00"), timeout = 0.05)
+
+def test_throttled_responses_are_reported(site, driver, monkeypatch):
+    paced = RateGovernor(enabled = True, rate = 100)
+    monkeypatch.setattr(capture, "governor", paced)
+    responses = ResponseCapture().attach(driver)
+    site.queue(MEDIA_INFO_URL.format(media_id = media_id("Cpost00")), 429)
+    driver.get("https://www.instagram.com/p/Cpost00/")
+
+    assert responses.throttle_events == 1
+    assert paced.throttle_events == 1
+
+def test_unclaimed_payloads_are_bounded(driver):
+    responses = ResponseCapture(max_pending = 1).attach(driver)
+    driver.get("https://www.instagram.com/p/Cpost00/")
+    driver.get("https://www.instagram.com/p/Cpost01/")
+
+    assert responses.wait_for("media", media_id("Cpost01"), timeout = 0.05)
+    with pytest.raises(TimeoutError):
+        responses.wait_for("media", media_id("Cpost00"), timeout = 0.05)
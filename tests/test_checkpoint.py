@@ -0,0 +1,77 @@
+import os
+from checkpoint import Checkpoint
+from parser import Account, Post
+from sinks import open_sinks, close_sinks
+
+FILTERS = {"hashtag": "pizza", "main_category": "Restaurant", "backup_category": ""}
+
+def post(shortcode):
+    return Post("#pizza", f"https://www.instagram.com/p/{shortcode}/", 3, 1, "2024-01-01")
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "food.checkpoint.json")
+    checkpoint = Checkpoint(path, FILTERS, 5)
+    account = Account(120, "https://www.instagram.com/pizzeria/", "pizzeria")
+    account.append_post(post("A"))
+    checkpoint.accounts["pizzeria"] = account
+    checkpoint.record("A", 1)
+    checkpoint.record("B", 2)
+    checkpoint.save()
+
+    loaded = Checkpoint.load(path)
+    assert loaded.filters == FILTERS
+    assert loaded.num_accounts == 5
+    assert loaded.scrolls == 2
+    assert loaded.is_visited("A") and loaded.is_visited("B")
+    assert not loaded.is_visited("C")
+    restored = loaded.accounts["pizzeria"]
+    assert restored.followers == 120
+    assert [p.post_link for p in restored.posts] == [post("A").post_link]
+
+def test_load_without_checkpoint(tmp_path):
+    assert Checkpoint.load(str(tmp_path / "missing.json")) is None
+
+def test_record_saves_every_n_posts(tmp_path):
+    path = str(tmp_path / "food.checkpoint.json")
+    checkpoint = Checkpoint(path, FILTERS, 5, every = 2)
+    checkpoint.record("A", 1)
+    assert not os.path.exists(path)
+    checkpoint.record("B", 2)
+    assert Checkpoint.load(path).visited == {"A", "B"}
+
+def test_resume_rewinds_rows_written_after_the_last_save(tmp_path):
+    prefix = str(tmp_path / "food")
+    path = f"{prefix}.checkpoint.json"
+    account = Account(120, "https://www.instagram.com/pizzeria/", "pizzeria")
+
+    sinks = open_sinks(prefix)
+    checkpoint = Checkpoint(path, FILTERS, 5, every = 2)
+    for scrolls, shortcode in enumerate(["A", "B", "C"], start = 1):
+        for sink in sinks:
+            sink.write(account, post(shortcode))
+        checkpoint.record(shortcode, scrolls, sinks)
+    # a batch written after the last save, then a hard kill
+    for sink in sinks:
+        sink.checkpoint()
+
+    resumed = Checkpoint.load(path)
+    assert resumed.visited == {"A", "B"}
+    resumed.rewind_outputs()
+
+    sinks = open_sinks(prefix, "a")
+    for sink in sinks:
+        sink.write(account, post("C"))
+    close_sinks(sinks, prefix)
+
+    with open(f"{prefix}.csv", encoding = "utf-8") as file:
+        rows = file.read().splitlines()
+    assert rows[0].startswith("username")
+    assert [row.split(",")[3] for row in rows[1:]] == [
+        post(shortcode).post_link for shortcode in "ABC"
+    ]
+    with open(f"{prefix}.jsonl", encoding = "utf-8") as file:
+        assert len(file.read().splitlines()) == 3
+
+def test_rewind_without_saved_outputs(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "food.checkpoint.json"), FILTERS, 5)
+    checkpoint.rewind_outputs()
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+import governor
+import http_engine
+from http_engine import HttpEngine
+from user_cache import UserCache
+from capture import shortcode_to_media_id
+from constants import MEDIA_INFO_URL, TAG_SECTIONS_URL, USER_INFO_URL
+from fakes import StandInSite
+
+@pytest.fixture
+def site():
+    site = StandInSite(page_size = 3)
+    for number in range(6):
+        site.add_post(f"Cpost{number:02d}", f"shop{number % 3}", str(number % 3 + 1))
+    site.add_post("Cpost06", "blogger", "4", is_business = False)
+    site.start()
+    yield site
+    site.stop()
+
+def scrape(site, num_accounts = 10):
+    engine = HttpEngine(
+        [{"name": "csrftoken", "value": "token"}],
+        concurrency = 2,
+        base_url = site.url,
+        user_cache = UserCache(":memory:")
+    )
+    return asyncio.run(engine.scrape("pizza", num_accounts))
+
+def media_path(code):
+    return MEDIA_INFO_URL.format(media_id = shortcode_to_media_id(code))
+
+def test_listing_pages_and_posts_are_fetched(site):
+    accounts, duration, visited = scrape(site)
+
+    assert sorted(accounts) == ["shop0", "shop1", "shop2"]
+    assert sum(len(account.posts) for account in accounts.values()) == 6
+    assert visited == 7
+    # three pages of listing
+    assert site.hits.count(TAG_SECTIONS_URL.format(tag = "pizza")) == 3
+    assert USER_INFO_URL.format(user_id = "4") in site.hits
+
+def test_throttled_request_is_retried_after_the_backoff(site, monkeypatch):
+    paced = governor.RateGovernor(enabled = True, rate = 100)
+    monkeypatch.setattr(http_engine, "governor", paced)
+    monkeypatch.setattr(governor, "GOVERNOR_BACKOFF_BASE", 0.05)
+    monkeypatch.setattr(governor, "GOVERNOR_MAX_RATE", 1000)
+    site.queue(media_path("Cpost00"), 429, {"message": "Please wait a few minutes"})
+
+    accounts, duration, visited = scrape(site)
+
+    assert paced.throttle_events == 1
+    assert site.hits.count(media_path("Cpost00")) == 2
+    # the links are built on the base URL
+    links = [post.post_link for post in accounts["shop0"].posts]
+    assert f"{site.url}/p/Cpost00/" in links
+
+def test_failing_post_is_skipped(site):
+    site.queue(media_path("Cpost01"), 500)
+
+    accounts, duration, visited = scrape(site)
+
+    assert visited == 7
+    assert sum(len(account.posts) for account in accounts.values()) == 5
+
+def test_failing_listing_page_ends_the_scrape(site):
+    site.queue(TAG_SECTIONS_URL.format(tag = "pizza"), 500)
+
+    accounts, duration, visited = scrape(site)
+
+    assert accounts == {}
+    assert visited == 0
@@ -0,0 +1,43 @@
+import pytest
+from matcher import HashtagRule, CaptionMatcher, hashtags_in, split_hashtags
+
+def test_hashtags_in_normalizes_case_and_unicode():
+    assert hashtags_in("Dinner #Food #ＰＩＺＺＡ and #food") == {"food", "pizza"}
+
+def test_hashtags_in_trims_emoji_and_punctuation():
+    assert hashtags_in("#food🍕 #pasta, #wine!") == {"food", "pasta", "wine"}
+
+def test_hashtags_in_keeps_joiners_and_other_scripts():
+    assert hashtags_in("#street_food #हिंदी") == {"street_food", "हिंदी"}
+
+def test_hashtags_in_without_hashtags():
+    assert hashtags_in("no hashtags here") == set()
+
+def test_split_hashtags():
+    assert split_hashtags("food, #Pizza  pasta") == ["food", "pizza", "pasta"]
+    assert split_hashtags(["#Food", " "]) == ["food"]
+
+def test_rule_from_config_rejects_unknown_keys():
+    with pytest.raises(ValueError):
+        HashtagRule.from_config({"any": ["food"], "some": ["pizza"]})
+
+def test_matcher_matches_whole_hashtags_only():
+    matcher = CaptionMatcher({"food": HashtagRule(["food"])})
+    assert matcher.match("#foodie") == []
+    assert matcher.match("#Food") == ["food"]
+
+def test_matcher_any_all_none():
+    matcher = CaptionMatcher({
+        "italian": HashtagRule.from_config(["pizza", "pasta"]),
+        "vegan_pizza": HashtagRule.from_config({"all": ["pizza", "vegan"]}),
+        "no_meat": HashtagRule.from_config({"any": ["pizza"], "none": ["meat"]}),
+    })
+    assert matcher.match("#pasta") == ["italian"]
+    assert matcher.match("#pizza #vegan") == ["italian", "vegan_pizza", "no_meat"]
+    assert matcher.match("#pizza #meat") == ["italian"]
+    assert matcher.match("#vegan") == []
+
+def test_matcher_unconditional_rule():
+    matcher = CaptionMatcher({"anything": HashtagRule(none_of = ["spam"])})
+    assert matcher.match("no hashtags") == ["anything"]
+    assert matcher.match("#spam") == []
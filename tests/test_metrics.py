@@ -0,0 +1,38 @@
+from metrics import Metrics
+
+def summary_of(values):
+    metrics = Metrics(enabled = True)
+    for value in values:
+        metrics.observe("stage", value)
+    return metrics.summary()["stages"]["stage"]
+
+def test_summary_nearest_rank_odd_sample():
+    stage = summary_of([5, 3, 1, 4, 2])
+    assert stage["count"] == 5
+    assert stage["sum"] == 15
+    assert stage["p50"] == 3
+    assert stage["p95"] == 5
+    assert stage["p99"] == 5
+
+def test_summary_nearest_rank_even_sample():
+    stage = summary_of(range(1, 101))
+    assert stage["p50"] == 50
+    assert stage["p95"] == 95
+    assert stage["p99"] == 99
+
+def test_summary_single_sample():
+    stage = summary_of([0.25])
+    assert stage["p50"] == stage["p95"] == stage["p99"] == 0.25
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    with metrics.timer("stage"):
+        pass
+    metrics.increment("counter")
+    assert metrics.summary() == {"stages": {}, "counters": {}}
+
+def test_counters():
+    metrics = Metrics(enabled = True)
+    metrics.increment("posts")
+    metrics.increment("posts", 2)
+    assert metrics.summary()["counters"] == {"posts": 3}
@@ -0,0 +1,23 @@
+from tqdm import tqdm
+from parser import PostFilter, StaticElement, record_post
+from payloads import extract_media
+from fakes import media_info, user_info
+
+def test_record_post_without_caption():
+    # the slim media record keeps a missing caption as None
+    media = extract_media(media_info("Cpost00", "shop", "1", caption = None))
+    assert PostFilter().check_media(media) is None
+
+    accounts = {}
+    record_post(
+        user_info("shop", "1"),
+        media,
+        StaticElement(datetime = "2023-11-14"),
+        StaticElement(href = "https://www.instagram.com/shop/"),
+        accounts,
+        tqdm(disable = True),
+        "https://www.instagram.com/p/Cpost00/"
+    )
+
+    post, = accounts["shop"].posts
+    assert post.post_text == ""
@@ -0,0 +1,104 @@
+import os
+import gzip
+import json
+import zlib
+import pytest
+from payloads import decompress, parse_payload, extract_media, extract_user
+from constants import DECODE_CHUNK_SIZE
+
+USER = {
+    "user": {
+        "pk": "42",
+        "username": "pizzeria",
+        "is_business": True,
+        "category": "Restaurant",
+        "follower_count": 1200,
+        "profile_pic_url": "https://example.com/pic.jpg",
+    }
+}
+
+MEDIA = {
+    "items": [{
+        "pk": "3100",
+        "code": "Cabc123",
+        "taken_at": 1700000000,
+        "like_count": 10,
+        "comment_count": 2,
+        "caption": {"text": "#pizza " * 5000, "pk": "1"},
+        "user": {"pk": "42", "username": "pizzeria", "full_name": "Pizzeria"},
+        "coauthor_producers": [],
+        "image_versions2": {"candidates": [{"url": "https://example.com/a.jpg"}]},
+    }]
+}
+
+def encoded(payload):
+    return json.dumps(payload).encode("utf-8")
+
+def test_decompress_identity():
+    body = encoded(USER)
+    assert decompress(body) is body
+    assert decompress(body, None) is body
+
+def test_decompress_gzip_over_several_chunks():
+    body = encoded({"data": os.urandom(DECODE_CHUNK_SIZE).hex()})
+    compressed = gzip.compress(body)
+    assert len(compressed) > DECODE_CHUNK_SIZE
+    assert decompress(compressed, "gzip") == body
+    assert decompress(compressed, " GZIP ") == body
+
+def test_decompress_deflate():
+    body = encoded(USER)
+    assert decompress(zlib.compress(body), "deflate") == body
+
+def test_decompress_brotli():
+    brotli = pytest.importorskip("brotli")
+    body = encoded(MEDIA)
+    assert decompress(brotli.compress(body), "br") == body
+
+def test_decompress_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    body = encoded(MEDIA)
+    assert decompress(zstandard.ZstdCompressor().compress(body), "zstd") == body
+
+def test_decompress_errors():
+    with pytest.raises(ValueError):
+        decompress(b"not gzip at all", "gzip")
+    with pytest.raises(ValueError):
+        decompress(b"data", "compress")
+
+def test_parse_user_keeps_read_fields():
+    record = parse_payload("user", gzip.compress(encoded(USER)), "gzip")
+    assert record == {
+        "user": {
+            "pk": "42",
+            "username": "pizzeria",
+            "is_business": True,
+            "category": "Restaurant",
+            "follower_count": 1200,
+        }
+    }
+
+def test_parse_media_keeps_read_fields():
+    record = parse_payload("media", encoded(MEDIA))
+    item = record["items"][0]
+    assert set(item) == {
+        "pk", "code", "taken_at", "like_count", "comment_count",
+        "caption", "user", "coauthor_producers",
+    }
+    assert item["caption"] == {"text": MEDIA["items"][0]["caption"]["text"]}
+    assert item["user"] == {"pk": "42", "username": "pizzeria"}
+    assert item["coauthor_producers"] == []
+
+def test_parse_media_without_caption():
+    media = {"items": [dict(MEDIA["items"][0], caption = None)]}
+    assert extract_media(media)["items"][0]["caption"] is None
+
+def test_parse_payload_errors():
+    with pytest.raises(ValueError):
+        parse_payload("user", b"{not json")
+    with pytest.raises(ValueError):
+        parse_payload("media", gzip.compress(encoded(MEDIA))[:100], "gzip")
+    with pytest.raises(ValueError):
+        extract_user({"status": "fail"})
+    with pytest.raises(ValueError):
+        extract_media({"items": []})
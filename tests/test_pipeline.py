@@ -0,0 +1,79 @@
+import pytest
+from tqdm import tqdm
+from parser import PostFilter
+from pipeline import PostPipeline
+from fakes import media_info, user_info
+
+class ListSink:
+    def __init__(self, fail_after = None):
+        self.posts = []
+        self.fail_after = fail_after
+
+    def write(self, account, post):
+        if self.fail_after is not None and len(self.posts) >= self.fail_after:
+            raise OSError("No space left on device")
+        self.posts.append((account.username, post.post_link))
+
+    def checkpoint(self):
+        return {}
+
+    def close(self):
+        pass
+
+def submit_post(pipeline, number, media = None):
+    username = f"shop{number}"
+    code = f"Cpost{number:02d}"
+    pipeline.submit(
+        f"https://www.instagram.com/p/{code}/",
+        user_info(username, str(number)),
+        f"https://www.instagram.com/{username}/",
+        media or media_info(code, username, str(number)),
+        number
+    )
+
+def pipeline_with(sink, workers = 1, queue_size = 1):
+    return PostPipeline(
+        PostFilter(), {}, 100, tqdm(disable = True), [sink],
+        workers = workers, queue_size = queue_size
+    ).start()
+
+def test_pipeline_records_posts():
+    sink = ListSink()
+    pipeline = pipeline_with(sink, workers = 2)
+    for number in range(5):
+        submit_post(pipeline, number)
+    pipeline.close()
+
+    assert sorted(username for username, _ in sink.posts) == [f"shop{number}" for number in range(5)]
+    assert len(pipeline.visited) == 5
+
+def test_unreadable_post_is_skipped():
+    sink = ListSink()
+    pipeline = pipeline_with(sink)
+    submit_post(pipeline, 0, media = {"items": []})
+    submit_post(pipeline, 1)
+    pipeline.close()
+
+    assert sink.posts == [("shop1", "https://www.instagram.com/p/Cpost01/")]
+    assert pipeline.error is None
+
+def test_sink_error_stops_the_pipeline_and_is_raised_by_submit():
+    sink = ListSink(fail_after = 1)
+    pipeline = pipeline_with(sink)
+    with pytest.raises(OSError):
+        # the queue fills up behind the failed worker, submit mustn't spin
+        for number in range(10):
+            submit_post(pipeline, number)
+    # and close doesn't block on the full queue nor raise it twice
+    pipeline.close()
+
+    assert pipeline.done.is_set()
+    assert len(sink.posts) == 1
+
+def test_sink_error_is_raised_by_close():
+    sink = ListSink(fail_after = 0)
+    pipeline = pipeline_with(sink, queue_size = 10)
+    submit_post(pipeline, 0)
+    with pytest.raises(OSError):
+        pipeline.close()
+    assert not pipeline.visited
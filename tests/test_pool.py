@@ -0,0 +1,102 @@
+import threading
+import pytest
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from pool import DriverPool, KeyedLock
+from user_cache import UserCache
+from fakes import StandInSite, FakeDriver
+
+class ListSink:
+    def __init__(self, error = None):
+        self.posts = []
+        self.error = error
+
+    def write(self, account, post):
+        if self.error is not None:
+            raise self.error
+        self.posts.append((account.username, post.post_link))
+
+    def checkpoint(self):
+        return {}
+
+    def close(self):
+        pass
+
+class SlowDriver(FakeDriver):
+    def get(self, url):
+        if "Cpost00" in url:
+            raise TimeoutException("Timed out receiving message from renderer")
+        super().get(url)
+
+@pytest.fixture
+def site():
+    site = StandInSite()
+    for number in range(6):
+        site.add_post(f"Cpost{number:02d}", f"shop{number % 3}")
+    site.start()
+    yield site
+    site.stop()
+
+def post_links(site):
+    return [f"https://www.instagram.com/p/{post['code']}/" for post in site.posts]
+
+def scrape(site, driver_factory, num_accounts = 3, sinks = None):
+    with DriverPool(driver_factory, 2, user_cache = UserCache(":memory:")) as pool:
+        return pool.scrape(post_links(site), num_accounts, sinks = sinks)
+
+def test_pool_scrapes_posts_with_fake_drivers(site):
+    sink = ListSink()
+    accounts, duration, visited = scrape(site, lambda: FakeDriver(site), sinks = [sink])
+
+    assert sorted(accounts) == ["shop0", "shop1", "shop2"]
+    assert 3 <= visited <= 6
+    assert len(sink.posts) == visited
+
+def test_pool_stops_at_the_target(site):
+    accounts, duration, visited = scrape(site, lambda: FakeDriver(site), num_accounts = 1)
+    assert len(accounts) == 1
+
+def test_timed_out_page_only_loses_its_post(site):
+    sink = ListSink()
+    accounts, duration, visited = scrape(site, lambda: SlowDriver(site), sinks = [sink])
+
+    assert sorted(accounts) == ["shop0", "shop1", "shop2"]
+    assert "https://www.instagram.com/p/Cpost00/" not in [link for _, link in sink.posts]
+
+def test_dead_browser_stops_the_pool(site):
+    drivers = []
+
+    def driver_factory():
+        drivers.append(FakeDriver(site))
+        drivers[-1].dead = len(drivers) == 2
+        return drivers[-1]
+
+    with pytest.raises(WebDriverException):
+        scrape(site, driver_factory)
+    assert all(driver.quit_called for driver in drivers)
+
+def test_sink_error_stops_the_pool(site):
+    with pytest.raises(OSError):
+        scrape(site, lambda: FakeDriver(site), sinks = [ListSink(OSError("disk full"))])
+
+def test_keyed_lock_drops_unused_locks():
+    locks = KeyedLock()
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with locks.hold("shop"):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target = hold)
+    thread.start()
+    entered.wait(5)
+    with locks.hold("other"):
+        assert len(locks) == 2
+    assert len(locks) == 1
+    release.set()
+    thread.join()
+
+    with locks.hold("shop"):
+        pass
+    assert len(locks) == 0
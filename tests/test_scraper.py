@@ -0,0 +1,58 @@
+import pytest
+import scraper
+from scraper import scrape_instagram_posts
+from checkpoint import Checkpoint
+from parser import PostFilter
+from user_cache import UserCache
+from capture import shortcode_to_media_id
+from constants import MEDIA_INFO_URL
+from fakes import StandInSite, FakeDriver
+
+@pytest.fixture
+def site():
+    site = StandInSite(page_size = 2)
+    for number in range(5):
+        site.add_post(f"Cpost{number:02d}", f"shop{number}")
+    site.start()
+    yield site
+    site.stop()
+
+def scrape(site, **kwargs):
+    driver = FakeDriver(site)
+    driver.get("https://www.instagram.com/explore/tags/pizza/")
+    return scrape_instagram_posts(
+        driver, 10, user_cache = UserCache(":memory:"), **kwargs
+    )
+
+def test_end_of_the_grid_is_reported(site, capsys):
+    accounts, duration, visited = scrape(site)
+
+    assert len(accounts) == 5
+    assert "The very last post with entered hashtag was reached!" in capsys.readouterr().out
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_harvest_limit_is_reported(site, capsys, stream):
+    accounts, duration, visited = scrape(site, max_posts = 3, stream = stream)
+
+    assert len(accounts) == 3
+    out = capsys.readouterr().out
+    assert "The limit of 3 posts to visit was reached!" in out
+    assert "very last post" not in out
+
+@pytest.mark.parametrize("pipeline_workers", [0, 2])
+def test_timed_out_posts_are_not_processed(site, tmp_path, monkeypatch, pipeline_workers):
+    monkeypatch.setattr(scraper.governor, "timeout", lambda default = None: 0.1)
+    # the media info of the first post fails, so the capture never gets it
+    site.queue(MEDIA_INFO_URL.format(media_id = shortcode_to_media_id("Cpost00")), 500)
+    # and the second post is rejected
+    site.fixtures[MEDIA_INFO_URL.format(media_id = shortcode_to_media_id("Cpost01"))]["items"][0]["caption"] = None
+    checkpoint = Checkpoint(str(tmp_path / "pizza.checkpoint.json"), {}, 10)
+
+    accounts, duration, visited = scrape(
+        site, checkpoint = checkpoint, pipeline_workers = pipeline_workers,
+        post_filter = PostFilter("pizza")
+    )
+
+    assert sorted(accounts) == ["shop2", "shop3", "shop4"]
+    # a resume visits the timed-out post again, not the rejected one
+    assert checkpoint.visited == {"Cpost01", "Cpost02", "Cpost03", "Cpost04"}
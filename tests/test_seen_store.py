@@ -0,0 +1,51 @@
+import time
+from seen_store import BloomFilter, SeenStore
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    items = [f"post\0{i}\0sig" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"in-{i}")
+    false_positives = sum(f"out-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_seen_store_keys_by_kind_and_signature(tmp_path):
+    store = SeenStore(str(tmp_path / "seen.sqlite3"))
+    store.add("post", "Cabc", "sig1", "hashtag_misses")
+    store.add("user", 42, "sig1", "non_business_accounts")
+
+    assert store.get("post", "Cabc", "sig1") == "hashtag_misses"
+    assert store.get("user", "42", "sig1") == "non_business_accounts"
+    assert store.get("post", "Cabc", "sig2") is None
+    assert store.get("user", "Cabc", "sig1") is None
+    store.close()
+
+def test_seen_store_persists_across_runs(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    store = SeenStore(path)
+    store.add("post", "Cabc", "sig", "hashtag_misses")
+    store.close()
+
+    store = SeenStore(path)
+    assert store.get("post", "Cabc", "sig") == "hashtag_misses"
+    store.close()
+
+def test_seen_store_expires_entries(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    store = SeenStore(path, ttl = 0.05)
+    store.add("post", "Cabc", "sig", "hashtag_misses")
+    time.sleep(0.1)
+    assert store.get("post", "Cabc", "sig") is None
+    store.close()
+
+    # expired entries are evicted when the store is opened again
+    store = SeenStore(path, ttl = 0.05)
+    count = store._connection.execute("SELECT COUNT(*) FROM rejections").fetchone()
+    assert count == (0,)
+    store.close()
@@ -0,0 +1,134 @@
+import json
+import time
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+from urllib.request import Request, urlopen
+import pytest
+import service
+from service import Job, ScraperService, ServiceHandler
+from recycle import RecyclingDriver
+from capture import apply_lean_capture
+from fakes import StandInSite, FakeDriver
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # the user cache and the data files are created in the working directory
+    monkeypatch.chdir(tmp_path)
+    site = StandInSite(page_size = 2)
+    for number in range(6):
+        site.add_post(f"Cpost{number:02d}", f"shop{number % 3}")
+    site.start()
+    yield site
+    site.stop()
+
+def wait_finished(job, timeout = 30):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job.finished
+
+def test_service_streams_a_job_through_a_fake_browser(site):
+    drivers = []
+
+    def driver_factory():
+        drivers.append(FakeDriver(site))
+        apply_lean_capture(drivers[-1])
+        return drivers[-1]
+
+    scraper = ScraperService(driver_factory, size = 1).start()
+    try:
+        job = scraper.submit({"hashtag": "pizza", "num_accounts": 3})
+        wait_finished(job)
+    finally:
+        scraper.close()
+
+    status = job.to_dict()
+    assert status["status"] == "done", status["error"]
+    assert status["accounts"] == 3
+    assert status["posts"] == 3
+    assert [event["event"] for event in job.events][0] == "started"
+    # the posts were visited in a second tab, closed with the job
+    assert drivers[0].opened == 1
+    assert list(drivers[0].windows) == ["tab-0"]
+    assert drivers[0].quit_called
+    # and the lean capture's blocking was set in both tabs
+    assert ("tab-1", "Network.setBlockedURLs") in drivers[0].cdp
+
+def test_recycled_browsers_are_only_replaced_between_jobs(site):
+    factory = partial(RecyclingDriver, lambda: FakeDriver(site), 2, 0)
+    scraper = ScraperService(factory, size = 1)
+    scraper.pool.start()
+    driver = scraper.pool.drivers[0]
+    scraper.start()
+    try:
+        first = scraper.submit({"hashtag": "pizza", "num_accounts": 3})
+        wait_finished(first)
+        assert driver.recycles == 0
+        second = scraper.submit({"hashtag": "pizza", "num_accounts": 3})
+        wait_finished(second)
+    finally:
+        scraper.close()
+
+    # a recycle in the middle of a job would have closed its grid tab
+    assert first.status == "done", first.error
+    assert second.status == "done", second.error
+    assert driver.recycles == 1
+    # the capture moved to the new browser
+    assert second.to_dict()["posts"] == 3
+
+def test_job_events_are_capped(monkeypatch):
+    monkeypatch.setattr(service, "SERVICE_JOB_EVENTS", 3)
+    job = Job("1", {"hashtag": "pizza", "num_accounts": 5})
+    job.start()
+    for number in range(5):
+        job.publish({"event": "post", "username": f"shop{number}"})
+
+    first, events = job.wait_events(0, timeout = 0)
+    assert first == 3
+    assert [event["username"] for event in events] == ["shop2", "shop3", "shop4"]
+    assert job.wait_events(6, timeout = 0) == (6, [])
+    assert job.to_dict()["posts"] == 5
+    assert job.to_dict()["accounts"] == 5
+
+def test_finished_jobs_are_pruned(site, monkeypatch):
+    monkeypatch.setattr(service, "SERVICE_FINISHED_JOBS", 2)
+    scraper = ScraperService(lambda: FakeDriver(site), size = 0)
+    for _ in range(4):
+        job = scraper.submit({"hashtag": "pizza", "num_accounts": 1})
+        assert scraper.cancel(job.id)
+    queued = scraper.submit({"hashtag": "pizza", "num_accounts": 1})
+
+    assert list(scraper.jobs) == ["3", "4", queued.id]
+    assert scraper.status()["jobs"] == {"cancelled": 4, "queued": 1}
+
+def test_events_endpoint_streams_until_the_job_is_finished(site):
+    release = threading.Event()
+
+    def run_job(driver, capture, job, sinks):
+        release.wait(10)
+        return {"output": "stub"}
+
+    scraper = ScraperService(lambda: FakeDriver(site), size = 1, run_job = run_job).start()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ServiceHandler)
+    server.daemon_threads = True
+    server.service = scraper
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        request = Request(
+            f"{url}/jobs", data = json.dumps({"hashtag": "pizza", "num_accounts": 1}).encode("utf-8"),
+            method = "POST"
+        )
+        with urlopen(request) as response:
+            job_id = json.loads(response.read())["id"]
+        release.set()
+        with urlopen(f"{url}/jobs/{job_id}/events") as response:
+            events = [json.loads(line) for line in response]
+    finally:
+        server.shutdown()
+        server.server_close()
+        scraper.close()
+
+    assert [event["event"] for event in events] == ["started", "done"]
+    assert events[-1]["output"] == "stub"
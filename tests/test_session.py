@@ -0,0 +1,55 @@
+import os
+import stat
+import pytest
+from session import save_session, load_session
+from constants import SESSION_CHECK_URL
+from fakes import StandInSite, FakeDriver
+
+COOKIES = [
+    {"name": "sessionid", "value": "secret", "domain": ".instagram.com", "expiry": 1.9e9},
+    {"name": "csrftoken", "value": "token", "domain": ".instagram.com"},
+]
+
+@pytest.fixture
+def site():
+    site = StandInSite()
+    site.start()
+    yield site
+    site.stop()
+
+def saved_session(site, path):
+    driver = FakeDriver(site)
+    for cookie in COOKIES:
+        driver.add_cookie(cookie)
+    save_session(driver, path)
+
+@pytest.mark.skipif(os.name != "posix", reason = "POSIX permissions")
+def test_session_file_is_private(site, tmp_path):
+    path = tmp_path / "session.json"
+    path.write_text("[]")
+    path.chmod(0o644)
+    saved_session(site, str(path))
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+def test_restored_session_is_checked_by_the_site(site, tmp_path):
+    path = str(tmp_path / "session.json")
+    saved_session(site, path)
+    site.fixtures[SESSION_CHECK_URL] = {"form_data": {"username": "me"}}
+
+    driver = FakeDriver(site)
+    assert load_session(driver, path)
+    assert driver.get_cookie("sessionid")["value"] == "secret"
+    assert driver.get_cookie("sessionid")["expiry"] == 1900000000
+    assert SESSION_CHECK_URL in site.hits
+
+def test_rejected_session_is_cleared(site, tmp_path):
+    path = str(tmp_path / "session.json")
+    saved_session(site, path)
+    site.queue(SESSION_CHECK_URL, 401, {"message": "login_required"})
+
+    driver = FakeDriver(site)
+    assert not load_session(driver, path)
+    assert driver.get_cookies() == []
+
+def test_missing_session_file(site, tmp_path):
+    assert not load_session(FakeDriver(site), str(tmp_path / "session.json"))
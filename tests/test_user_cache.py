@@ -0,0 +1,54 @@
+import time
+from user_cache import UserCache
+from fakes import user_info
+
+def test_put_and_get_keeps_read_fields():
+    cache = UserCache(":memory:")
+    user = user_info("shop", 7)
+    user["user"]["profile_pic_url"] = "https://example.com/pic.jpg"
+    cache.put(user)
+
+    assert cache.get("shop") == {
+        "user": {
+            "pk": "7",
+            "username": "shop",
+            "is_business": True,
+            "category": "Restaurant",
+            "follower_count": 1200,
+        }
+    }
+    assert cache.get("unknown") is None
+    assert cache.get("") is None
+
+def test_lru_is_bounded_and_backed_by_the_database(tmp_path):
+    path = str(tmp_path / "users.sqlite3")
+    cache = UserCache(path, lru_size = 2)
+    for number in range(3):
+        cache.put(user_info(f"shop{number}", number))
+
+    assert list(cache._lru) == ["shop1", "shop2"]
+    # the evicted entry is read back from SQLite and becomes the newest
+    assert cache.get("shop0")["user"]["pk"] == "0"
+    assert list(cache._lru) == ["shop2", "shop0"]
+    cache.close()
+
+    # and the entries outlive the run
+    reopened = UserCache(path)
+    assert reopened.get("shop1")["user"]["is_business"] is True
+    reopened.close()
+
+def test_expired_entries_are_missing_and_evicted(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.sqlite3")
+    cache = UserCache(path, ttl = 60)
+    cache.put(user_info("shop", 7))
+    cache.put(user_info("other", 8))
+
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get("shop") is None
+    assert "shop" not in cache._lru
+
+    cache.evict_expired()
+    count = cache._connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    assert count == 0
+    cache.close()
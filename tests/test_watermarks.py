@@ -0,0 +1,47 @@
+import json
+from watermarks import Watermark
+
+def watermark(tmp_path, refresh_days = 0):
+    return Watermark("food", refresh_days, path = str(tmp_path / "watermarks.json"))
+
+def test_first_crawl_has_no_mark(tmp_path):
+    mark = watermark(tmp_path)
+    assert mark.taken_at is None
+    assert mark.since() is None
+
+def test_advance_to_newest_when_everything_processed(tmp_path):
+    mark = watermark(tmp_path)
+    dates = {"a": 100, "b": 200, "c": 300}
+    assert mark.advance(dates, {"a", "b", "c"})
+    assert (mark.taken_at, mark.shortcode) == (300, "c")
+
+def test_advance_stops_below_oldest_pending_post(tmp_path):
+    mark = watermark(tmp_path)
+    dates = {"a": 100, "b": 200, "c": 300, "d": 400}
+    assert mark.advance(dates, {"a", "b", "d"})
+    assert (mark.taken_at, mark.shortcode) == (200, "b")
+
+def test_advance_does_not_move_when_oldest_post_pending(tmp_path):
+    mark = watermark(tmp_path)
+    assert not mark.advance({"a": 100, "b": 200}, {"b"})
+    assert mark.taken_at is None
+    assert not (tmp_path / "watermarks.json").exists()
+
+def test_advance_ignores_posts_below_the_mark(tmp_path):
+    mark = watermark(tmp_path)
+    mark.advance({"a": 100, "b": 200}, {"a", "b"})
+    # refreshed posts before the mark don't hold it back
+    dates = {"a": 100, "b": 200, "c": 300}
+    assert mark.advance(dates, {"c"})
+    assert mark.taken_at == 300
+
+def test_mark_is_saved_and_loaded_per_hashtag(tmp_path):
+    path = str(tmp_path / "watermarks.json")
+    Watermark("food", path = path).advance({"a": 100}, {"a"})
+    Watermark("pizza", path = path).advance({"z": 500}, {"z"})
+
+    with open(path, encoding = "utf-8") as file:
+        assert set(json.load(file)) == {"food", "pizza"}
+    mark = Watermark("food", refresh_days = 1, path = path)
+    assert (mark.taken_at, mark.shortcode) == (100, "a")
+    assert mark.since() == 100 - 24 * 60 * 60
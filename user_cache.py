@@ -0,0 +1,134 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from constants import *
+
+class UserCache:
+    '''
+    Persistent cache of user info payloads with an in-memory LRU in front.
+
+    Only the fields the parser relies on are kept: user id, username,
+    is_business, category and follower_count, together with the time
+    they were fetched. Entries older than the TTL are treated as missing
+    and evicted.
+
+    Args:
+        path (str): Path to the SQLite database file. Use ":memory:"
+                    to keep the cache for the current run only.
+        ttl (float): Number of seconds an entry stays valid.
+        lru_size (int): Number of entries kept in memory.
+    '''
+    FIELDS = ("pk", "username", "is_business", "category", "follower_count")
+
+    def __init__(self, path = USER_CACHE_PATH, ttl = USER_CACHE_TTL, lru_size = USER_CACHE_LRU_SIZE):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " username TEXT PRIMARY KEY,"
+            " pk TEXT,"
+            " is_business INTEGER,"
+            " category TEXT,"
+            " follower_count INTEGER,"
+            " fetched_at REAL)"
+        )
+        self._connection.commit()
+        self.evict_expired()
+
+    def _remember(self, username, entry):
+        self._lru[username] = entry
+        self._lru.move_to_end(username)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last = False)
+
+    def _is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def get(self, username):
+        '''
+        Look up a user by username.
+        Args:
+            username (str): The username of the account.
+        Returns:
+            dict: A user info dictionary shaped like the API response
+                  ({"user": {...}}), or None if unknown or expired.
+        '''
+        if not username:
+            return None
+
+        with self._lock:
+            entry = self._lru.get(username)
+            if entry is None:
+                row = self._connection.execute(
+                    "SELECT pk, username, is_business, category,"
+                    " follower_count, fetched_at"
+                    " FROM users WHERE username = ?",
+                    (username,)
+                ).fetchone()
+                if row is None:
+                    return None
+                entry = dict(zip(self.FIELDS + ("fetched_at",), row))
+                entry["is_business"] = bool(entry["is_business"])
+
+            if not self._is_fresh(entry):
+                self._lru.pop(username, None)
+                self._connection.execute(
+                    "DELETE FROM users WHERE username = ?", (username,)
+                )
+                self._connection.commit()
+                return None
+
+            self._remember(username, entry)
+
+        return {"user": {field: entry[field] for field in self.FIELDS}}
+
+    def put(self, user_dict):
+        '''
+        Store the relevant fields of a user info response.
+        Args:
+            user_dict (dict): The user info response ({"user": {...}}).
+        '''
+        user = user_dict["user"]
+        entry = {field: user.get(field) for field in self.FIELDS}
+        entry["pk"] = str(entry["pk"])
+        entry["fetched_at"] = time.time()
+
+        with self._lock:
+            self._remember(entry["username"], entry)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO users"
+                " (username, pk, is_business, category,"
+                " follower_count, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry["username"],
+                    entry["pk"],
+                    int(bool(entry["is_business"])),
+                    entry["category"],
+                    entry["follower_count"],
+                    entry["fetched_at"]
+                )
+            )
+            self._connection.commit()
+
+    def evict_expired(self):
+        '''
+        Remove every entry older than the TTL from the database.
+        '''
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM users WHERE fetched_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self._connection.commit()
+
+    def close(self):
+        '''
+        Close the underlying database connection.
+        '''
+        with self._lock:
+            self._connection.close()
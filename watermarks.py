@@ -0,0 +1,95 @@
+import os
+import json
+from parser import format_date_of_pub
+from constants import *
+
+class Watermark:
+    '''
+    High-water mark of the incremental crawls of a hashtag: the newest
+    post up to which every post of the hashtag's grid was processed.
+    Incremental crawls only visit the posts taken after it, plus the
+    ones of the refresh window before it, whose likes and comments
+    are fetched again.
+
+    The marks of every hashtag are kept in one JSON file.
+
+    Args:
+        hashtag (str): The main hashtag.
+        refresh_days (float): Number of days before the mark whose posts
+                              are visited again.
+        path (str): Path of the watermarks file.
+    '''
+    def __init__(self, hashtag, refresh_days = 0, path = WATERMARKS_PATH):
+        self.hashtag = hashtag
+        self.refresh_days = refresh_days
+        self.path = path
+        self.taken_at = None
+        self.shortcode = None
+
+        mark = self._load().get(hashtag)
+        if mark is not None:
+            self.taken_at = mark["taken_at"]
+            self.shortcode = mark["shortcode"]
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding = "utf-8") as file:
+            return json.load(file)
+
+    def since(self):
+        '''
+        Get the date of the oldest posts to visit.
+        Returns:
+            int: Unix timestamp, or None to visit every post.
+        '''
+        if self.taken_at is None:
+            return None
+        return self.taken_at - int(self.refresh_days * 24 * 60 * 60)
+
+    def advance(self, dates, processed):
+        '''
+        Move the mark to the newest processed post below which every
+        post newer than the current mark was processed, and save it.
+        Posts that weren't to be visited, e.g. past the harvest limit,
+        are left behind like by a full crawl.
+        Args:
+            dates (dict): The taken_at of the posts to visit by shortcode.
+            processed (set): The shortcodes of the processed posts.
+        Returns:
+            bool: True if the mark moved.
+        '''
+        floor = self.taken_at if self.taken_at is not None else float("-inf")
+        pending = [
+            taken_at for shortcode, taken_at in dates.items()
+            if taken_at > floor and shortcode not in processed
+        ]
+        ceiling = min(pending, default = float("inf"))
+        covered = [
+            (taken_at, shortcode) for shortcode, taken_at in dates.items()
+            if floor < taken_at < ceiling and shortcode in processed
+        ]
+        if not covered:
+            return False
+
+        self.taken_at, self.shortcode = max(covered)
+        self.save()
+        return True
+
+    def save(self):
+        '''
+        Write the mark to the watermarks file, atomically, keeping the
+        marks of the other hashtags.
+        '''
+        marks = self._load()
+        marks[self.hashtag] = {
+            "taken_at": self.taken_at,
+            "date_of_pub": format_date_of_pub(self.taken_at),
+            "shortcode": self.shortcode,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, mode = "w", encoding = "utf-8") as file:
+            json.dump(marks, file, indent = 4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)